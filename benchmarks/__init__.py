@@ -0,0 +1,10 @@
+"""Micro-benchmarks for HAP-python.
+
+The benchmarks are not part of the test suite. Run a single module with, e.g.,
+``python -m benchmarks.bench_iid_manager`` from the repository root, or all of them
+with ``python -m benchmarks``, which can also store the results as a baseline and
+compare later runs with it (see ``benchmarks.__main__``).
+
+``python -m benchmarks.soak`` is a soak test rather than a benchmark: it runs many
+simulated controllers against a local bridge and reports their latencies and failures.
+"""
@@ -0,0 +1,121 @@
+"""Run the benchmarks and compare them with a baseline.
+
+Usage, from the repository root::
+
+    python -m benchmarks                       # run all benchmarks
+    python -m benchmarks bench_tlv bench_requests
+    python -m benchmarks --save benchmarks/baseline.json
+    python -m benchmarks --compare benchmarks/baseline.json
+
+With ``--compare``, every result is shown with its change relative to the baseline
+and the exit status is 1 if a result got worse by more than ``--threshold``. The
+baseline is only meaningful on the machine it was saved on, so save a new one before
+comparing changes on other hardware.
+"""
+import argparse
+import importlib
+import json
+import platform
+import sys
+
+from benchmarks import common
+
+MODULES = (
+    'bench_accessories',
+    'bench_requests',
+    'bench_characteristic',
+    'bench_iid_manager',
+    'bench_events',
+    'bench_event_delivery',
+    'bench_hap_socket',
+    'bench_hap_socket_recv',
+    'bench_tlv',
+    'bench_pairing',
+    'bench_handshake',
+    'bench_memory',
+    'bench_startup',
+)
+DEFAULT_THRESHOLD = 0.2
+
+
+def run(modules):
+    """Run the main function of the given benchmark modules.
+
+    :return: A dict of result name to result, see ``common.record``.
+    :rtype: dict
+    """
+    results = {}
+    for name in modules:
+        print('# {}'.format(name))
+        del common.RESULTS[:]
+        importlib.import_module('benchmarks.' + name).main()
+        for result in common.RESULTS:
+            results['{}: {}'.format(name, result['name'])] = result
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every result relative to the baseline.
+
+    :return: The names of the results that got worse by more than ``threshold``.
+    :rtype: list
+    """
+    regressions = []
+    print()
+    print('{:<70} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current',
+                                              'change'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or base['unit'] != result['unit']:
+            print('{:<70} {:>12} {:>12.4g} {:>8}'.format(name, '-', result['value'],
+                                                         'new'))
+            continue
+        change = result['value'] / base['value'] - 1
+        worse = -change if result['higher_is_better'] else change
+        flag = ''
+        if worse > threshold:
+            regressions.append(name)
+            flag = ' !'
+        print('{:<70} {:>12.4g} {:>12.4g} {:>+7.1%}{}'.format(
+            name, base['value'], result['value'], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', metavar='module',
+                        help='benchmark modules to run, all by default')
+    parser.add_argument('--save', metavar='FILE',
+                        help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative change that counts as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.modules) - set(MODULES)
+    if unknown:
+        parser.error('unknown benchmark modules: ' + ', '.join(sorted(unknown)))
+    results = run(args.modules or MODULES)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, file, indent=2, sort_keys=True)
+            file.write('\n')
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\n{} result(s) regressed by more than {:.0%}.'.format(
+                len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
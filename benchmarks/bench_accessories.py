@@ -0,0 +1,40 @@
+"""Benchmark serializing the accessories of a bridge for GET /accessories."""
+import json
+from unittest.mock import patch
+
+from pyhap.accessory import Accessory, Bridge
+from pyhap.accessory_driver import AccessoryDriver
+
+from benchmarks.common import measure, report
+
+SIZES = (10, 100)
+
+
+def get_driver(size):
+    """Return a driver with a bridge of ``size`` lightbulbs and sensors."""
+    with patch('pyhap.accessory_driver.Zeroconf'), \
+            patch('pyhap.accessory_driver.AccessoryDriver.persist'):
+        driver = AccessoryDriver(address='127.0.0.1')
+        bridge = Bridge(driver, 'Bridge')
+        for i in range(size):
+            acc = Accessory(driver, 'Accessory {}'.format(i))
+            if i % 2:
+                acc.add_preload_service('Lightbulb', chars=['Brightness', 'Hue'])
+            else:
+                acc.add_preload_service('TemperatureSensor')
+            bridge.add_accessory(acc)
+        driver.add_accessory(bridge)
+    return driver
+
+
+def main():
+    for size in SIZES:
+        driver = get_driver(size)
+        report('json.dumps(get_accessories()) {} accessories'.format(size),
+               measure(lambda: json.dumps(driver.get_accessories()).encode()))
+        report('get_accessories_json() {} accessories'.format(size),
+               measure(driver.get_accessories_json))
+
+
+if __name__ == '__main__':
+    main()
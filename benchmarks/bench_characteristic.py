@@ -0,0 +1,33 @@
+"""Benchmark Characteristic.set_value for each kind of validation.
+
+There is no broker, so only the validation and the assignment are measured.
+"""
+from uuid import uuid1
+
+from pyhap.characteristic import (
+    HAP_FORMAT_BOOL, HAP_FORMAT_FLOAT, HAP_FORMAT_STRING, HAP_FORMAT_UINT8,
+    HAP_PERMISSION_READ, Characteristic)
+
+from benchmarks.common import measure, report_rate
+
+PERMISSIONS = [HAP_PERMISSION_READ]
+CASES = (
+    ('bool', {'Format': HAP_FORMAT_BOOL}, 1),
+    ('float with bounds', {'Format': HAP_FORMAT_FLOAT, 'minValue': -100,
+                           'maxValue': 100}, 21.5),
+    ('uint8 with valid values', {'Format': HAP_FORMAT_UINT8,
+                                 'ValidValues': {str(i): i for i in range(10)}}, 9),
+    ('string', {'Format': HAP_FORMAT_STRING}, 'Living room'),
+)
+
+
+def main():
+    for name, properties, value in CASES:
+        properties['Permissions'] = PERMISSIONS
+        char = Characteristic('Bench', uuid1(), properties)
+        seconds = measure(lambda: char.set_value(value))
+        report_rate('set_value ' + name, 1 / seconds)
+
+
+if __name__ == '__main__':
+    main()
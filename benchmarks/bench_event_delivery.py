@@ -0,0 +1,111 @@
+"""Benchmark delivering events to clients connected over loopback TCP.
+
+Every round sets new values on the characteristics of a bridge. The event dispatch
+thread takes the published changes from the event queue and pushes them to the
+AsyncHAPServer, whose event loop writes them to the clients. A round ends when every
+client has read the last change, so the numbers are the end-to-end throughput of the
+event pipeline, without encryption (see bench_hap_socket).
+"""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+from benchmarks.bench_accessories import get_driver
+from benchmarks.bench_events import get_characteristics
+from benchmarks.common import measure, report, report_rate
+
+NUM_ACCESSORIES = 100
+NUM_CLIENTS = 3
+TIMEOUT = 5
+
+
+class EventClient:
+    """Reads the events of a connection and keeps the last value of every topic."""
+
+    def __init__(self, addr):
+        self.sock = socket.create_connection(addr)
+        self.client_addr = self.sock.getsockname()
+        self.values = {}  # (aid, iid): value
+        self.cond = threading.Condition()
+        threading.Thread(target=self.read, daemon=True).start()
+
+    def read(self):
+        """Parse the EVENT messages until the connection is closed."""
+        buffer = b''
+        while True:
+            data = self.sock.recv(64 * 1024)
+            if not data:
+                return
+            buffer += data
+            while True:
+                header_end = buffer.find(b'\r\n\r\n')
+                if header_end == -1:
+                    break
+                # Content-Length is the last header of an event
+                body_start = header_end + 4
+                body_end = body_start + int(buffer[:header_end].rsplit(b': ', 1)[1])
+                if len(buffer) < body_end:
+                    break
+                chars = json.loads(buffer[body_start:body_end])['characteristics']
+                buffer = buffer[body_end:]
+                with self.cond:
+                    for char in chars:
+                        self.values[(char['aid'], char['iid'])] = char['value']
+                    self.cond.notify_all()
+
+    def wait_for(self, topic, value):
+        """Wait until the given value of the topic has been received."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.values.get(topic) == value,
+                                      TIMEOUT):
+                raise TimeoutError('No event for {} = {}'.format(topic, value))
+
+    def close(self):
+        self.sock.close()
+
+
+def main():
+    driver = get_driver(NUM_ACCESSORIES)
+    loop = driver.loop
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = driver.http_server
+    server.addr_port = ('127.0.0.1', 0)
+    asyncio.run_coroutine_threadsafe(server.async_start(loop), loop).result()
+    addr = server.server.sockets[0].getsockname()
+
+    clients = [EventClient(addr) for _ in range(NUM_CLIENTS)]
+    deadline = time.monotonic() + TIMEOUT
+    while len(server.connections) < NUM_CLIENTS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    chars = get_characteristics(driver)
+    topics = [(char.broker.aid, char.broker.iid_manager.get_iid(char)) for char in chars]
+    for client in clients:
+        for topic in topics:
+            driver.subscribe_client_topic(client.client_addr, topic)
+    threading.Thread(target=driver.send_events, daemon=True).start()
+    values = [0]
+
+    def delivery_round():
+        values[0] = (values[0] + 1) % 100
+        for char in chars:
+            char.set_value(values[0])
+        for client in clients:
+            client.wait_for(topics[-1], values[0])
+
+    try:
+        seconds = measure(delivery_round)
+        report('deliver {} changes to {} clients'.format(len(chars), NUM_CLIENTS),
+               seconds)
+        report_rate('event delivery throughput', len(chars) * NUM_CLIENTS / seconds,
+                    'events/s')
+    finally:
+        for client in clients:
+            client.close()
+        asyncio.run_coroutine_threadsafe(server.async_stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark publishing characteristic changes and encoding them as events.
+
+Every round sets new values on the characteristics of a bridge, which publishes
+them, and runs one iteration of the event dispatch loop to encode the events for
+the subscribed clients.
+"""
+from benchmarks.bench_accessories import get_driver
+from benchmarks.common import measure, report, report_rate
+
+NUM_ACCESSORIES = 100
+NUM_CLIENTS = 3
+
+
+class OneIterationLoop:
+    """Stands in for the event loop, so send_events returns after one batch."""
+
+    def __init__(self):
+        self.closed = True
+
+    def is_closed(self):
+        self.closed = not self.closed
+        return self.closed
+
+
+class HAPServerStub:
+    """Discards the pushed events."""
+
+    def push_event(self, bytesdata, client_addr, topics=()):  # pylint: disable=no-self-use,unused-argument
+        return True
+
+
+def get_characteristics(driver):
+    """Return the Brightness and CurrentTemperature characteristics of the bridge."""
+    chars = []
+    for acc in driver.accessory.accessories.values():
+        for service in acc.services:
+            for char in service.characteristics:
+                if char.display_name in ('Brightness', 'CurrentTemperature'):
+                    chars.append(char)
+    return chars
+
+
+def main():
+    driver = get_driver(NUM_ACCESSORIES)
+    driver.loop = OneIterationLoop()
+    driver.http_server = HAPServerStub()
+    chars = get_characteristics(driver)
+    for char in chars:
+        aid = char.broker.aid
+        iid = char.broker.iid_manager.get_iid(char)
+        for client in range(NUM_CLIENTS):
+            driver.subscribe_client_topic(('10.0.0.{}'.format(client), 1234),
+                                          (aid, iid))
+    values = [0]
+
+    def publish_round():
+        values[0] = (values[0] + 1) % 100
+        for char in chars:
+            char.set_value(values[0])
+        driver.send_events()
+
+    seconds = measure(publish_round)
+    report('publish and encode {} changes'.format(len(chars)), seconds)
+    report_rate('publish throughput', len(chars) / seconds, 'publishes/s')
+
+
+if __name__ == '__main__':
+    main()
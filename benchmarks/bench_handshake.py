@@ -0,0 +1,53 @@
+"""Benchmark a full, scripted pair setup and pair verify against the request handler.
+
+A scripted controller runs every step of both handshakes through
+HAPConnectionHandler.handle_request, so the numbers include the TLV coding, the key
+derivations and the ciphers of the handler, but no networking. The controller side
+of each step is included in the measurement too; it does about the same work as the
+accessory side.
+
+Pairing is CPU bound, so run this on the hardware the accessory is deployed on.
+"""
+from unittest.mock import Mock, patch
+
+from pyhap.accessory_driver import AccessoryDriver
+from pyhap.hap_protocol import HAPConnectionHandler
+
+from benchmarks.common import measure, report
+from benchmarks.controller import Controller, run
+
+CLIENT_ADDR = ('127.0.0.1', 55555)
+
+
+def get_request(driver):
+    """Return a function that posts a request to a new connection handler."""
+    handler = HAPConnectionHandler(Mock(), CLIENT_ADDR, driver)
+
+    def request(path, body):
+        response = handler.handle_request(
+            'POST', path, {'Content-Length': str(len(body))}, body)
+        head, _, body = response.partition(b'\r\n\r\n')
+        assert head.startswith(b'HTTP/1.1 200'), head
+        return body
+    return request
+
+
+def main():
+    with patch('pyhap.accessory_driver.Zeroconf'):
+        driver = AccessoryDriver(address='127.0.0.1', pincode=b'123-45-678')
+    controller = Controller()
+
+    def pair_setup():
+        driver.state.paired_clients.clear()
+        run(controller.pair_setup(driver.state.pincode), get_request(driver))
+
+    def pair_verify():
+        run(controller.pair_verify(), get_request(driver))
+
+    with patch.object(driver, 'schedule_persist'):
+        report('pair setup (M1-M6)', measure(pair_setup))
+        report('pair verify (M1-M4)', measure(pair_verify))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Benchmark the encrypted write path of HAPSocket over a socketpair.
+
+A reader thread drains the other end of the pair, so the numbers include the
+encryption, the framing and the syscalls of ``sendall``.
+"""
+import socket
+import threading
+
+from pyhap.hap_server import HAPSocket
+
+from benchmarks.common import measure, report_throughput
+
+PAYLOAD_SIZES = (1024, 64 * 1024, 1024 * 1024)
+SHARED_KEY = b'\x00' * 32
+
+
+def drain(sock):
+    """Read from ``sock`` until the other end is closed."""
+    while sock.recv(1024 * 1024):
+        pass
+
+
+def main():
+    writer, reader = socket.socketpair()
+    drain_thread = threading.Thread(target=drain, args=(reader,), daemon=True)
+    drain_thread.start()
+    hap_socket = HAPSocket(writer, SHARED_KEY)
+
+    try:
+        for size in PAYLOAD_SIZES:
+            payload = b'x' * size
+            report_throughput('HAPSocket.sendall({} bytes)'.format(size),
+                              measure(lambda: hap_socket.sendall(payload)), size)
+    finally:
+        writer.close()
+        drain_thread.join()
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark the encrypted read path of HAPSocket over a socketpair.
+
+A controller writes pipelined PUT /characteristics requests to an encrypted session
+and the accessory side parses them from ``HAPSocket.makefile``, like the
+HAPServerHandler does.
+"""
+import http.client
+import json
+import socket
+import threading
+import time
+
+from pyhap.hap_server import HAPCrypto, HAPSocket
+
+from benchmarks.common import report, report_rate
+
+NUM_REQUESTS = 2000
+SHARED_KEY = b'\x00' * 32
+
+
+def get_requests():
+    """Return ``NUM_REQUESTS`` PUT /characteristics requests, encrypted."""
+    client_crypto = HAPCrypto(SHARED_KEY)
+    # The controller encrypts with the inbound key of the accessory
+    client_crypto._out_cipher = client_crypto._in_cipher  # pylint: disable=protected-access
+    body = json.dumps({'characteristics': [
+        {'aid': 1, 'iid': iid, 'value': 1} for iid in range(9, 15)]}).encode()
+    request = b'PUT /characteristics HTTP/1.1\r\n' \
+        b'Host: accessory\r\n' \
+        b'Content-Type: application/hap+json\r\n' \
+        b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+    return b''.join(client_crypto.encrypt(request) for _ in range(NUM_REQUESTS))
+
+
+def read_requests(rfile):
+    """Parse ``NUM_REQUESTS`` requests from ``rfile``."""
+    for _ in range(NUM_REQUESTS):
+        rfile.readline()
+        headers = http.client.parse_headers(rfile)
+        rfile.read(int(headers['Content-Length']))
+
+
+def measure_requests(data, repeat=5):
+    """Return the best time to read all requests, in seconds."""
+    times = []
+    for _ in range(repeat):
+        writer, reader = socket.socketpair()
+        send_thread = threading.Thread(target=writer.sendall, args=(data,),
+                                       daemon=True)
+        hap_socket = HAPSocket(reader, SHARED_KEY)
+        rfile = hap_socket.makefile('rb')
+        start = time.perf_counter()
+        send_thread.start()
+        read_requests(rfile)
+        times.append(time.perf_counter() - start)
+        send_thread.join()
+        rfile.close()
+        writer.close()
+        reader.close()
+    return min(times)
+
+
+def main():
+    seconds = measure_requests(get_requests())
+    report('PUT /characteristics request', seconds / NUM_REQUESTS)
+    report_rate('PUT /characteristics throughput', NUM_REQUESTS / seconds,
+                'requests/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""Benchmark IIDManager lookups as the number of assigned objects grows.
+
+The lookup cost of ``get_obj`` should stay flat, since it is used for every
+characteristic in GET and PUT /characteristics requests.
+"""
+from pyhap.iid_manager import IIDManager
+
+from benchmarks.common import measure, report
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def get_iid_manager(size):
+    """Return an IIDManager with ``size`` assigned objects."""
+    iid_manager = IIDManager()
+    for _ in range(size):
+        iid_manager.assign(object())
+    return iid_manager
+
+
+def main():
+    for size in SIZES:
+        iid_manager = get_iid_manager(size)
+        first, last = 1, size
+        report('get_obj(first) with {} objects'.format(size),
+               measure(lambda: iid_manager.get_obj(first)))
+        report('get_obj(last) with {} objects'.format(size),
+               measure(lambda: iid_manager.get_obj(last)))
+
+
+if __name__ == '__main__':
+    main()
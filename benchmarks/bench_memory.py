@@ -0,0 +1,72 @@
+"""Measure the memory a large bridge holds, with tracemalloc.
+
+The bridge is built from the accessories of busy_home.py: a lightbulb, a fan with
+optional characteristics, a garage door and a temperature sensor, repeated until the
+bridge holds NUM_ACCESSORIES accessories. The type database is loaded before the
+measurement starts, so only the memory of the accessories themselves is counted.
+"""
+import tracemalloc
+from unittest.mock import patch
+
+from pyhap.accessory import Accessory, Bridge
+from pyhap.accessory_driver import AccessoryDriver
+
+from benchmarks.common import report_size
+
+NUM_ACCESSORIES = 300
+TOP_LINES = 10
+
+
+def add_lightbulb(acc):
+    acc.add_preload_service('Lightbulb').configure_char(
+        'On', setter_callback=print)
+
+
+def add_fan(acc):
+    serv_fan = acc.add_preload_service(
+        'Fan', chars=['RotationSpeed', 'RotationDirection'])
+    serv_fan.configure_char('RotationSpeed', setter_callback=print)
+    serv_fan.configure_char('RotationDirection', setter_callback=print)
+
+
+def add_garage_door(acc):
+    acc.add_preload_service('GarageDoorOpener').configure_char(
+        'TargetDoorState', setter_callback=print)
+
+
+def add_temperature_sensor(acc):
+    acc.add_preload_service('TemperatureSensor').configure_char(
+        'CurrentTemperature')
+
+
+KINDS = (add_lightbulb, add_fan, add_garage_door, add_temperature_sensor)
+
+
+def main():
+    with patch('pyhap.accessory_driver.Zeroconf'):
+        driver = AccessoryDriver(address='127.0.0.1')
+    for add_service in KINDS:  # Load the types before measuring
+        add_service(Accessory(driver, 'Warm up'))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    bridge = Bridge(driver, 'Bridge')
+    for i in range(NUM_ACCESSORIES):
+        acc = Accessory(driver, 'Accessory {}'.format(i))
+        KINDS[i % len(KINDS)](acc)
+        bridge.add_accessory(acc)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'lineno')
+    total = sum(stat.size_diff for stat in stats)
+    num_chars = sum(len(service.characteristics) for acc in bridge.accessories.values()
+                    for service in acc.services)
+    report_size('bridge of {} accessories'.format(NUM_ACCESSORIES), total)
+    report_size('per characteristic ({})'.format(num_chars), total / num_chars)
+    for stat in stats[:TOP_LINES]:
+        print(stat)
+
+
+if __name__ == '__main__':
+    main()
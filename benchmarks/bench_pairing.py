@@ -0,0 +1,66 @@
+"""Benchmark the accessory side of the SRP steps of pair setup.
+
+M1 is the work done for the first pair setup request: creating the SRP verifier and
+encoding the salt and public key B. M3 is the work done for the controller's proof:
+deriving the session key from A and checking the proof M. The controller side is
+computed once, outside of the measurements.
+
+Pairing is CPU bound, so run this on the hardware the accessory is deployed on.
+"""
+import os
+from unittest.mock import patch
+
+from pyhap import hsrp
+from pyhap.accessory_driver import AccessoryDriver
+from pyhap.util import long_to_bytes
+
+from benchmarks.common import measure, report
+
+USERNAME = b'Pair-Setup'
+
+
+def get_client_proof(ctx, pincode, salt, B):
+    """Return the controller's public key A, proof M and session key K for the given
+    challenge."""
+    hashfunc, N, g = ctx['hashfunc'], ctx['N'], ctx['g']
+    a = hsrp.bytes_to_long(os.urandom(32))
+    A = pow(g, a, N)
+    u = int(hashfunc(hsrp.padN(long_to_bytes(A), ctx)
+                     + hsrp.padN(long_to_bytes(B), ctx)).hexdigest(), 16)
+    x = hsrp.get_x(USERNAME, pincode, salt, ctx)
+    S = pow(B - hsrp.get_k(ctx) * pow(g, x, N), a + u * x, N)
+    K = hsrp.get_session_key(S, ctx)
+    hN = hashfunc(long_to_bytes(N)).digest()
+    hG = hashfunc(long_to_bytes(g)).digest()
+    hGroup = bytes(n ^ g for n, g in zip(hN, hG))
+    M = hashfunc(hGroup + hashfunc(USERNAME).digest() + salt + long_to_bytes(A)
+                 + long_to_bytes(B) + long_to_bytes(K)).digest()
+    return long_to_bytes(A), M, K
+
+
+def main():
+    with patch('pyhap.accessory_driver.Zeroconf'):
+        driver = AccessoryDriver(address='127.0.0.1', pincode=b'123-45-678')
+
+    def pairing_m1():
+        driver.setup_srp_verifier()
+        _salt, B = driver.srp_verifier.get_challenge()
+        return long_to_bytes(B)
+
+    report('pair setup M1 (SRP challenge)', measure(pairing_m1))
+
+    verifier = driver.srp_verifier
+    salt, B = verifier.get_challenge()
+    A, M, _K = get_client_proof(verifier.ctx, driver.state.pincode, salt, B)
+
+    def pairing_m3():
+        verifier.set_A(A)
+        assert verifier.verify(M) is not None
+
+    report('pair setup M3 (SRP proof)', measure(pairing_m3))
+    report('long_to_bytes(3072 bit)',
+           measure(lambda: long_to_bytes(verifier.ctx['N'])))
+
+
+if __name__ == '__main__':
+    main()
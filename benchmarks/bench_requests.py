@@ -0,0 +1,77 @@
+"""Benchmark GET and PUT /characteristics requests against the request handler.
+
+The requests go through HAPConnectionHandler.handle_request, so the numbers include
+parsing the request, looking up the characteristics, the service callbacks and
+encoding the response, but no networking or encryption.
+"""
+import json
+from unittest.mock import Mock
+
+from pyhap.hap_protocol import HAPConnectionHandler
+
+from benchmarks.bench_accessories import get_driver
+from benchmarks.common import measure, report
+
+NUM_ACCESSORIES = 100
+SIZES = (1, 10, 100)
+PUT_SIZES = (1, 10, 50)  # Half of the accessories are lightbulbs
+CLIENT_ADDR = ('127.0.0.1', 55555)
+
+
+def get_handler(driver):
+    """Return a handler of an encrypted connection."""
+    handler = HAPConnectionHandler(Mock(), CLIENT_ADDR, driver)
+    handler.is_encrypted = True
+    return handler
+
+
+def get_lightbulbs(driver):
+    """Return the (aid, iid of On, iid of Brightness) of the lightbulbs of the bridge.
+
+    A service callback is set on every lightbulb.
+    """
+    lightbulbs = []
+    for acc in driver.accessory.accessories.values():
+        service = acc.get_service('Lightbulb')
+        if service is None:
+            continue
+        service.setter_callback = lambda values: None
+        lightbulbs.append((acc.aid,
+                           acc.iid_manager.get_iid(service.get_characteristic('On')),
+                           acc.iid_manager.get_iid(
+                               service.get_characteristic('Brightness'))))
+    return lightbulbs
+
+
+def get_char_ids(driver):
+    """Return the "aid.iid" of every characteristic of the bridged accessories."""
+    return ['{}.{}'.format(acc.aid, acc.iid_manager.get_iid(char))
+            for acc in driver.accessory.accessories.values()
+            for service in acc.services
+            for char in service.characteristics]
+
+
+def main():
+    driver = get_driver(NUM_ACCESSORIES)
+    handler = get_handler(driver)
+    char_ids = get_char_ids(driver)
+    for size in SIZES:
+        path = '/characteristics?id=' + ','.join(char_ids[:size])
+        report('GET /characteristics {} ids'.format(size),
+               measure(lambda: handler.handle_request('GET', path, {}, b'')))
+
+    lightbulbs = get_lightbulbs(driver)
+    for size in PUT_SIZES:
+        body = json.dumps({'characteristics': [
+            rep for aid, on_iid, brightness_iid in lightbulbs[:size]
+            for rep in ({'aid': aid, 'iid': on_iid, 'value': True},
+                        {'aid': aid, 'iid': brightness_iid, 'value': 50})
+        ]}).encode()
+        headers = {'Content-Length': str(len(body))}
+        report('PUT /characteristics {} services'.format(size),
+               measure(lambda: handler.handle_request(
+                   'PUT', '/characteristics', headers, body)))
+
+
+if __name__ == '__main__':
+    main()
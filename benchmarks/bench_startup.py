@@ -0,0 +1,47 @@
+"""Benchmark the startup of a bridge process.
+
+Every measurement runs in a fresh interpreter, so nothing is cached between them:
+importing the driver and the accessory classes, then creating the driver and a bridge
+of lightbulbs and sensors (see bench_accessories.get_driver), which loads the type
+database.
+"""
+import subprocess
+import sys
+
+from benchmarks.common import report
+
+SIZES = (1, 100)
+REPEAT = 5
+SCRIPT = '''
+import time
+import unittest.mock
+
+start = time.perf_counter()
+import pyhap.accessory_driver, pyhap.accessory
+imported = time.perf_counter()
+from benchmarks.bench_accessories import get_driver
+get_driver({size})
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def run(size):
+    """Return the best import and bridge creation times in fresh interpreters."""
+    timings = []
+    for _ in range(REPEAT):
+        output = subprocess.check_output(
+            [sys.executable, '-W', 'ignore', '-c', SCRIPT.format(size=size)])
+        timings.append([float(seconds) for seconds in output.split()])
+    return min(t[0] for t in timings), min(t[1] for t in timings)
+
+
+def main():
+    for size in SIZES:
+        import_time, bridge_time = run(size)
+        if size == SIZES[0]:
+            report('import pyhap', import_time)
+        report('first bridge with {} accessories'.format(size), bridge_time)
+
+
+if __name__ == '__main__':
+    main()
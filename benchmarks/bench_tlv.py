@@ -0,0 +1,80 @@
+"""Benchmark encoding and decoding TLV8 messages like those of pairing.
+
+The short message is a pair verify M1: a state and a 32 byte public key. The
+fragmented message is a pair setup M4 response with a 384 byte SRP public key, which
+is split into fragments of 255 bytes, and a 64 byte proof. The large message has a
+16 KiB value, like a certificate chain or a camera configuration.
+
+Every result is also reported for the implementation before the codec used single
+joins, for comparison (see ``legacy_encode`` and ``legacy_decode``).
+"""
+import os
+import struct
+
+from pyhap import tlv
+from pyhap.hap_server import HAP_TLV_TAGS
+
+from benchmarks.common import measure, report
+
+MESSAGES = (
+    ('short', (HAP_TLV_TAGS.SEQUENCE_NUM, b'\x01',
+               HAP_TLV_TAGS.PUBLIC_KEY, os.urandom(32))),
+    ('fragmented', (HAP_TLV_TAGS.SEQUENCE_NUM, b'\x02',
+                    HAP_TLV_TAGS.PUBLIC_KEY, os.urandom(384),
+                    HAP_TLV_TAGS.PASSWORD_PROOF, os.urandom(64))),
+    ('large', (HAP_TLV_TAGS.SEQUENCE_NUM, b'\x02',
+               HAP_TLV_TAGS.ENCRYPTED_DATA, os.urandom(16 * 1024))),
+)
+
+
+def legacy_encode(*args):
+    """tlv.encode as it was, which concatenated the fragments one at a time."""
+    pieces = []
+    for x in range(0, len(args), 2):
+        tag = args[x]
+        data = args[x + 1]
+        total_length = len(data)
+        if len(data) <= 255:
+            encoded = tag + struct.pack("B", total_length) + data
+        else:
+            encoded = b""
+            for y in range(0, total_length // 255):
+                encoded = encoded + tag + b'\xFF' + data[y * 255: (y + 1) * 255]
+            remaining = total_length % 255
+            encoded = encoded + tag + struct.pack("B", remaining) \
+                + data[-remaining:]
+        pieces.append(encoded)
+    return b"".join(pieces)
+
+
+def legacy_decode(data):
+    """tlv.decode as it was, which concatenated the fragments one at a time."""
+    objects = {}
+    current = 0
+    while current < len(data):
+        tag = data[current: current + 1]
+        length = data[current + 1]
+        value = data[current + 2: current + 2 + length]
+        if tag in objects:
+            objects[tag] = objects[tag] + value
+        else:
+            objects[tag] = value
+        current = current + 2 + length
+    return objects
+
+
+def main():
+    for name, args in MESSAGES:
+        data = tlv.encode(*args)
+        assert tlv.decode(data) == legacy_decode(data)
+        size = '{} ({} bytes)'.format(name, len(data))
+        report('tlv.encode ' + size, measure(lambda: tlv.encode(*args)))
+        report('legacy encode ' + size, measure(lambda: legacy_encode(*args)))
+        report('tlv.decode ' + size, measure(lambda: tlv.decode(data)))
+        report('legacy decode ' + size, measure(lambda: legacy_decode(data)))
+        report('tlv.iter_items ' + size,
+               measure(lambda: list(tlv.iter_items(data))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Helpers shared by the benchmark modules.
+
+Every ``report`` function prints a result and records it in ``RESULTS``, so the
+runner in ``benchmarks.__main__`` can store and compare them.
+"""
+import timeit
+
+RESULTS = []
+"""The results reported since the runner started the current module."""
+
+
+def measure(func, repeat=5):
+    """Return the best time per call of ``func``, in seconds.
+
+    The number of calls per run is chosen by ``timeit`` so that a run takes at least
+    0.2 seconds; the fastest of ``repeat`` runs is reported.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def record(name, value, unit, higher_is_better):
+    """Record a result without printing it."""
+    RESULTS.append({'name': name, 'value': value, 'unit': unit,
+                    'higher_is_better': higher_is_better})
+
+
+def report(name, seconds):
+    """Print the time per call of a benchmark in a human readable unit."""
+    record(name, seconds, 's', False)
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6), ('ns', 1e9)):
+        if seconds * scale >= 1:
+            break
+    print('{:<50} {:>10.2f} {}'.format(name, seconds * scale, unit))
+
+
+def report_rate(name, rate, unit='calls/s'):
+    """Print the number of operations per second of a benchmark."""
+    record(name, rate, unit, True)
+    print('{:<50} {:>10.0f} {}'.format(name, rate, unit))
+
+
+def report_throughput(name, seconds, nbytes):
+    """Print the throughput of a benchmark that handles ``nbytes`` per call."""
+    megabytes = nbytes / seconds / 1e6
+    record(name, megabytes, 'MB/s', True)
+    print('{:<50} {:>10.2f} MB/s'.format(name, megabytes))
+
+
+def report_size(name, nbytes):
+    """Print the memory used by a benchmark."""
+    record(name, nbytes, 'B', False)
+    if nbytes >= 1024:
+        print('{:<50} {:>10.1f} KiB'.format(name, nbytes / 1024))
+    else:
+        print('{:<50} {:>10.0f} B'.format(name, nbytes))
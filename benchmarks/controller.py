@@ -0,0 +1,137 @@
+"""The controller side of pair setup, pair verify and adding pairings.
+
+The handshakes are generators that yield the ``(path, body)`` of every request and are
+sent the decoded TLV response, so the same steps run against the request handler (see
+``run`` and bench_handshake) or over the network (see soak).
+"""
+import hashlib
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+import curve25519
+import ed25519
+
+from pyhap import hsrp, tlv
+from pyhap.hap_server import HAP_TLV_TAGS, HAPCrypto, HAPServerHandler, hap_hkdf
+from pyhap.params import get_srp_context
+from pyhap.util import long_to_bytes
+
+from benchmarks.bench_pairing import get_client_proof
+
+H = HAPServerHandler
+SRP_CONTEXT = get_srp_context(3072, hashlib.sha512, 16)
+ADD_PAIRING = b'\x03'
+
+
+class HandshakeError(Exception):
+    """The accessory answered a handshake step with an error."""
+
+
+class ControllerCrypto(HAPCrypto):
+    """The HAP "TLS" framing of the controller, which reads with the write key of the
+    accessory and the other way around."""
+
+    OUT_CIPHER_INFO = HAPCrypto.IN_CIPHER_INFO
+    IN_CIPHER_INFO = HAPCrypto.OUT_CIPHER_INFO
+
+
+def _check(response, sequence):
+    """Raise HandshakeError unless the response is the given step of a handshake."""
+    if HAP_TLV_TAGS.ERROR_CODE in response:
+        raise HandshakeError('Error {!r} in step {!r}'.format(
+            bytes(response[HAP_TLV_TAGS.ERROR_CODE]), sequence))
+    if bytes(response.get(HAP_TLV_TAGS.SEQUENCE_NUM, b'')) != sequence:
+        raise HandshakeError('Expected step {!r}'.format(sequence))
+
+
+class Controller:
+    """A controller with its own long term key pair."""
+
+    def __init__(self):
+        self.username = str(uuid.uuid4()).encode()
+        self.signing_key, verifying_key = ed25519.create_keypair()
+        self.ltpk = verifying_key.to_bytes()
+
+    def pair_setup(self, pincode):
+        """Pair with an unpaired accessory (M1-M6)."""
+        response = yield '/pair-setup', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x01', HAP_TLV_TAGS.REQUEST_TYPE, b'\x00')
+        _check(response, b'\x02')
+        salt = bytes(response[HAP_TLV_TAGS.SALT])
+        B = hsrp.bytes_to_long(bytes(response[HAP_TLV_TAGS.PUBLIC_KEY]))
+        A, M, K = get_client_proof(SRP_CONTEXT, pincode, salt, B)
+
+        response = yield '/pair-setup', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x03',
+            HAP_TLV_TAGS.PUBLIC_KEY, A,
+            HAP_TLV_TAGS.PASSWORD_PROOF, M)
+        _check(response, b'\x04')
+
+        session_key = long_to_bytes(K)
+        enc_key = hap_hkdf(session_key, H.PAIRING_3_SALT, H.PAIRING_3_INFO)
+        controller_x = hap_hkdf(session_key, H.PAIRING_4_SALT, H.PAIRING_4_INFO)
+        proof = self.signing_key.sign(controller_x + self.username + self.ltpk)
+        message = tlv.encode(HAP_TLV_TAGS.USERNAME, self.username,
+                             HAP_TLV_TAGS.PUBLIC_KEY, self.ltpk,
+                             HAP_TLV_TAGS.PROOF, proof)
+        cipher = ChaCha20Poly1305(enc_key)
+        response = yield '/pair-setup', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x05',
+            HAP_TLV_TAGS.ENCRYPTED_DATA,
+            cipher.encrypt(H.PAIRING_3_NONCE, message, b''))
+        _check(response, b'\x06')
+        cipher.decrypt(H.PAIRING_5_NONCE,
+                       bytes(response[HAP_TLV_TAGS.ENCRYPTED_DATA]), b'')
+
+    def pair_verify(self):
+        """Negotiate a session with the accessory (M1-M4) and return its shared key."""
+        private_key = curve25519.Private()
+        public_key = private_key.get_public().serialize()
+        response = yield '/pair-verify', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x01', HAP_TLV_TAGS.PUBLIC_KEY, public_key)
+        _check(response, b'\x02')
+
+        accessory_public = bytes(response[HAP_TLV_TAGS.PUBLIC_KEY])
+        shared_key = private_key.get_shared_key(
+            curve25519.Public(accessory_public), lambda x: x)
+        cipher = ChaCha20Poly1305(
+            hap_hkdf(shared_key, H.PVERIFY_1_SALT, H.PVERIFY_1_INFO))
+        cipher.decrypt(H.PVERIFY_1_NONCE,
+                       bytes(response[HAP_TLV_TAGS.ENCRYPTED_DATA]), b'')
+
+        proof = self.signing_key.sign(public_key + self.username + accessory_public)
+        message = tlv.encode(HAP_TLV_TAGS.USERNAME, self.username,
+                             HAP_TLV_TAGS.PROOF, proof)
+        response = yield '/pair-verify', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x03',
+            HAP_TLV_TAGS.ENCRYPTED_DATA,
+            cipher.encrypt(H.PVERIFY_2_NONCE, message, b''))
+        _check(response, b'\x04')
+        return shared_key
+
+    def add_pairing(self, other):
+        """Pair another controller, from an encrypted session of this one."""
+        response = yield '/pairings', tlv.encode(
+            HAP_TLV_TAGS.SEQUENCE_NUM, b'\x01',
+            HAP_TLV_TAGS.REQUEST_TYPE, ADD_PAIRING,
+            HAP_TLV_TAGS.USERNAME, other.username,
+            HAP_TLV_TAGS.PUBLIC_KEY, other.ltpk)
+        _check(response, b'\x02')
+
+
+def run(handshake, request):
+    """Run a handshake synchronously.
+
+    :param request: A function that sends the ``(path, body)`` of a request and
+        returns the body of the response.
+    :type request: callable
+
+    :return: The result of the handshake.
+    """
+    response = None
+    try:
+        while True:
+            path, body = handshake.send(response)
+            response = tlv.decode(request(path, body))
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,334 @@
+"""Soak test a bridge with many simulated HomeKit controllers.
+
+Usage, from the repository root::
+
+    python -m benchmarks.soak --controllers 200 --duration 60
+
+A bridge of lightbulbs and temperature sensors (see bench_accessories.get_driver) is
+served by a local AccessoryDriver on a loopback port. An admin controller pairs with
+it and adds a pairing for every simulated controller. Each controller then connects,
+pair verifies, subscribes to the temperatures with ``PUT /characteristics`` and polls
+``GET /characteristics`` over its encrypted session until the test ends. Meanwhile
+the temperatures change every ``--event-interval`` seconds.
+
+The report has the latency percentiles of every kind of request, the lag from a
+temperature change to its event at the controllers, and the failures. The controllers
+run on an event loop in the same process as the driver, so on a loaded machine the
+latencies include some time the controllers waited for the CPU themselves; use
+``--ramp`` to spread the pair verifies of the controllers.
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+import json
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+from pyhap import tlv
+from pyhap.hap_server import HAPServerHandler
+
+from benchmarks.bench_accessories import get_driver
+from benchmarks.controller import Controller, ControllerCrypto, HandshakeError
+
+PERCENTILES = (50, 90, 99)
+
+
+class Stats:
+    """The latencies, event lags and failures of all controllers."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # kind: [seconds]
+        self.failures = Counter()  # kind: count
+        self.lags = []  # seconds
+        self.changed = {}  # ((aid, iid), value): time of the change
+        self.unmatched_events = 0
+
+    def event_received(self, body):
+        """Record the lag of every change in the body of an EVENT message."""
+        now = time.monotonic()
+        for char in json.loads(body.decode())['characteristics']:
+            changed = self.changed.get(((char['aid'], char['iid']), char['value']))
+            if changed is None:
+                self.unmatched_events += 1
+            else:
+                self.lags.append(now - changed)
+
+
+def percentiles(values):
+    """Return the PERCENTILES and the maximum of the values, by nearest rank."""
+    values = sorted(values)
+    return [values[min(len(values) - 1, len(values) * p // 100)]
+            for p in PERCENTILES] + [values[-1]]
+
+
+class HAPClient:
+    """An asyncio HAP connection of a controller, encrypted once ``crypto`` is set.
+
+    Responses are handed to the pending request, one at a time, and the body of every
+    EVENT message to ``on_event``.
+    """
+
+    def __init__(self, on_event, timeout):
+        self.on_event = on_event
+        self.timeout = timeout
+        self.crypto = None
+        self.reader = None
+        self.writer = None
+        self._responses = asyncio.Queue()
+        self._read_task = None
+
+    async def connect(self, addr):
+        self.reader, self.writer = await asyncio.open_connection(*addr)
+        self._read_task = asyncio.ensure_future(self._read())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+    async def _read(self):
+        """Parse the received messages until the connection is closed."""
+        buffer = bytearray()
+        try:
+            while True:
+                data = await self.reader.read(64 * 1024)
+                if not data:
+                    return
+                if self.crypto is None:
+                    buffer += data
+                else:
+                    self.crypto.receive_data(data)
+                    buffer += self.crypto.decrypt()
+                while self._parse_message(buffer):
+                    pass
+        finally:
+            self._responses.put_nowait(None)
+
+    def _parse_message(self, buffer):
+        """Handle the first complete message in the buffer and remove it.
+
+        :return: False if there is no complete message.
+        """
+        header_end = buffer.find(b'\r\n\r\n')
+        if header_end == -1:
+            return False
+        status_line, *header_lines = \
+            bytes(buffer[:header_end]).decode('latin-1').split('\r\n')
+        headers = dict(line.lower().split(': ', 1) for line in header_lines)
+        body_start = header_end + 4
+        body_end = body_start + int(headers.get('content-length', 0))
+        if len(buffer) < body_end:
+            return False
+        body = bytes(buffer[body_start:body_end])
+        del buffer[:body_end]
+        if status_line.startswith('EVENT/'):
+            self.on_event(body)
+        else:
+            self._responses.put_nowait((int(status_line.split()[1]), body))
+        return True
+
+    async def request(self, method, path, body=b'',
+                      content_type=HAPServerHandler.JSON_RESPONSE_TYPE):
+        """Send a request and return the status and the body of the response."""
+        message = '{} {} HTTP/1.1\r\nHost: bridge\r\nContent-Type: {}\r\n' \
+                  'Content-Length: {}\r\n\r\n'.format(
+                      method, path, content_type, len(body)).encode() + body
+        if self.crypto is not None:
+            message = self.crypto.encrypt(message)
+        self.writer.write(message)
+        response = await asyncio.wait_for(self._responses.get(), self.timeout)
+        if response is None:
+            raise ConnectionError('Connection closed')
+        return response
+
+    async def handshake(self, steps):
+        """Run the steps of a handshake (see benchmarks.controller) and return its
+        result."""
+        response = None
+        try:
+            while True:
+                path, body = steps.send(response)
+                status, body = await self.request(
+                    'POST', path, body, HAPServerHandler.PAIRING_RESPONSE_TYPE)
+                if status != 200:
+                    raise HandshakeError('Status {} for {}'.format(status, path))
+                response = tlv.decode(body)
+        except StopIteration as stop:
+            return stop.value
+
+
+class Soak:
+    """Runs the controllers against the bridge and collects their Stats."""
+
+    def __init__(self, driver, addr, args):
+        self.driver = driver
+        self.addr = addr
+        self.args = args
+        self.stats = Stats()
+        self.temperatures = []  # (topic, characteristic)
+        for acc in driver.accessory.accessories.values():
+            service = acc.get_service('TemperatureSensor')
+            if service is not None:
+                char = service.get_characteristic('CurrentTemperature')
+                self.temperatures.append(
+                    ((acc.aid, acc.iid_manager.get_iid(char)), char))
+        self.poll_path = '/characteristics?id=' + ','.join(
+            '{}.{}'.format(*topic) for topic, _ in self.temperatures)
+        self.subscribe_body = json.dumps({'characteristics': [
+            {'aid': aid, 'iid': iid, 'ev': True}
+            for (aid, iid), _ in self.temperatures]}).encode()
+
+    async def timed(self, kind, coro):
+        """Await the coroutine and record its latency, or its failure."""
+        start = time.monotonic()
+        try:
+            result = await coro
+        except Exception:  # pylint: disable=broad-except
+            self.stats.failures[kind] += 1
+            raise
+        self.stats.latencies[kind].append(time.monotonic() - start)
+        return result
+
+    async def connect(self, controller):
+        """Return a client with a verified session of the controller."""
+        client = HAPClient(self.stats.event_received, self.args.timeout)
+        await self.timed('connect', client.connect(self.addr))
+        shared_key = await self.timed('pair-verify',
+                                      client.handshake(controller.pair_verify()))
+        client.crypto = ControllerCrypto(shared_key)
+        return client
+
+    async def pair(self, controllers):
+        """Pair an admin controller and let it add the other controllers."""
+        admin = Controller()
+        client = HAPClient(self.stats.event_received, self.args.timeout)
+        await client.connect(self.addr)
+        await self.timed('pair-setup', client.handshake(
+            admin.pair_setup(self.driver.state.pincode)))
+        client.close()
+
+        client = await self.connect(admin)
+        for controller in controllers:
+            await self.timed('add-pairing', client.handshake(
+                admin.add_pairing(controller)))
+        client.close()
+
+    async def run_controller(self, index, controller, deadline):
+        """Verify, subscribe and poll until the deadline."""
+        await asyncio.sleep(self.args.ramp * index / self.args.controllers)
+        client = None
+        try:
+            client = await self.connect(controller)
+            status, _ = await self.timed('subscribe', client.request(
+                'PUT', '/characteristics', self.subscribe_body))
+            if status != 204:
+                self.stats.failures['subscribe status {}'.format(status)] += 1
+            while time.monotonic() < deadline:
+                status, _ = await self.timed('get', client.request('GET', self.poll_path))
+                if status != 207:
+                    self.stats.failures['get status {}'.format(status)] += 1
+                await asyncio.sleep(self.args.poll_interval)
+        except Exception:  # pylint: disable=broad-except
+            self.stats.failures['disconnected'] += 1
+        finally:
+            if client is not None:
+                client.close()
+
+    def change_temperatures(self, stop_event):
+        """Change every temperature each event interval, remembering when."""
+        tick = 0
+        while not stop_event.wait(self.args.event_interval):
+            tick += 1
+            value = (tick % 1000) / 10
+            for topic, char in self.temperatures:
+                self.stats.changed[(topic, value)] = time.monotonic()
+                char.set_value(value)
+
+    async def run(self):
+        controllers = [Controller() for _ in range(self.args.controllers)]
+        await self.pair(controllers)
+
+        stop_event = threading.Event()
+        ticker = threading.Thread(target=self.change_temperatures, args=(stop_event,),
+                                  daemon=True)
+        ticker.start()
+        deadline = time.monotonic() + self.args.ramp + self.args.duration
+        try:
+            await asyncio.gather(*(self.run_controller(index, controller, deadline)
+                                   for index, controller in enumerate(controllers)))
+        finally:
+            stop_event.set()
+            ticker.join()
+
+    def report(self):
+        """Print the latencies, the event lags and the failures."""
+        stats = self.stats
+        header = '{:<24} {:>8}' + ' {:>9}' * (len(PERCENTILES) + 1)
+        print(header.format('', 'count',
+                            *['p{}'.format(p) for p in PERCENTILES], 'max'))
+        rows = sorted(stats.latencies.items())
+        if stats.lags:
+            rows.append(('event lag', stats.lags))
+        for kind, values in rows:
+            print(header.format(kind, len(values), *[
+                '{:.2f} ms'.format(value * 1e3) for value in percentiles(values)]))
+        if stats.unmatched_events:
+            print('{} events with a value that was not set'.format(
+                stats.unmatched_events))
+        for kind, count in sorted(stats.failures.items()):
+            print('failed: {:<24} {:>8}'.format(kind, count))
+        if not stats.failures:
+            print('no failures')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.soak',
+                                     description=__doc__.split('\n')[0])
+    parser.add_argument('--controllers', type=int, default=100,
+                        help='number of simulated controllers (default: %(default)s)')
+    parser.add_argument('--accessories', type=int, default=20,
+                        help='accessories of the bridge (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to poll once all controllers started '
+                             '(default: %(default)s)')
+    parser.add_argument('--ramp', type=float, default=5,
+                        help='seconds over which the controllers start '
+                             '(default: %(default)s)')
+    parser.add_argument('--poll-interval', type=float, default=1,
+                        help='seconds between the polls of a controller '
+                             '(default: %(default)s)')
+    parser.add_argument('--event-interval', type=float, default=0.5,
+                        help='seconds between temperature changes '
+                             '(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds to wait for a response (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    with patch('pyhap.accessory_driver.AccessoryDriver.persist'):
+        driver = get_driver(args.accessories)
+        # There is no mDNS here, so skip re-advertising after every added pairing
+        driver.safe_mode = True
+        loop = driver.loop
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        server = driver.http_server
+        server.addr_port = ('127.0.0.1', 0)
+        asyncio.run_coroutine_threadsafe(server.async_start(loop), loop).result()
+        threading.Thread(target=driver.send_events, daemon=True).start()
+
+        soak = Soak(driver, server.server.sockets[0].getsockname(), args)
+        client_loop = asyncio.new_event_loop()
+        try:
+            client_loop.run_until_complete(soak.run())
+        finally:
+            client_loop.close()
+            asyncio.run_coroutine_threadsafe(server.async_stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+    soak.report()
+    return 1 if soak.stats.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+from importlib.util import find_spec
 import os
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -9,10 +10,6 @@ SERVICES_FILE = os.path.join(RESOURCE_DIR, "services.json")
 
 # Flag if QR Code dependencies are installed.
 # Installation with `pip install HAP-python[QRCode]`.
-SUPPORT_QR_CODE = False
-try:
-    import base36  # noqa: F401
-    import pyqrcode  # noqa: F401
-    SUPPORT_QR_CODE = True
-except ImportError:
-    pass
+# They are only imported when a QR code is shown, as pyqrcode is slow to import.
+SUPPORT_QR_CODE = find_spec('base36') is not None \
+    and find_spec('pyqrcode') is not None
@@ -9,10 +9,6 @@ from pyhap.const import (
     HAP_REPR_VALUE, CATEGORY_OTHER, CATEGORY_BRIDGE)
 from pyhap.iid_manager import IIDManager
 
-if SUPPORT_QR_CODE:
-    import base36
-    from pyqrcode import QRCode
-
 logger = logging.getLogger(__name__)
 
 
@@ -163,6 +159,7 @@ class Accessory:
             for c in s.characteristics:
                 self.iid_manager.assign(c)
                 c.broker = self
+        self.driver.accessories_changed()
 
     def get_service(self, name):
         """Return a Service with the given name.
@@ -184,6 +181,8 @@ class Accessory:
 
         :rtype: str
         """
+        import base36  # pylint: disable=import-outside-toplevel
+
         buffer = bytearray(b'\x00\x00\x00\x00\x00\x00\x00\x00')
 
         value_low = int(self.driver.state.pincode.replace(b'-', b''), 10)
@@ -243,6 +242,8 @@ class Accessory:
         """
         pincode = self.driver.state.pincode.decode()
         if SUPPORT_QR_CODE:
+            from pyqrcode import QRCode  # pylint: disable=import-outside-toplevel
+
             xhm_uri = self.xhm_uri()
             print('Setup payload: {}'.format(xhm_uri), flush=True)
             print('Scan this code with your HomeKit app on your iOS device:',
@@ -357,6 +358,7 @@ class Bridge(Accessory):
             raise ValueError("Duplicate AID found when attempting to add accessory")
 
         self.accessories[acc.aid] = acc
+        self.driver.accessories_changed()
 
     def to_HAP(self):
         """Returns a HAP representation of itself and all contained accessories.
@@ -389,4 +391,8 @@ class Bridge(Accessory):
 
 
 def get_topic(aid, iid):
-    return str(aid) + '.' + str(iid)
+    """Return the topic of the characteristic with the given aid and iid.
+
+    :rtype: tuple <int, int>
+    """
+    return (aid, iid)
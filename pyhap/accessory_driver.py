@@ -5,31 +5,50 @@ Sending updates to clients
 The process of sending value changes to clients happens in two parts - on one hand, the
 value change is indicated by a Characteristic and, on the other, that change is sent to a
 client. To begin, typically, something in the Accessory's run method will do
-set_value(foo, notify=True) on one of its contained Characteristic. This in turn will
-create a HAP representation of the change and publish it to the Accessory. This will
-then add some more information and eventually the value change will reach the
-AccessoryDriver (all this happens through the publish() interface). The AccessoryDriver
-will then check if there is a client that subscribed for events from this exact
-Characteristic from this exact Accessory (remember, it could be a Bridge with more than
-one Accessory in it). If so, the event is put in a FIFO queue - the event queue. This
-terminates the call chain and concludes the publishing process from the Characteristic,
-the Characteristic does not block waiting for the actual send to happen.
+set_value(foo, notify=True) on one of its contained Characteristic. With
+suppress_unchanged_events, a value equal to the one the Characteristic last notified stops
+here. Otherwise, this in turn will create a HAP representation of the change and publish
+it to the Accessory. This will then add some more information and eventually the value
+change will reach the AccessoryDriver (all this happens through the publish() interface).
+The AccessoryDriver will then check if there is a client that subscribed for events from
+this exact Characteristic from this exact Accessory (remember, it could be a Bridge with
+more than one Accessory in it). If so, the event is put in a FIFO queue - the event queue.
+This terminates the call chain and concludes the publishing process from the
+Characteristic, the Characteristic does not block waiting for the actual send to happen.
 
 When the AccessoryDriver is started, it spawns an event dispatch thread. The purpose of
 this thread is to get events from the event queue and send them to subscribed clients.
-Whenever a send fails, the client is unsubscripted, as it is assumed that the client left
-or went to sleep before telling us. This concludes the publishing process from the
-AccessoryDriver.
+The thread takes the events from the queue in batches, drops the values in a batch that
+were superseded by a later value of the same characteristic and sends all the changes
+for a client in a single message. Whenever a send fails, the client is unsubscripted, as
+it is assumed that the client left or went to sleep before telling us. This concludes
+the publishing process from the AccessoryDriver.
+
+Persisting the state
+
+Configuration changes only schedule the state to be persisted. The changes within
+PERSIST_DELAY seconds are written together from the executor, so bridges that reconfigure
+many accessories at once do not wait for the disk. Pairing and unpairing are written right
+away, since a controller that lost its pairing on a crash could not reach the accessory
+again until it is reset. The state file is replaced atomically and any pending change is
+written when the driver stops.
+
+Metrics
+
+The driver records metrics of the requests, the events, the connections and its queues
+in a MetricsRegistry (see pyhap.metrics), which can be served locally in the Prometheus
+text format with the ``metrics_port`` parameter.
 """
 import asyncio
+import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
-import functools
 import os
 import logging
 import socket
 import hashlib
 import base64
 import sys
+import tempfile
 import time
 import threading
 import json
@@ -41,14 +60,19 @@ from pyhap.accessory import get_topic
 from pyhap.characteristic import CharacteristicError
 from pyhap.const import (
     STANDALONE_AID, HAP_PERMISSION_NOTIFY, HAP_REPR_ACCS, HAP_REPR_AID,
-    HAP_REPR_CHARS, HAP_REPR_IID, HAP_REPR_STATUS, HAP_REPR_VALUE)
+    HAP_REPR_CHARS, HAP_REPR_IID, HAP_REPR_MAX_LEN, HAP_REPR_SERVICES,
+    HAP_REPR_STATUS, HAP_REPR_VALUE, HAP_REPR_WRITE_RESPONSE)
 from pyhap.encoder import AccessoryEncoder
-from pyhap.hap_server import HAPServer
+from pyhap.hap_protocol import AsyncHAPServer
+from pyhap.hap_server import EVENT_OVERFLOW_POLICY, HAP_SERVER_STATUS, HAPServer
 from pyhap.hsrp import Server as SrpServer
 from pyhap.loader import Loader
+from pyhap.metrics import MetricsRegistry, async_start_metrics_server
 from pyhap.params import get_srp_context
+from pyhap.session_cache import SessionCache
 from pyhap.state import State
-from pyhap import util
+from pyhap.util import iscoro
+from pyhap import tracing, util
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +80,10 @@ CHAR_STAT_OK = 0
 SERVICE_COMMUNICATION_FAILURE = -70402
 SERVICE_CALLBACK = 0
 SERVICE_CALLBACK_DATA = 1
+SERVICE_CALLBACK_REPS = 2
 HAP_SERVICE_TYPE = '_hap._tcp.local.'
+# Stands in for the IID of each characteristic in the cached accessories JSON
+ACCESSORIES_JSON_MARKER = '\x00'
 
 
 def callback(func):
@@ -70,13 +97,38 @@ def is_callback(func):
     return '_pyhap_callback' in getattr(func, '__dict__', {})
 
 
-def iscoro(func):
-    """Check if the function is a coroutine or if the function is a ``functools.partial``,
-    check the wrapped function for the same.
-    """
-    if isinstance(func, functools.partial):
-        func = func.func
-    return asyncio.iscoroutinefunction(func)
+class CountingThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor that counts the jobs waiting for a worker."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backlog = 0
+        self._backlog_lock = threading.Lock()
+
+    def _job_taken(self):
+        """Count a job that a worker started or that was cancelled before."""
+        with self._backlog_lock:
+            self.backlog -= 1
+
+    def _run_job(self, fn, *args, **kwargs):
+        self._job_taken()
+        return fn(*args, **kwargs)
+
+    def _job_done(self, future):
+        """Count a job that was cancelled while it waited, so it is never run."""
+        if future.cancelled():
+            self._job_taken()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._backlog_lock:
+            self.backlog += 1
+        try:
+            future = super().submit(self._run_job, fn, *args, **kwargs)
+        except Exception:
+            self._job_taken()
+            raise
+        future.add_done_callback(self._job_done)
+        return future
 
 
 class AccessoryMDNSServiceInfo(ServiceInfo):
@@ -141,11 +193,29 @@ class AccessoryDriver:
     """Number of HAP send events to be processed before reporting statistics on
     the event queue length."""
 
+    MAX_EVENTS_PER_BATCH = 100
+    """Maximum number of events taken from the event queue before they are sent."""
+
+    PERSIST_DELAY = 1
+    """Seconds for which changes of the state are collected before it is persisted."""
+
+    EVENT_CHARS_PREFIX = b'{"' + HAP_REPR_CHARS.encode() + b'":['
+    """Start of the JSON of an event, followed by the characteristics."""
+
+    EVENT_KEYS = frozenset((HAP_REPR_AID, HAP_REPR_IID, HAP_REPR_VALUE))
+    """Keys of the published data that is encoded from a per topic template."""
+
     def __init__(self, *, address=None, port=51234,
                  persist_file='accessory.state', pincode=None,
                  encoder=None, loader=None, loop=None, mac=None,
                  listen_address=None, advertised_address=None, interface_choice=None,
-                 zeroconf_instance=None):
+                 zeroconf_instance=None, threaded_server=False,
+                 event_coalesce_window=0, client_event_queue_size=100,
+                 client_event_overflow_policy=EVENT_OVERFLOW_POLICY.DROP_OLDEST,
+                 suppress_unchanged_events=False, concurrent_getters=False,
+                 getter_timeout=5, concurrent_setters=False, setter_timeout=10,
+                 write_response=False, metrics=None, metrics_address='127.0.0.1',
+                 metrics_port=None):
         """
         Initialize a new AccessoryDriver object.
 
@@ -191,6 +261,76 @@ class AccessoryDriver:
         :param zeroconf_instance: A Zeroconf instance. When running multiple accessories or
             bridges a single zeroconf instance can be shared to avoid the overhead
             of processing the same data multiple times.
+
+        :param threaded_server: Serve HAP clients with the legacy HAPServer, which
+            dedicates a thread to every connection, instead of serving them from the
+            event loop.
+        :type threaded_server: bool
+
+        :param event_coalesce_window: The time, in seconds, for which the event
+            dispatch thread collects further events after taking one from the event
+            queue. Only the latest value of a characteristic in that window is sent, so
+            a larger window trades latency for less traffic with bursty accessories.
+            Defaults to 0, in which case only events that are already queued are
+            collected.
+        :type event_coalesce_window: float
+
+        :param client_event_queue_size: The number of events queued for a client that
+            does not keep up with them before ``client_event_overflow_policy`` applies.
+            Every client has its own queue, so a slow client does not delay the others.
+        :type client_event_queue_size: int
+
+        :param client_event_overflow_policy: What to do when the event queue of a
+            client is full, one of the EVENT_OVERFLOW_POLICY values: drop the oldest
+            event, drop queued events with only topics of the new event or disconnect
+            the client.
+        :type client_event_overflow_policy: str
+
+        :param suppress_unchanged_events: Do not notify clients when an accessory sets
+            a characteristic to the value it last notified, e.g. when it polls a sensor
+            with an unchanged reading. Characteristics can override this with their
+            ``suppress_unchanged_events`` attribute and let floats vary within a
+            ``deadband``.
+        :type suppress_unchanged_events: bool
+
+        :param concurrent_getters: Run the ``getter_callback`` of the characteristics
+            requested together in the ``callback_executor``, at the same time, instead
+            of one after the other in the request thread. Coroutine getters always run
+            concurrently, on the event loop, and getters decorated with ``callback``
+            always run in the request thread.
+        :type concurrent_getters: bool
+
+        :param getter_timeout: The time, in seconds, a request waits for the
+            concurrent getters. Characteristics whose getter takes longer are reported
+            with a service communication failure.
+        :type getter_timeout: float
+
+        :param concurrent_setters: Run the service ``setter_callback`` of different
+            accessories written together at the same time, coroutines on the event loop
+            and functions in the ``callback_executor``. The callbacks of one accessory
+            still run one after the other, in the order of the request. Coroutine
+            callbacks always run on the event loop.
+        :type concurrent_setters: bool
+
+        :param setter_timeout: The time, in seconds, a request waits for the concurrent
+            or coroutine service callbacks. Characteristics whose callback takes longer
+            are reported with a service communication failure.
+        :type setter_timeout: float
+
+        :param write_response: Report the status of every characteristic of a write,
+            instead of failing the whole write when a callback raises.
+        :type write_response: bool
+
+        :param metrics: The registry to record the metrics of the driver in. Defaults
+            to None, in which case the driver creates its own.
+        :type metrics: MetricsRegistry
+
+        :param metrics_address: The local address to serve the metrics on.
+        :type metrics_address: str
+
+        :param metrics_port: The port to serve the metrics on, at ``/metrics``.
+            Defaults to None, in which case they are not served.
+        :type metrics_port: int
         """
         if loop is None:
             if sys.platform == 'win32':
@@ -202,10 +342,16 @@ class AccessoryDriver:
             if sys.version_info >= (3, 6):
                 executor_opts['thread_name_prefix'] = 'SyncWorker'
 
-            self.executor = ThreadPoolExecutor(**executor_opts)
+            self.executor = CountingThreadPoolExecutor(**executor_opts)
             loop.set_default_executor(self.executor)
         else:
             self.executor = None
+        # Requests are handled in the default executor and wait for the concurrent
+        # callbacks, which therefore must not need a worker of the same pool.
+        executor_opts = {}
+        if sys.version_info >= (3, 6):
+            executor_opts['thread_name_prefix'] = 'CallbackWorker'
+        self.callback_executor = ThreadPoolExecutor(**executor_opts)
 
         self.loop = loop
 
@@ -219,8 +365,14 @@ class AccessoryDriver:
             self.advertiser = Zeroconf()
         self.persist_file = os.path.expanduser(persist_file)
         self.encoder = encoder or AccessoryEncoder()
-        self.topics = {}  # topic: set of (address, port) of subscribed clients
-        self.topic_lock = threading.Lock()  # for exclusive access to the topics
+        self.persist_lock = threading.Lock()  # for exclusive access to the state file
+        self.persist_pending = False
+        self.persist_handle = None  # the scheduled persist, see schedule_persist
+        # topic: frozenset of (address, port) of subscribed clients. The sets are
+        # replaced rather than modified, so they can be read without the topic_lock.
+        self.topics = {}
+        self.client_topics = {}  # (address, port): set of topics
+        self.topic_lock = threading.Lock()  # for exclusive changes to the topics
         self.loader = loader or Loader()
         self.aio_stop_event = asyncio.Event(loop=loop)
         self.stop_event = threading.Event()
@@ -228,13 +380,27 @@ class AccessoryDriver:
             queue.SimpleQueue() if hasattr(queue, "SimpleQueue") else queue.Queue()  # pylint: disable=no-member
         )
         self.send_event_thread = None  # the event dispatch thread
+        self.event_coalesce_window = event_coalesce_window
+        self.event_prefixes = {}  # topic: b'{"aid":A,"iid":I,"value":'
         self.sent_events = 0
         self.accumulated_qsize = 0
+        # topic: number of events, only changed by the event dispatch thread
+        self.published_events = {}
+        self.failed_events = {}
+        self.suppress_unchanged_events = suppress_unchanged_events
+        self.concurrent_getters = concurrent_getters
+        self.getter_timeout = getter_timeout
+        self.concurrent_setters = concurrent_setters
+        self.setter_timeout = setter_timeout
+        self.write_response = write_response
 
         self.safe_mode = False
 
         self.mdns_service_info = None
         self.srp_verifier = None
+        self.session_cache = SessionCache()  # sessions that can be pair resumed
+        # (config_version, JSON segments, characteristics), see get_accessories_json
+        self.accessories_json_cache = None
 
         address = address or util.get_local_address()
         advertised_address = advertised_address or address
@@ -242,7 +408,80 @@ class AccessoryDriver:
 
         listen_address = listen_address or address
         network_tuple = (listen_address, self.state.port)
-        self.http_server = HAPServer(network_tuple, self)
+        self.threaded_server = threaded_server
+        event_queue_opts = {
+            'event_queue_size': client_event_queue_size,
+            'event_overflow_policy': client_event_overflow_policy,
+        }
+        if threaded_server:
+            self.http_server = HAPServer(network_tuple, self, **event_queue_opts)
+        else:
+            self.http_server = AsyncHAPServer(network_tuple, self, **event_queue_opts)
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.metrics_address = metrics_address
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self._setup_metrics()
+
+    def _setup_metrics(self):
+        """Create the metrics of the driver in the registry."""
+        metrics = self.metrics
+        self.request_duration = metrics.histogram(
+            'hap_request_duration_seconds', 'Time to handle a HAP request.',
+            ('method', 'path'))
+        self.pair_verify_duration = metrics.histogram(
+            'hap_pair_verify_duration_seconds',
+            'Time from the first to the last step of a pair verify.')
+        metrics.counter(
+            'hap_events_published_total',
+            'Events published for subscribed clients.', ('aid', 'iid'),
+            collect=lambda: dict(self.published_events))
+        metrics.counter(
+            'hap_events_failed_total',
+            'Events that could not be sent to a client.', ('aid', 'iid'),
+            collect=lambda: dict(self.failed_events))
+        metrics.counter(
+            'hap_events_suppressed_total',
+            'Events not sent because the value did not change.', ('aid', 'iid'),
+            collect=self._collect_suppressed_events)
+        metrics.gauge(
+            'hap_connections', 'Open HAP connections.',
+            collect=lambda: self.http_server.get_connection_stats()['connections'])
+        metrics.gauge(
+            'hap_encrypted_sessions', 'HAP connections with an encrypted session.',
+            collect=lambda: self.http_server.get_connection_stats()['encrypted'])
+        metrics.gauge(
+            'hap_event_queue_size', 'Events waiting for the event dispatch thread.',
+            collect=self.event_queue.qsize)
+        metrics.gauge(
+            'hap_client_event_queue_depth', 'Events queued for a client.',
+            ('client',), collect=lambda: self._collect_client_event_queues('depth'))
+        metrics.counter(
+            'hap_client_events_dropped_total',
+            'Events dropped because the queue of a client was full.', ('client',),
+            collect=lambda: self._collect_client_event_queues('dropped'))
+        if self.executor is not None:
+            metrics.gauge(
+                'hap_executor_backlog', 'Jobs waiting for a worker of the executor.',
+                collect=lambda: self.executor.backlog)
+
+    def _collect_suppressed_events(self):
+        """Return the number of suppressed events of every characteristic."""
+        if self.accessory is None:
+            return {}
+        accessories = (self.accessory,
+                       *getattr(self.accessory, 'accessories', {}).values())
+        return {(acc.aid, iid): obj.suppressed_events
+                for acc in accessories
+                for iid, obj in list(acc.iid_manager.objs.items())
+                if getattr(obj, 'suppressed_events', 0)}
+
+    def _collect_client_event_queues(self, stat):
+        """Return the given ClientEventQueue stat of every client."""
+        return {('{}:{}'.format(*client_addr),): stats[stat]
+                for client_addr, stats
+                in self.http_server.get_event_queue_stats().items()}
 
     def start(self):
         """Start the event loop and call `start_service`.
@@ -302,8 +541,20 @@ class AccessoryDriver:
 
         # Start listening for requests
         logger.debug('Starting server.')
-        self.http_server_thread = threading.Thread(target=self.http_server.serve_forever)
-        self.http_server_thread.start()
+        if self.threaded_server:
+            self.http_server_thread = threading.Thread(
+                target=self.http_server.serve_forever)
+            self.http_server_thread.start()
+        else:
+            asyncio.run_coroutine_threadsafe(
+                self.http_server.async_start(self.loop), self.loop).result()
+
+        if self.metrics_port is not None:
+            logger.debug('Starting metrics server.')
+            self.metrics_server = asyncio.run_coroutine_threadsafe(
+                async_start_metrics_server(self.metrics, self.loop,
+                                           self.metrics_address, self.metrics_port),
+                self.loop).result()
 
         # Advertise the accessory as a mDNS service.
         logger.debug('Starting mDNS.')
@@ -326,8 +577,17 @@ class AccessoryDriver:
             self.loop.create_task, self.async_stop())
 
     async def async_stop(self):
-        """Stops the AccessoryDriver and shutdown all remaining tasks."""
+        """Stops the AccessoryDriver and shutdown all remaining tasks.
+
+        Only the first call stops the driver; the HAP server is stopped from the event
+        loop, so a second stop could otherwise wait for a loop that has stopped.
+        """
+        if self.aio_stop_event.is_set():
+            return
+        self.aio_stop_event.set()
         await self.async_add_job(self._do_stop)
+        # A callback that did not return before its request timed out may still run
+        self.callback_executor.shutdown(wait=False)
         # Executor=None means a loop wasn't passed in
         if self.executor is not None:
             logger.debug('Shutdown executors')
@@ -342,6 +602,7 @@ class AccessoryDriver:
         2. Call the stop method of the Accessory and wait for its thread to finish.
         3. Stop mDNS advertising.
         4. Stop HAP server.
+        5. Persist any pending change of the state.
         """
         # TODO: This should happen in a different order - mDNS, server, accessory. Need
         # to ensure that sending with a closed server will not crash the app.
@@ -358,9 +619,19 @@ class AccessoryDriver:
         self.advertiser.close()
 
         logger.debug("Stopping HAP server")
-        self.http_server.shutdown()
-        self.http_server.server_close()
-        self.http_server_thread.join()
+        if self.threaded_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server_thread.join()
+        else:
+            asyncio.run_coroutine_threadsafe(
+                self.http_server.async_stop(), self.loop).result()
+
+        if self.metrics_server is not None:
+            self.loop.call_soon_threadsafe(self.metrics_server.close)
+
+        logger.debug("Writing pending state changes")
+        self.persist_if_pending()
 
         logger.debug("AccessoryDriver stopped successfully")
 
@@ -417,8 +688,8 @@ class AccessoryDriver:
         :param client: A client (address, port) tuple that should be subscribed.
         :type client: tuple <str, int>
 
-        :param topic: The topic to which to subscribe.
-        :type topic: str
+        :param topic: The (aid, iid) topic to which to subscribe.
+        :type topic: tuple <int, int>
 
         :param subscribe: Whether to subscribe or unsubscribe the client. Both subscribing
             an already subscribed client and unsubscribing a client that is not subscribed
@@ -426,20 +697,42 @@ class AccessoryDriver:
         :type subscribe: bool
         """
         with self.topic_lock:
+            subscribed_clients = self.topics.get(topic, frozenset())
             if subscribe:
-                subscribed_clients = self.topics.get(topic)
-                if subscribed_clients is None:
-                    subscribed_clients = set()
-                    self.topics[topic] = subscribed_clients
-                subscribed_clients.add(client)
-            else:
-                if topic not in self.topics:
-                    return
-                subscribed_clients = self.topics[topic]
-                subscribed_clients.discard(client)
-                if not subscribed_clients:
-                    del self.topics[topic]
+                if client not in subscribed_clients:
+                    self.topics[topic] = subscribed_clients | {client}
+                    self.client_topics.setdefault(client, set()).add(topic)
+                return
+            if client not in subscribed_clients:
+                return
+            self._remove_topic_client(topic, client)
+            client_topics = self.client_topics.get(client)
+            if client_topics is not None:
+                client_topics.discard(topic)
+                if not client_topics:
+                    del self.client_topics[client]
+
+    def unsubscribe_client(self, client):
+        """Unsubscribe the given client from all topics, thread-safe.
+
+        Called by the HAP server when the connection of the client is closed.
+
+        :param client: A client (address, port) tuple.
+        :type client: tuple <str, int>
+        """
+        with self.topic_lock:
+            for topic in self.client_topics.pop(client, ()):
+                self._remove_topic_client(topic, client)
+
+    def _remove_topic_client(self, topic, client):
+        """Remove a client from the subscribers of a topic, with the topic_lock held."""
+        subscribed_clients = self.topics[topic] - {client}
+        if subscribed_clients:
+            self.topics[topic] = subscribed_clients
+        else:
+            del self.topics[topic]
 
+    @tracing.traced('driver.publish')
     def publish(self, data, sender_client_addr=None):
         """Publishes an event to the client.
 
@@ -454,9 +747,66 @@ class AccessoryDriver:
         if topic not in self.topics:
             return
 
-        data = {HAP_REPR_CHARS: [data]}
-        bytedata = json.dumps(data).encode()
-        self.event_queue.put((topic, bytedata, sender_client_addr))
+        self.event_queue.put((topic, data, sender_client_addr))
+
+    def _encode_event_data(self, topic, data):
+        """Return the JSON of the published data of a characteristic.
+
+        The ``{"aid":A,"iid":I,"value":`` prefix is built once per topic, so only the
+        value is serialized for every change. Data with other keys is serialized as a
+        whole. Non-finite floats are encoded differently by each JSON library (see
+        ``util.to_json_bytes``).
+
+        :rtype: bytes
+        """
+        if data.keys() != self.EVENT_KEYS:
+            return util.to_json_bytes(data)
+        prefix = self.event_prefixes.get(topic)
+        if prefix is None:
+            prefix = util.to_json_bytes(
+                {HAP_REPR_AID: data[HAP_REPR_AID], HAP_REPR_IID: data[HAP_REPR_IID]}
+            )[:-1] + b',"' + HAP_REPR_VALUE.encode() + b'":'
+            self.event_prefixes[topic] = prefix
+        return prefix + util.to_json_bytes(data[HAP_REPR_VALUE]) + b'}'
+
+    def _get_event_batch(self):
+        """Wait for an event and collect the events queued after it.
+
+        Events are collected until the queue is empty and ``event_coalesce_window``
+        seconds have passed since the first one, or until ``MAX_EVENTS_PER_BATCH``
+        events are taken from the queue.
+
+        :return: The latest (data, sender_client_addr) event for each topic, in the
+            order the topics were last published.
+        :rtype: dict
+        """
+        published_events = self.published_events
+        topic, data, sender_client_addr = self.event_queue.get()
+        events = {topic: (data, sender_client_addr)}
+        published_events[topic] = published_events.get(topic, 0) + 1
+        num_events = 1
+        deadline = time.monotonic() + self.event_coalesce_window
+        while num_events < self.MAX_EVENTS_PER_BATCH:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    topic, data, sender_client_addr = self.event_queue.get(
+                        timeout=timeout)
+                else:
+                    topic, data, sender_client_addr = self.event_queue.get_nowait()
+            except queue.Empty:
+                break
+            # A later value supersedes any earlier one for the same characteristic
+            events.pop(topic, None)
+            events[topic] = (data, sender_client_addr)
+            published_events[topic] = published_events.get(topic, 0) + 1
+            num_events += 1
+
+        if hasattr(self.event_queue, "task_done"):
+            for _ in range(num_events):
+                self.event_queue.task_done()  # pylint: disable=no-member
+        self.sent_events += num_events
+        return events
 
     def send_events(self):
         """Start sending events from the queue to clients.
@@ -465,49 +815,68 @@ class AccessoryDriver:
         queue size for the past NUM_EVENTS_BEFORE_STATS. Enable debug logging to see this
         information.
 
+        Events are taken from the queue in batches (see ``_get_event_batch``) and all
+        events of a batch for the same client are sent in a single message.
+
         Whenever sending an event fails (i.e. HAPServer.push_event returns False), the
-        intended client is removed from the set of subscribed clients for the topic.
+        intended client is removed from the set of subscribed clients for the topics
+        of the event. An event whose data cannot be encoded is logged and dropped.
 
         @note: This method blocks on Queue.get, waiting for something to come. Thus, if
         this is not run in a daemon thread or it is run on the main thread, the app will
         hang.
         """
+        failed_events = self.failed_events
         while not self.loop.is_closed():
-            # Maybe consider having a pool of worker threads, each performing a send in
-            # order to increase throughput.
-            #
+            events = self._get_event_batch()
             # Clients that made the characteristic change are NOT susposed to get events
             # about the characteristic change as it can cause an HTTP disconnect and violates
             # the HAP spec
             #
-            topic, bytedata, sender_client_addr = self.event_queue.get()
-            subscribed_clients = self.topics.get(topic, [])
-            logger.debug(
-                'Send event: topic(%s), data(%s), sender_client_addr(%s)',
-                topic,
-                bytedata,
-                sender_client_addr
-            )
-            for client_addr in subscribed_clients.copy():
-                if sender_client_addr and sender_client_addr == client_addr:
-                    logger.debug(
-                        'Skip sending event to client since '
-                        'its the client that made the characteristic change: %s',
-                        client_addr
-                    )
-                    continue
-                logger.debug('Sending event to client: %s', client_addr)
-                pushed = self.http_server.push_event(bytedata, client_addr)
+            client_events = {}  # client_addr: [(topic, encoded data)]
+            for topic, (data, sender_client_addr) in events.items():
+                subscribed_clients = self.topics.get(topic, ())
+                logger.debug(
+                    'Send event: topic(%s), data(%s), sender_client_addr(%s)',
+                    topic,
+                    data,
+                    sender_client_addr
+                )
+                encoded = None
+                for client_addr in subscribed_clients:
+                    if sender_client_addr and sender_client_addr == client_addr:
+                        logger.debug(
+                            'Skip sending event to client since '
+                            'its the client that made the characteristic change: %s',
+                            client_addr
+                        )
+                        continue
+                    if encoded is None:
+                        try:
+                            encoded = self._encode_event_data(topic, data)
+                        except Exception:  # pylint: disable=broad-except
+                            logger.exception('Dropping event of %s that could not be '
+                                             'encoded: %s', topic, data)
+                            break
+                    client_events.setdefault(client_addr, []).append((topic, encoded))
+
+            for client_addr, topic_events in client_events.items():
+                logger.debug('Sending %d event(s) to client: %s',
+                             len(topic_events), client_addr)
+                bytedata = b''.join((
+                    self.EVENT_CHARS_PREFIX,
+                    b','.join([encoded for _, encoded in topic_events]),
+                    b']}'))
+                pushed = self.http_server.push_event(
+                    bytedata, client_addr, [topic for topic, _ in topic_events])
                 if not pushed:
                     logger.debug('Could not send event to %s, probably stale socket.',
                                  client_addr)
-                    # Maybe consider removing the client_addr from every topic?
-                    self.subscribe_client_topic(client_addr, topic, False)
-            if hasattr(self.event_queue, "task_done"):
-                self.event_queue.task_done()  # pylint: disable=no-member
-            self.sent_events += 1
-            self.accumulated_qsize += self.event_queue.qsize()
+                    for topic, _ in topic_events:
+                        failed_events[topic] = failed_events.get(topic, 0) + 1
+                        self.subscribe_client_topic(client_addr, topic, False)
 
+            self.accumulated_qsize += self.event_queue.qsize()
             if self.sent_events > self.NUM_EVENTS_BEFORE_STATS:
                 logger.debug('Average queue size for the past %s events: %.2f',
                              self.sent_events, self.accumulated_qsize / self.sent_events)
@@ -517,12 +886,12 @@ class AccessoryDriver:
     def config_changed(self):
         """Notify the driver that the accessory's configuration has changed.
 
-        Persists the accessory, so that the new configuration is available on
-        restart. Also, updates the mDNS advertisement, so that iOS clients know they need
-        to fetch new data.
+        Schedules the accessory to be persisted, so that the new configuration is
+        available on restart. Also, updates the mDNS advertisement, so that iOS clients
+        know they need to fetch new data.
         """
         self.state.config_version += 1
-        self.persist()
+        self.schedule_persist()
         self.update_advertisement()
 
     def update_advertisement(self):
@@ -534,9 +903,63 @@ class AccessoryDriver:
         self.advertiser.register_service(self.mdns_service_info)
 
     def persist(self):
-        """Saves the state of the accessory."""
-        with open(self.persist_file, 'w') as fp:
-            self.encoder.persist(fp, self.state)
+        """Saves the state of the accessory.
+
+        The state is written to a temporary file that then replaces the state file, so
+        a crash while writing never leaves a truncated state file behind.
+        """
+        persist_dir = os.path.dirname(os.path.abspath(self.persist_file))
+        with self.persist_lock:
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile(
+                        mode='w', dir=persist_dir, delete=False) as fp:
+                    tmp_path = fp.name
+                    self.encoder.persist(fp, self.state)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tmp_path, self.persist_file)
+                tmp_path = None
+            finally:
+                if tmp_path is not None:
+                    os.unlink(tmp_path)
+
+    def schedule_persist(self):
+        """Persist the state of the accessory in the background, thread-safe.
+
+        The first change schedules a write in PERSIST_DELAY seconds and the changes until
+        then are written with it. If the event loop is closed, the state is persisted
+        right away.
+        """
+        self.persist_pending = True
+        if self.loop.is_closed():
+            self.persist_if_pending()
+            return
+        self.loop.call_soon_threadsafe(self._async_schedule_persist)
+
+    @callback
+    def _async_schedule_persist(self):
+        """Schedule a write of the state, unless one is already scheduled."""
+        if self.persist_handle is None:
+            self.persist_handle = self.loop.call_later(
+                self.PERSIST_DELAY, self._async_persist_scheduled)
+
+    @callback
+    def _async_persist_scheduled(self):
+        """Write the state from the executor."""
+        self.persist_handle = None
+        self.async_add_job(self.persist_if_pending)
+
+    def persist_if_pending(self):
+        """Persist the state if it changed since it was last persisted."""
+        if not self.persist_pending:
+            return
+        self.persist_pending = False
+        try:
+            self.persist()
+        except Exception:
+            self.persist_pending = True
+            raise
 
     def load(self):
         """ """
@@ -546,7 +969,7 @@ class AccessoryDriver:
     def pair(self, client_uuid, client_public):
         """Called when a client has paired with the accessory.
 
-        Persist the new accessory state.
+        Persist the new accessory state, together with any scheduled changes.
 
         :param client_uuid: The client uuid.
         :type client_uuid: uuid.UUID
@@ -561,21 +984,26 @@ class AccessoryDriver:
         # let the accessory call config_changed, which will persist and update mDNS?
         # See also unpair.
         logger.info("Paired with %s.", client_uuid)
-        self.state.add_paired_client(client_uuid, client_public)
-        self.persist()
+        with self.persist_lock:
+            self.state.add_paired_client(client_uuid, client_public)
+        self.persist_pending = True
+        self.persist_if_pending()
         return True
 
     def unpair(self, client_uuid):
         """Removes the paired client from the accessory.
 
-        Persist the new accessory state.
+        Persist the new accessory state, together with any scheduled changes.
 
         :param client_uuid: The client uuid.
         :type client_uuid: uuid.UUID
         """
         logger.info("Unpairing client %s.", client_uuid)
-        self.state.remove_paired_client(client_uuid)
-        self.persist()
+        with self.persist_lock:
+            self.state.remove_paired_client(client_uuid)
+        self.session_cache.remove_client(client_uuid)
+        self.persist_pending = True
+        self.persist_if_pending()
 
     def finish_pair(self):
         """Finishing pairing or unpairing.
@@ -601,7 +1029,8 @@ class AccessoryDriver:
         """Create an SRP verifier for the accessory's info."""
         # TODO: Move the below hard-coded values somewhere nice.
         ctx = get_srp_context(3072, hashlib.sha512, 16)
-        verifier = SrpServer(ctx, b'Pair-Setup', self.state.pincode)
+        salt, v = self.state.get_srp_verifier(b'Pair-Setup', ctx)
+        verifier = SrpServer(ctx, b'Pair-Setup', self.state.pincode, salt, v)
         self.srp_verifier = verifier
 
     def get_accessories(self):
@@ -635,6 +1064,80 @@ class AccessoryDriver:
         logger.debug("Get accessories response: %s", hap_rep)
         return {HAP_REPR_ACCS: hap_rep}
 
+    def get_accessories_json(self):
+        """Returns the accessory in HAP format, serialized to JSON.
+
+        The structure of the accessories is serialized once and cached for the current
+        ``config_version``. On every call, only the value dependent part of each
+        characteristic (see ``Characteristic.value_to_HAP``) is spliced into the cached
+        JSON, and it is only serialized again if it changed since the last call.
+
+        :rtype: bytes
+        """
+        cache = self.accessories_json_cache
+        if cache is None or cache[0] != self.state.config_version:
+            cache = self._build_accessories_json_cache()
+            if cache is None:
+                return json.dumps(self.get_accessories()).encode('utf-8')
+            self.accessories_json_cache = cache
+
+        _, segments, chars = cache
+        parts = [segments[0]]
+        for char_cache, segment in zip(chars, segments[1:]):
+            value_rep = char_cache[1].value_to_HAP()
+            last_value_rep, value_json = char_cache[2]
+            if value_rep != last_value_rep or \
+                    type(value_rep.get(HAP_REPR_VALUE)) is not \
+                    type(last_value_rep.get(HAP_REPR_VALUE)):
+                value_json = json.dumps(value_rep)[1:-1]
+                if value_json:
+                    value_json = str(char_cache[0]) + ', ' + value_json
+                else:
+                    value_json = str(char_cache[0])
+                char_cache[2] = (value_rep, value_json)
+            parts.append(value_json)
+            parts.append(segment)
+        return ''.join(parts).encode('utf-8')
+
+    def _build_accessories_json_cache(self):
+        """Serialize the accessories with a marker in place of each characteristic IID.
+
+        :return: The config version, the JSON split at the markers and, for the
+            characteristics between the segments, [iid, characteristic,
+            (last value_to_HAP, its JSON)] lists. None if the accessories contain the
+            marker themselves.
+        :rtype: tuple
+        """
+        config_version = self.state.config_version
+        hap_rep = self.get_accessories()
+        chars = []
+        for acc_rep in hap_rep[HAP_REPR_ACCS]:
+            aid = acc_rep[HAP_REPR_AID]
+            for serv_rep in acc_rep[HAP_REPR_SERVICES]:
+                for char_rep in serv_rep[HAP_REPR_CHARS]:
+                    iid = char_rep[HAP_REPR_IID]
+                    char = self.accessory.get_characteristic(aid, iid)
+                    chars.append([iid, char, (None, None)])
+                    char_rep[HAP_REPR_IID] = ACCESSORIES_JSON_MARKER
+                    char_rep.pop(HAP_REPR_VALUE, None)
+                    char_rep.pop(HAP_REPR_MAX_LEN, None)
+
+        segments = json.dumps(hap_rep).split(json.dumps(ACCESSORIES_JSON_MARKER))
+        if len(segments) != len(chars) + 1:
+            logger.debug('Not caching the accessories JSON, it contains the marker')
+            return None
+        return config_version, segments, chars
+
+    def accessories_changed(self):
+        """Drop the cached accessories JSON after the structure of an accessory changed.
+
+        Called when services or bridged accessories are added and when the properties
+        of a characteristic are overridden. Other changes need a ``config_changed``, so
+        that clients fetch the accessories again.
+        """
+        self.accessories_json_cache = None
+
+    @tracing.traced('driver.get_characteristics')
     def get_characteristics(self, char_ids):
         """Returns values for the required characteristics.
 
@@ -656,6 +1159,7 @@ class AccessoryDriver:
         :rtype: dict
         """
         chars = []
+        concurrent = []  # (rep, char) of the getters to run concurrently
         for aid_iid in char_ids:
             aid, iid = (int(i) for i in aid_iid.split("."))
             rep = {
@@ -675,7 +1179,10 @@ class AccessoryDriver:
                     available = acc.available
                     char = acc.iid_manager.get_obj(iid)
 
-                if available:
+                if available and self._is_concurrent_getter(char.getter_callback) \
+                        and not char.use_cached_value():
+                    concurrent.append((rep, char))
+                elif available:
                     rep[HAP_REPR_VALUE] = char.get_value()
                     rep[HAP_REPR_STATUS] = CHAR_STAT_OK
             except CharacteristicError:
@@ -684,9 +1191,56 @@ class AccessoryDriver:
                 logger.exception("Unexpected error getting value for characteristic %s.", id)
 
             chars.append(rep)
+        if concurrent:
+            asyncio.run_coroutine_threadsafe(
+                self.async_get_concurrent_values(concurrent), self.loop).result()
         logger.debug("Get chars response: %s", chars)
         return {HAP_REPR_CHARS: chars}
 
+    def _is_concurrent_getter(self, getter):
+        """Return whether the getter runs concurrently, see get_characteristics."""
+        if getter is None:
+            return False
+        if iscoro(getter):
+            return True
+        return self.concurrent_getters and not is_callback(getter)
+
+    async def async_get_concurrent_values(self, concurrent):
+        """Run the getters of the characteristics at the same time.
+
+        Waits for at most ``getter_timeout`` seconds. The getters that have not
+        returned by then are cancelled and their characteristics keep the service
+        communication failure status.
+
+        :param concurrent: The (HAP representation, characteristic) pairs to fill in.
+        :type concurrent: list
+        """
+        futures = {}
+        for rep, char in concurrent:
+            if iscoro(char.getter_callback):
+                future = self.loop.create_task(char.getter_callback())
+            else:
+                future = self.loop.run_in_executor(self.callback_executor,
+                                                   char.getter_callback)
+            futures[future] = (rep, char)
+
+        done, not_done = await asyncio.wait(futures, timeout=self.getter_timeout)
+        for future in not_done:
+            future.cancel()
+            logger.warning("Getting value for characteristic %s timed out.",
+                           futures[future][1])
+        for future in done:
+            rep, char = futures[future]
+            try:
+                char.set_getter_value(future.result())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Unexpected error getting value for characteristic %s.",
+                                 char)
+                continue
+            rep[HAP_REPR_VALUE] = char.value
+            rep[HAP_REPR_STATUS] = CHAR_STAT_OK
+
+    @tracing.traced('driver.set_characteristics')
     def set_characteristics(self, chars_query, client_addr):
         """Called from ``HAPServerHandler`` when iOS configures the characteristics.
 
@@ -704,12 +1258,24 @@ class AccessoryDriver:
            }
 
         :type chars_query: dict
+
+        :return: With ``write_response``, the status of each characteristic and the
+            value of those written with ``"r": True``, in the format of
+            `get_characteristics`. None otherwise.
+        :rtype: dict
         """
         # TODO: Add support for chars that do no support notifications.
         service_callbacks = {}
+        reps = []
+        written = []  # (rep, char) of the characteristics to respond with the value of
         for cq in chars_query[HAP_REPR_CHARS]:
             aid, iid = cq[HAP_REPR_AID], cq[HAP_REPR_IID]
+            rep = {HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_STATUS: CHAR_STAT_OK}
+            reps.append(rep)
             char = self.accessory.get_characteristic(aid, iid)
+            if char is None and self.write_response:
+                rep[HAP_REPR_STATUS] = HAP_SERVER_STATUS.RESOURCE_DOES_NOT_EXIST
+                continue
 
             if HAP_PERMISSION_NOTIFY in cq:
                 char_topic = get_topic(aid, iid)
@@ -721,8 +1287,15 @@ class AccessoryDriver:
                 )
 
             if HAP_REPR_VALUE in cq:
-                # TODO: status needs to be based on success of set_value
-                char.client_update_value(cq[HAP_REPR_VALUE], client_addr)
+                try:
+                    char.client_update_value(cq[HAP_REPR_VALUE], client_addr)
+                except Exception:  # pylint: disable=broad-except
+                    if not self.write_response:
+                        raise
+                    self._setter_failed([rep])
+                    continue
+                if cq.get(HAP_REPR_WRITE_RESPONSE):
+                    written.append((rep, char))
                 # For some services we want to send all the char value
                 # changes at once.  This resolves an issue where we send
                 # ON and then BRIGHTNESS and the light would go to 100%
@@ -734,17 +1307,104 @@ class AccessoryDriver:
                     service_name = service.display_name
                     service_callbacks.setdefault(aid, {})
                     service_callbacks[aid].setdefault(
-                        service_name, [service.setter_callback, {}]
+                        service_name, [service.setter_callback, {}, []]
                     )
                     service_callbacks[aid][service_name][SERVICE_CALLBACK_DATA][
                         char.display_name
                     ] = cq[HAP_REPR_VALUE]
+                    service_callbacks[aid][service_name][SERVICE_CALLBACK_REPS].append(
+                        rep)
 
-        for aid in service_callbacks:
-            for service_name in service_callbacks[aid]:
-                service_callbacks[aid][service_name][SERVICE_CALLBACK](
-                    service_callbacks[aid][service_name][SERVICE_CALLBACK_DATA]
-                )
+        if self.concurrent_setters and len(service_callbacks) > 1:
+            asyncio.run_coroutine_threadsafe(
+                self.async_run_service_callbacks(service_callbacks), self.loop).result()
+        else:
+            for aid in service_callbacks:
+                for callback, data, callback_reps in service_callbacks[aid].values():
+                    try:
+                        if iscoro(callback):
+                            future = asyncio.run_coroutine_threadsafe(
+                                callback(data), self.loop)
+                            try:
+                                future.result(self.setter_timeout)
+                            except concurrent.futures.TimeoutError:
+                                future.cancel()
+                                raise
+                        else:
+                            callback(data)
+                    except Exception:  # pylint: disable=broad-except
+                        if not self.write_response:
+                            raise
+                        self._setter_failed(callback_reps)
+
+        if not self.write_response:
+            return None
+        for rep, char in written:
+            if rep[HAP_REPR_STATUS] == CHAR_STAT_OK:
+                rep[HAP_REPR_VALUE] = char.get_value()
+        return {HAP_REPR_CHARS: reps}
+
+    async def async_run_service_callbacks(self, service_callbacks):
+        """Run the service callbacks of a write, see set_characteristics.
+
+        The callbacks of each accessory run in order, those of different accessories
+        at the same time. Waits for at most ``setter_timeout`` seconds. The callbacks
+        that have not returned by then are cancelled, or left to finish in the
+        ``callback_executor``, and their characteristics get the service
+        communication failure status. Without ``write_response``, the write fails.
+
+        :param service_callbacks: aid: {service name: [callback, data, reps]}
+        :type service_callbacks: dict
+        """
+        pending = {}  # task: the callbacks of an accessory that have not returned
+        for callbacks in service_callbacks.values():
+            remaining = list(callbacks.values())
+            pending[self.loop.create_task(
+                self._async_run_accessory_callbacks(remaining))] = remaining
+
+        done, not_done = await asyncio.wait(pending, timeout=self.setter_timeout)
+        for task in not_done:
+            task.cancel()
+        for task in done:
+            task.result()  # the error of a callback, without write_response
+        if not not_done:
+            return
+        reps = [rep for task in not_done
+                for _callback, _data, callback_reps in pending[task]
+                for rep in callback_reps]
+        logger.warning("Setting values for characteristics %s timed out.",
+                       [(rep[HAP_REPR_AID], rep[HAP_REPR_IID]) for rep in reps])
+        if not self.write_response:
+            raise asyncio.TimeoutError
+        for rep in reps:
+            rep[HAP_REPR_STATUS] = SERVICE_COMMUNICATION_FAILURE
+
+    async def _async_run_accessory_callbacks(self, callbacks):
+        """Run the service callbacks of an accessory one after the other, removing
+        each from ``callbacks`` once it returned."""
+        while callbacks:
+            callback, data, callback_reps = callbacks[0]
+            try:
+                if iscoro(callback):
+                    await callback(data)
+                else:
+                    await self.loop.run_in_executor(
+                        self.callback_executor, callback, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                if not self.write_response:
+                    raise
+                self._setter_failed(callback_reps)
+            del callbacks[0]
+
+    @staticmethod
+    def _setter_failed(reps):
+        """Log the current exception and report it for the written characteristics."""
+        logger.exception("Error setting value for characteristics %s.",
+                         [(rep[HAP_REPR_AID], rep[HAP_REPR_IID]) for rep in reps])
+        for rep in reps:
+            rep[HAP_REPR_STATUS] = SERVICE_COMMUNICATION_FAILURE
 
     def signal_handler(self, _signal, _frame):
         """Stops the AccessoryDriver for a given signal.
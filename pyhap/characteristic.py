@@ -4,7 +4,9 @@ All things for a HAP characteristic.
 A Characteristic is the smallest unit of the smart home, e.g.
 a temperature measuring or a device status.
 """
+import functools
 import logging
+import time
 
 from uuid import UUID
 
@@ -12,6 +14,8 @@ from pyhap.const import (
     HAP_PERMISSION_READ, HAP_REPR_DESC, HAP_REPR_FORMAT, HAP_REPR_IID,
     HAP_REPR_MAX_LEN, HAP_REPR_PERM, HAP_REPR_TYPE, HAP_REPR_VALUE,
     HAP_REPR_VALID_VALUES)
+from pyhap import tracing
+from pyhap.util import iscoro
 
 logger = logging.getLogger(__name__)
 
@@ -65,11 +69,96 @@ PROP_VALID_VALUES = 'ValidValues'
 
 PROP_NUMERIC = (PROP_MAX_VALUE, PROP_MIN_VALUE, PROP_MIN_STEP, PROP_UNIT)
 
+# ### Getter stale policies ###
+# What get_value does when the cached value of a getter_callback has expired
+GETTER_STALE_REFRESH = 'refresh'  # Call the getter and wait for it
+GETTER_STALE_BACKGROUND = 'background'  # Return the value, refresh it in the background
+
+_NOT_NOTIFIED = object()  # the value a characteristic has not notified yet
+
 
 class CharacteristicError(Exception):
     """Generic exception class for characteristic errors."""
 
 
+def _invalid_value(display_name, value, reason):
+    """Log and raise the error for a value that cannot be converted."""
+    error_msg = '{}: value={} is {}.'.format(display_name, value, reason)
+    logger.error(error_msg)
+    raise ValueError(error_msg)
+
+
+def _to_str(value):
+    return str(value)[:256]
+
+
+def _unchanged(value):
+    return value
+
+
+@functools.lru_cache(maxsize=1024)
+def _valid_values_validator(display_name, valid_values):
+    def validate_valid_values(value):
+        try:
+            valid = value in valid_values
+        except TypeError:  # unhashable, e.g. a list sent by a client
+            valid = False
+        if not valid:
+            _invalid_value(display_name, value, 'an invalid value')
+        return value
+    return validate_valid_values
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _numeric_validator(display_name, max_value, min_value):
+    def validate_numeric(value):
+        if not isinstance(value, (int, float)):
+            _invalid_value(display_name, value, 'not a numeric value')
+        if max_value is not None and value > max_value:
+            value = max_value
+        if min_value is not None and value < min_value:
+            value = min_value
+        return value
+    return validate_numeric
+
+
+@functools.lru_cache(maxsize=1024)
+def _type_id_str(type_id):
+    return str(type_id).upper()
+
+
+def compile_validator(display_name, properties):
+    """Return a function that checks and converts values for the given properties.
+
+    The properties are looked up once, so the returned function only does the work
+    the format requires: a set lookup for valid values, prebound bounds for numbers.
+    Characteristics with the same name and the same relevant properties, e.g. all
+    characteristics of a type, share the same function.
+
+    :param display_name: The name of the characteristic, for the error messages.
+    :type display_name: str
+
+    :param properties: The properties of the characteristic.
+    :type properties: dict
+
+    :return: A function of one value that returns the valid value or raises
+        ValueError.
+    :rtype: callable
+    """
+    fmt = properties[PROP_FORMAT]
+    if properties.get(PROP_VALID_VALUES):
+        return _valid_values_validator(
+            display_name, frozenset(properties[PROP_VALID_VALUES].values()))
+    if fmt == HAP_FORMAT_STRING:
+        return _to_str
+    if fmt == HAP_FORMAT_BOOL:
+        return bool
+    if fmt in HAP_FORMAT_NUMERICS:
+        return _numeric_validator(display_name, properties.get(PROP_MAX_VALUE),
+                                  properties.get(PROP_MIN_VALUE))
+    return _unchanged
+
+
 class Characteristic:
     """Represents a HAP characteristic, the smallest unit of the smart home.
 
@@ -80,7 +169,10 @@ class Characteristic:
     """
 
     __slots__ = ('broker', 'display_name', 'properties', 'type_id',
-                 'value', 'getter_callback', 'setter_callback', 'service', '_uuid_str')
+                 'value', 'getter_callback', 'setter_callback', 'service', '_uuid_str',
+                 '_validator', '_default_value', 'suppress_unchanged_events',
+                 'deadband', 'suppressed_events', '_notified_value', 'getter_ttl',
+                 'getter_stale_policy', '_value_expiry', '_refresh_scheduled')
 
     def __init__(self, display_name, type_id, properties):
         """Initialise with the given properties.
@@ -100,62 +192,129 @@ class Characteristic:
         self.display_name = display_name
         self.properties = properties
         self.type_id = type_id
-        self.value = self._get_default_value()
+        self._compile_validator()
+        self.value = self._default_value
         self.getter_callback = None
         self.setter_callback = None
         self.service = None
-        self._uuid_str = str(type_id).upper()
+        self._uuid_str = _type_id_str(type_id)  # shared by the type
+        # Whether set_value drops notifications of the last notified value. None
+        # follows the suppress_unchanged_events option of the AccessoryDriver.
+        self.suppress_unchanged_events = None
+        # For the float format, changes up to this size also count as unchanged.
+        self.deadband = 0
+        self.suppressed_events = 0
+        self._notified_value = _NOT_NOTIFIED
+        # The time, in seconds, for which a value from getter_callback is reused.
+        # None calls the getter on every read.
+        self.getter_ttl = None
+        self.getter_stale_policy = GETTER_STALE_REFRESH
+        self._value_expiry = None  # monotonic time, None if the getter was not called
+        self._refresh_scheduled = False
 
     def __repr__(self):
         """Return the representation of the characteristic."""
         return '<characteristic display_name={} value={} properties={}>' \
-            .format(self.display_name, self.value, self.properties)
+            .format(self.display_name, self.value, dict(self.properties))
 
-    def _get_default_value(self):
-        """Return default value for format."""
+    def _compile_validator(self):
+        """Build the validator and the default value from the current properties.
+
+        Called whenever the properties are set through the characteristic, i.e. at
+        creation and in `override_properties`, which is the way to change them: the
+        properties of characteristics from the Loader are read-only.
+        """
+        self._validator = compile_validator(self.display_name, self.properties)
         if self.properties.get(PROP_VALID_VALUES):
-            return min(self.properties[PROP_VALID_VALUES].values())
+            self._default_value = min(self.properties[PROP_VALID_VALUES].values())
+        else:
+            self._default_value = self._validator(
+                HAP_FORMAT_DEFAULTS[self.properties[PROP_FORMAT]])
 
-        value = HAP_FORMAT_DEFAULTS[self.properties[PROP_FORMAT]]
-        return self.to_valid_value(value)
+    def _get_default_value(self):
+        """Return default value for format."""
+        return self._default_value
 
     def get_value(self):
         """This is to allow for calling `getter_callback`
 
+        A coroutine `getter_callback` cannot be awaited here, so the last value is
+        returned instead. The AccessoryDriver awaits it when clients read the value.
+
+        With a `getter_ttl`, the value of the getter is reused until it expires, see
+        `use_cached_value`.
+
         :return: Current Characteristic Value
         """
-        if self.getter_callback:
-            # pylint: disable=not-callable
-            self.value = self.to_valid_value(value=self.getter_callback())
+        if self.getter_callback and not iscoro(self.getter_callback) \
+                and not self.use_cached_value():
+            with tracing.span('characteristic.getter',
+                              characteristic=self.display_name):
+                value = self.getter_callback()  # pylint: disable=not-callable
+            self.set_getter_value(value)
+        return self.value
+
+    def use_cached_value(self):
+        """Return whether a read can use the current value instead of the getter.
+
+        That is while the value from the getter is younger than `getter_ttl` or, with
+        the GETTER_STALE_BACKGROUND policy, once it expired. The expired value is then
+        refreshed in the background, from the loop of the AccessoryDriver.
+        """
+        if self.getter_ttl is None or self._value_expiry is None:
+            return False
+        if time.monotonic() < self._value_expiry:
+            return True
+        if self.getter_stale_policy != GETTER_STALE_BACKGROUND or not self.broker:
+            return False
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            if iscoro(self.getter_callback):
+                self.broker.driver.add_job(self._async_refresh_value)
+            else:
+                self.broker.driver.add_job(self._refresh_value)
+        return True
+
+    def set_getter_value(self, value):
+        """Validate and store a value returned by `getter_callback`.
+
+        :return: The valid value.
+        """
+        self.value = self.to_valid_value(value)
+        if self.getter_ttl is not None:
+            self._value_expiry = time.monotonic() + self.getter_ttl
         return self.value
 
+    def _refresh_value(self):
+        """Call the getter in the background, see `use_cached_value`."""
+        try:
+            # pylint: disable=not-callable
+            self.set_getter_value(self.getter_callback())
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('%s: refreshing the value failed.', self.display_name)
+        finally:
+            self._refresh_scheduled = False
+
+    async def _async_refresh_value(self):
+        """Await the getter in the background, see `use_cached_value`."""
+        try:
+            # pylint: disable=not-callable
+            self.set_getter_value(await self.getter_callback())
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('%s: refreshing the value failed.', self.display_name)
+        finally:
+            self._refresh_scheduled = False
+
     def to_valid_value(self, value):
         """Perform validation and conversion to valid value."""
-        if self.properties.get(PROP_VALID_VALUES):
-            if value not in self.properties[PROP_VALID_VALUES].values():
-                error_msg = '{}: value={} is an invalid value.' \
-                            .format(self.display_name, value)
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-        elif self.properties[PROP_FORMAT] == HAP_FORMAT_STRING:
-            value = str(value)[:256]
-        elif self.properties[PROP_FORMAT] == HAP_FORMAT_BOOL:
-            value = bool(value)
-        elif self.properties[PROP_FORMAT] in HAP_FORMAT_NUMERICS:
-            if not isinstance(value, (int, float)):
-                error_msg = '{}: value={} is not a numeric value.' \
-                            .format(self.display_name, value)
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-            value = min(self.properties.get(PROP_MAX_VALUE, value), value)
-            value = max(self.properties.get(PROP_MIN_VALUE, value), value)
-        return value
+        return self._validator(value)
 
     def override_properties(self, properties=None, valid_values=None):
         """Override characteristic property values and valid values.
 
         :param properties: Dictionary with values to override the existing
-            properties. Only changed values are required.
+            properties. Only changed values are required. A value of None removes
+            the property.
         :type properties: dict
 
         :param valid_values: Dictionary with values to override the existing
@@ -166,16 +325,26 @@ class Characteristic:
             raise ValueError(
                 'No properties or valid_values specified to override.')
 
+        # The properties may be shared with other characteristics of the same type,
+        # see Loader, so they are replaced rather than changed.
+        self.properties = dict(self.properties)
         if properties:
-            self.properties.update(properties)
+            for key, value in properties.items():
+                if value is None:
+                    self.properties.pop(key, None)
+                else:
+                    self.properties[key] = value
 
         if valid_values:
             self.properties[PROP_VALID_VALUES] = valid_values
 
+        self._compile_validator()
         try:
             self.value = self.to_valid_value(self.value)
         except ValueError:
             self.value = self._get_default_value()
+        if self.broker:
+            self.broker.driver.accessories_changed()
 
     def set_value(self, value, should_notify=True):
         """Set the given raw value. It is checked if it is a valid value.
@@ -200,8 +369,28 @@ class Characteristic:
         value = self.to_valid_value(value)
         self.value = value
         if should_notify and self.broker:
+            if self._is_unchanged(value):
+                self.suppressed_events += 1
+                return
             self.notify()
 
+    def _is_unchanged(self, value):
+        """Return whether notifying the value can be skipped.
+
+        That is if unchanged events are suppressed and the value equals the last
+        notified value, or for floats, differs from it by at most `deadband`.
+        """
+        suppress = self.suppress_unchanged_events
+        if suppress is None:
+            suppress = self.broker.driver.suppress_unchanged_events
+        if not suppress or self._notified_value is _NOT_NOTIFIED:
+            return False
+        if value == self._notified_value:
+            return True
+        return bool(self.deadband) \
+            and self.properties[PROP_FORMAT] == HAP_FORMAT_FLOAT \
+            and abs(value - self._notified_value) <= self.deadband
+
     def client_update_value(self, value, sender_client_addr=None):
         """Called from broker for value change in Home app.
 
@@ -212,8 +401,9 @@ class Characteristic:
         self.value = value
         self.notify(sender_client_addr)
         if self.setter_callback:
-            # pylint: disable=not-callable
-            self.setter_callback(value)
+            with tracing.span('characteristic.setter',
+                              characteristic=self.display_name):
+                self.setter_callback(value)  # pylint: disable=not-callable
 
     def notify(self, sender_client_addr=None):
         """Notify clients about a value change. Sends the value.
@@ -221,6 +411,7 @@ class Characteristic:
         .. seealso:: accessory.publish
         .. seealso:: accessory_driver.publish
         """
+        self._notified_value = self.value
         self.broker.publish(self.value, self, sender_client_addr)
 
     # pylint: disable=invalid-name
@@ -240,7 +431,6 @@ class Characteristic:
             HAP_REPR_FORMAT: self.properties[PROP_FORMAT],
         }
 
-        value = self.get_value()
         if self.properties[PROP_FORMAT] in HAP_FORMAT_NUMERICS:
             hap_rep.update({k: self.properties[k] for k in
                             self.properties.keys() & PROP_NUMERIC})
@@ -248,12 +438,24 @@ class Characteristic:
             if PROP_VALID_VALUES in self.properties:
                 hap_rep[HAP_REPR_VALID_VALUES] = \
                     sorted(self.properties[PROP_VALID_VALUES].values())
-        elif self.properties[PROP_FORMAT] == HAP_FORMAT_STRING:
+        hap_rep.update(self.value_to_HAP())
+
+        return hap_rep
+
+    def value_to_HAP(self):
+        """Create the part of the HAP representation that depends on the value.
+
+        :return: The value, if it is readable, and the maximum length of strings
+            longer than the default one.
+        :rtype: dict
+        """
+        hap_rep = {}
+        value = self.get_value()
+        if self.properties[PROP_FORMAT] == HAP_FORMAT_STRING:
             if len(value) > 64:
                 hap_rep[HAP_REPR_MAX_LEN] = min(len(value), 256)
         if HAP_PERMISSION_READ in self.properties[PROP_PERMISSIONS]:
             hap_rep[HAP_REPR_VALUE] = value
-
         return hap_rep
 
     @classmethod
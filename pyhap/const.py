@@ -73,3 +73,4 @@ HAP_REPR_STATUS = 'status'
 HAP_REPR_TYPE = 'type'
 HAP_REPR_VALUE = 'value'
 HAP_REPR_VALID_VALUES = 'valid-values'
+HAP_REPR_WRITE_RESPONSE = 'r'
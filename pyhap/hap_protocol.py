@@ -0,0 +1,397 @@
+"""This module implements the asyncio transport of HAP.
+
+The AsyncHAPServer accepts connections on the event loop of the AccessoryDriver, so a
+connected HAP client does not hold a dedicated thread.
+The HAPServerProtocol parses the incoming HTTP requests of a single connection and
+manages its "TLS" once pair verify is complete.
+The HAPConnectionHandler runs the request methods of the HAPServerHandler, so the
+HANDLERS dispatch table and the pairing flows are shared with the threaded server.
+"""
+import asyncio
+from http import HTTPStatus
+import http.client
+import io
+import logging
+
+from cryptography.exceptions import InvalidTag
+
+from pyhap import tracing
+from pyhap.const import __version__
+from pyhap.hap_server import (
+    EVENT_OVERFLOW_POLICY, ClientEventQueue, HAPCrypto, HAPServer, HAPServerHandler)
+
+logger = logging.getLogger(__name__)
+
+
+class HAPConnectionHandler(HAPServerHandler):
+    """Handles the requests of a single connection without owning its socket.
+
+    Responses are buffered and returned to the HAPServerProtocol, which writes them
+    from the event loop.
+    """
+
+    def __init__(self, server, client_addr, accessory_handler):  # pylint: disable=super-init-not-called
+        """
+        @param server: The server that accepted the connection.
+        @type server: AsyncHAPServer
+
+        @param accessory_handler: An object that controls an accessory's state.
+        @type accessory_handler: AccessoryDriver
+        """
+        # BaseHTTPRequestHandler.__init__ would start reading from a socket, so only
+        # the attributes the request methods rely on are set here.
+        self.server = server
+        self.client_address = client_addr
+        self.accessory_handler = accessory_handler
+        self.state = self.accessory_handler.state
+        self.enc_context = None
+        self.is_encrypted = False
+        self.server_version = 'pyhap/' + __version__
+        self.protocol_version = 'HTTP/1.1'
+        self.request_version = 'HTTP/1.1'
+        self.status_code = None
+        self.shared_key = None  # Set once pair verify succeeds
+        self.command = None
+        self.path = None
+        self.requestline = None
+        self.headers = None
+        self.rfile = None
+        self._headers_buffer = []
+        self._response = []
+
+    def handle_request(self, command, path, headers, body):
+        """Dispatch a parsed request and return the response bytes.
+
+        @param headers: The request headers.
+        @type headers: http.client.HTTPMessage
+
+        @param body: The request body.
+        @type body: bytes
+        """
+        self.command = command
+        self.path = path
+        self.requestline = '{} {} {}'.format(command, path, self.request_version)
+        self.headers = headers
+        self.rfile = io.BytesIO(body)
+        self._headers_buffer = []
+        self._response = []
+        self.dispatch()
+        return b"".join(self._response)
+
+    def end_response(self, bytesdata):
+        """Combine the headers and the data into a single response."""
+        if self.status_code != HTTPStatus.NO_CONTENT:
+            self.send_header("Content-Length", len(bytesdata))
+        self._response.append(b"".join(self._headers_buffer) + b"\r\n" + bytesdata)
+        self._headers_buffer = []
+
+    def _upgrade_reader_to_encrypted(self):
+        """Make the shared key of pair verify available to the protocol.
+
+        The protocol switches to encrypted transport once the final unencrypted
+        response is written.
+        """
+        self.shared_key = self.enc_context["shared_key"]
+
+    def _upgrade_writer_to_encrypted(self):
+        """Mark the connection as encrypted."""
+        self.is_encrypted = True
+
+
+class HAPServerProtocol(asyncio.Protocol):
+    """An asyncio protocol for a single HAP connection.
+
+    Requests are parsed from the received data and handled one at a time in the
+    executor, since they may call blocking user callbacks. Responses and events are
+    written from the event loop, which is also the only place the encryption state is
+    touched.
+
+    Events are queued in a ClientEventQueue and only written while the transport
+    accepts more data, so a client that stops reading cannot grow the write buffer
+    without bound. Likewise, the connection is closed when a client sends more headers
+    or a larger body than the limits below, like the threaded HAPServer does.
+    """
+
+    MAX_HEADER_SIZE = 64 * 1024
+    """The maximum size of the request line and headers of a request, in bytes."""
+
+    MAX_HEADERS = 100
+    """The maximum number of headers of a request."""
+
+    MAX_BODY_SIZE = 1024 * 1024
+    """The maximum Content-Length of a request, in bytes."""
+
+    def __init__(self, loop, server):
+        """
+        @param loop: The event loop the connection is served from.
+        @type loop: asyncio.AbstractEventLoop
+
+        @param server: The server that accepted the connection.
+        @type server: AsyncHAPServer
+        """
+        self.loop = loop
+        self.server = server
+        self.transport = None
+        self.peername = None
+        self.handler = None
+        self.hap_crypto = None
+        self.event_queue = ClientEventQueue(server.event_queue_size,
+                                            server.event_overflow_policy)
+        self._writing_paused = False
+        self._request_buffer = bytearray()  # Decrypted, not yet handled data
+        self._header_scan_start = 0  # Where to look for the end of the headers
+        self._request_future = None
+
+    def connection_made(self, transport):
+        """Register the connection with the server."""
+        self.transport = transport
+        self.peername = transport.get_extra_info('peername')
+        logger.info("Got connection with %s.", self.peername)
+        self.handler = HAPConnectionHandler(self.server, self.peername,
+                                            self.server.accessory_handler)
+        self.server.connections[self.peername] = self
+
+    def connection_lost(self, exc):
+        """Forget the connection."""
+        logger.debug('Connection to %s lost: %s', self.peername, exc)
+        self.close()
+
+    def close(self):
+        """Close the connection and remove it and its subscriptions from the server."""
+        if self.server.connections.get(self.peername) is self:
+            del self.server.connections[self.peername]
+            self.server.accessory_handler.unsubscribe_client(self.peername)
+        self.event_queue.close()
+        self.transport.close()
+
+    def pause_writing(self):
+        """Stop writing events until the transport has drained."""
+        logger.debug('Pausing events to %s.', self.peername)
+        self._writing_paused = True
+
+    def resume_writing(self):
+        """Write the events queued while the transport was full."""
+        logger.debug('Resuming events to %s.', self.peername)
+        self._writing_paused = False
+        self._send_queued_events()
+
+    def data_received(self, data):
+        """Buffer the received data and handle any complete request."""
+        if self.hap_crypto is None:
+            self._request_buffer += data
+        else:
+            try:
+                with tracing.span('hap.protocol.decrypt', bytes=len(data)):
+                    self.hap_crypto.receive_data(data)
+                    self._request_buffer += self.hap_crypto.decrypt()
+            except InvalidTag:
+                logger.debug('Decryption failed for %s, closing connection.',
+                             self.peername)
+                self.close()
+                return
+        if len(self._request_buffer) > self.MAX_HEADER_SIZE + self.MAX_BODY_SIZE:
+            logger.debug('Too much unhandled data from %s, closing connection.',
+                         self.peername)
+            self.close()
+            return
+        self._process_next_request()
+
+    def queue_event(self, data, topics=()):
+        """Queue an EVENT message for the client and write it if possible."""
+        if self.transport.is_closing():
+            return
+        if not self.event_queue.put(data, topics):
+            logger.debug('Event queue of %s overflowed, closing connection.',
+                         self.peername)
+            self.close()
+            return
+        self._send_queued_events()
+
+    def _send_queued_events(self):
+        """Write the queued events until the transport asks to pause."""
+        while not self._writing_paused and not self.transport.is_closing():
+            data = self.event_queue.get_nowait()
+            if data is None:
+                return
+            self._write(data)
+
+    @tracing.traced('hap.protocol.write')
+    def _write(self, data):
+        """Encrypt if the session is encrypted and write to the transport."""
+        if self.hap_crypto is not None:
+            data = self.hap_crypto.encrypt(data)
+        self.transport.write(data)
+
+    def _parse_request(self):
+        """Remove and return the next complete request from the request buffer.
+
+        :return: A (command, path, headers, body) tuple or None if no complete
+            request has been received yet.
+
+        :raises ValueError: When the request is malformed or exceeds the limits.
+        """
+        header_end = self._request_buffer.find(b"\r\n\r\n", self._header_scan_start)
+        if header_end == -1:
+            if len(self._request_buffer) > self.MAX_HEADER_SIZE:
+                raise ValueError("Headers exceed %d bytes" % self.MAX_HEADER_SIZE)
+            # Only the data received next, and the end of this data, needs scanning.
+            self._header_scan_start = max(0, len(self._request_buffer) - 3)
+            return None
+        self._header_scan_start = header_end
+        if header_end > self.MAX_HEADER_SIZE:
+            raise ValueError("Headers exceed %d bytes" % self.MAX_HEADER_SIZE)
+        request_line, _, header_lines = \
+            bytes(self._request_buffer[:header_end + 4]).partition(b"\r\n")
+        command, path, _version = request_line.decode("latin-1").split()
+        if header_lines.count(b"\r\n") > self.MAX_HEADERS + 1:
+            raise ValueError("More than %d headers" % self.MAX_HEADERS)
+        headers = http.client.parse_headers(io.BytesIO(header_lines))
+
+        content_length = int(headers.get("Content-Length", 0))
+        if not 0 <= content_length <= self.MAX_BODY_SIZE:
+            raise ValueError("Invalid Content-Length %d" % content_length)
+        body_start = header_end + 4
+        body_end = body_start + content_length
+        if len(self._request_buffer) < body_end:
+            return None
+        body = bytes(self._request_buffer[body_start:body_end])
+        del self._request_buffer[:body_end]
+        self._header_scan_start = 0
+        return command, path, headers, body
+
+    def _process_next_request(self):
+        """Hand the next complete request to the handler, one at a time."""
+        if self._request_future is not None or self.transport.is_closing():
+            return
+        try:
+            request = self._parse_request()
+        except ValueError:
+            logger.debug('Malformed request from %s, closing connection.',
+                         self.peername, exc_info=True)
+            self.close()
+            return
+        if request is None:
+            return
+        self._request_future = self.loop.run_in_executor(
+            None, self.handler.handle_request, *request)
+        self._request_future.add_done_callback(self._handle_response)
+
+    def _handle_response(self, future):
+        """Write the response and switch to encrypted transport if negotiated."""
+        self._request_future = None
+        if self.transport.is_closing():
+            return
+        try:
+            response = future.result()
+        except Exception:  # pylint: disable=broad-except
+            logger.debug('Failed to handle request from %s, closing connection.',
+                         self.peername, exc_info=True)
+            self.close()
+            return
+
+        self._write(response)
+
+        if self.hap_crypto is None and self.handler.shared_key is not None:
+            logger.debug("Switching %s to encrypted transport.", self.peername)
+            self.hap_crypto = HAPCrypto(self.handler.shared_key)
+            # Anything received after the pair verify request is already encrypted.
+            pending = bytes(self._request_buffer)
+            self._request_buffer.clear()
+            if pending:
+                self.data_received(pending)
+                return
+
+        self._process_next_request()
+
+
+class AsyncHAPServer:
+    """Point of contact for HAP clients, served from the event loop.
+
+    The AsyncHAPServer handles all incoming client requests (e.g. pair) and also
+    handles communication from Accessories to clients (value changes), like the
+    threaded HAPServer, but without a thread per connection.
+    """
+
+    def __init__(self, addr_port, accessory_handler, event_queue_size=100,
+                 event_overflow_policy=EVENT_OVERFLOW_POLICY.DROP_OLDEST):
+        """
+        @param addr_port: The (address, port) tuple to listen on.
+        @type addr_port: tuple <str, int>
+
+        @param accessory_handler: An object that controls an accessory's state.
+        @type accessory_handler: AccessoryDriver
+
+        @param event_queue_size: The number of events queued for a client that does
+            not keep up before the overflow policy applies.
+        @type event_queue_size: int
+
+        @param event_overflow_policy: One of the EVENT_OVERFLOW_POLICY values.
+        @type event_overflow_policy: str
+        """
+        self.addr_port = addr_port
+        self.accessory_handler = accessory_handler
+        self.event_queue_size = event_queue_size
+        self.event_overflow_policy = event_overflow_policy
+        self.connections = {}  # (address, port): HAPServerProtocol
+        self.loop = None
+        self.server = None
+
+    async def async_start(self, loop):
+        """Start listening for connections on the given event loop."""
+        self.loop = loop
+        self.server = await loop.create_server(
+            lambda: HAPServerProtocol(loop, self),
+            self.addr_port[0], self.addr_port[1])
+
+    async def async_stop(self):
+        """Stop listening and close all connections."""
+        logger.info('Stopping HAP server')
+        self.server.close()
+        for protocol in list(self.connections.values()):
+            protocol.close()
+        self.connections.clear()
+        await self.server.wait_closed()
+
+    def get_event_queue_stats(self):
+        """Return the statistics of the event queue of every client.
+
+        :return: A dict of client (address, port) tuple to the ClientEventQueue stats.
+        :rtype: dict
+        """
+        return {client_addr: protocol.event_queue.get_stats()
+                for client_addr, protocol in list(self.connections.items())}
+
+    def get_connection_stats(self):
+        """Return the number of connections and of those with an encrypted session.
+
+        :rtype: dict
+        """
+        protocols = list(self.connections.values())
+        return {'connections': len(protocols),
+                'encrypted': sum(1 for protocol in protocols
+                                 if protocol.hap_crypto is not None)}
+
+    def push_event(self, bytesdata, client_addr, topics=()):
+        """Queue an event for the current connection with the provided data.
+
+        Thread-safe; the event is written from the event loop.
+
+        :param bytesdata: The data to send.
+        :type bytesdata: bytes
+
+        :param client_addr: A client (address, port) tuple to which to send the data.
+        :type client_addr: tuple <str, int>
+
+        :param topics: The topics with a value in the data, used to coalesce events.
+        :type topics: iterable
+
+        :return: True if the client is connected, False otherwise.
+        :rtype: bool
+        """
+        protocol = self.connections.get(client_addr)
+        if protocol is None:
+            logger.debug('No connection for %s', client_addr)
+            return False
+        self.loop.call_soon_threadsafe(
+            protocol.queue_event, HAPServer.create_hap_event(bytesdata), topics)
+        return True
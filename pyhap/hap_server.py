@@ -3,6 +3,10 @@
 The HAPServer is the point of contact to and from the world.
 The HAPServerHandler manages the state of the connection and handles incoming requests.
 The HAPSocket is a socket implementation that manages the "TLS" of the connection.
+The HAPCrypto implements the "TLS" framing itself, independently of any socket.
+
+The HAPServer serves each connection from its own thread. This is the legacy mode of
+the AccessoryDriver; by default it uses the asyncio-based server in pyhap.hap_protocol.
 """
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from http import HTTPStatus
@@ -11,11 +15,15 @@ import socket
 import struct
 import json
 import errno
+import os
 import uuid
 from urllib.parse import urlparse, parse_qs
 import socketserver
 import threading
+import time
+from collections import deque
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
@@ -25,8 +33,10 @@ import curve25519
 import ed25519
 
 import pyhap.tlv as tlv
+from pyhap import tracing
 from pyhap.util import long_to_bytes
-from pyhap.const import __version__
+from pyhap.const import (
+    __version__, HAP_REPR_CHARS, HAP_REPR_STATUS, HAP_REPR_VALUE)
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +54,7 @@ class HAP_TLV_TAGS:
     SEQUENCE_NUM = b'\x06'
     ERROR_CODE = b'\x07'
     PROOF = b'\x0A'
+    SESSION_ID = b'\x0E'
 
 
 # Status codes for underlying HAP calls
@@ -68,6 +79,13 @@ class HAP_OPERATION_CODE:
     INVALID_SIGNATURE = b'\x04'
 
 
+# What to do when the event queue of a client is full
+class EVENT_OVERFLOW_POLICY:
+    DROP_OLDEST = 'drop_oldest'  # Discard the oldest queued event
+    COALESCE = 'coalesce'  # Discard queued events superseded by the new one
+    DISCONNECT = 'disconnect'  # Close the connection of the client
+
+
 class HAP_CRYPTO:
     HKDF_KEYLEN = 32  # bytes, length of expanded HKDF keys
     HKDF_HASH = hashes.SHA512()  # Hash function to use in key expansion
@@ -92,6 +110,38 @@ def hap_hkdf(key, salt, info):
     return hkdf.derive(key)
 
 
+class HandshakeKeys:
+    """The keys derived from the shared secret of one pair setup or pair verify.
+
+    Each (salt, info) key is derived at most once and each cipher is created at most
+    once, however many steps of the handshake use them.
+    """
+
+    def __init__(self, input_key):
+        """
+        @param input_key: The shared secret to expand, e.g. the SRP session key.
+        @type input_key: bytes
+        """
+        self.input_key = input_key
+        self._keys = {}  # (salt, info): key
+        self._ciphers = {}  # (salt, info): ChaCha20Poly1305
+
+    def key(self, salt, info):
+        """Return the key expanded from the shared secret with the salt and info."""
+        key = self._keys.get((salt, info))
+        if key is None:
+            key = self._keys[(salt, info)] = hap_hkdf(self.input_key, salt, info)
+        return key
+
+    def cipher(self, salt, info):
+        """Return a ChaCha20Poly1305 keyed with ``key(salt, info)``."""
+        cipher = self._ciphers.get((salt, info))
+        if cipher is None:
+            cipher = self._ciphers[(salt, info)] = \
+                ChaCha20Poly1305(self.key(salt, info))
+        return cipher
+
+
 class TimeoutException(Exception):
     pass
 
@@ -146,6 +196,17 @@ class HAPServerHandler(BaseHTTPRequestHandler):
 
     PVERIFY_2_NONCE = _pad_tls_nonce(b"PV-Msg03")
 
+    PVERIFY_SESSION_ID_SALT = b"Pair-Verify-ResumeSessionID-Salt"
+    PVERIFY_SESSION_ID_INFO = b"Pair-Verify-ResumeSessionID-Info"
+    SESSION_ID_LENGTH = 8
+
+    PRESUME_METHOD = b'\x06'
+    PRESUME_REQUEST_INFO = b"Pair-Resume-Request-Info"
+    PRESUME_REQUEST_NONCE = _pad_tls_nonce(b"PR-Msg01")
+    PRESUME_RESPONSE_INFO = b"Pair-Resume-Response-Info"
+    PRESUME_RESPONSE_NONCE = _pad_tls_nonce(b"PR-Msg02")
+    PRESUME_SHARED_SECRET_INFO = b"Pair-Resume-Shared-Secret-Info"
+
     def __init__(self, sock, client_addr, server, accessory_handler):
         """
         @param accessory_handler: An object that controls an accessory's state.
@@ -172,7 +233,7 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         logger.info("%s - %s", self.address_string(), format % args)
 
     def _set_encryption_ctx(self, client_public, private_key, public_key, shared_key,
-                            pre_session_key):
+                            keys):
         """Sets the encryption context.
 
         The encryption context is generated in pair verify step one and is used to
@@ -187,16 +248,16 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         @param shared_key: The resulted session key.
         @type shared_key: bytes
 
-        @param pre_session_key: The key used during session negotiation
-            (pair verify one and two).
-        @type pre_session_key: bytes
+        @param keys: The keys derived from the shared key during session
+            negotiation (pair verify one and two).
+        @type keys: HandshakeKeys
         """
         self.enc_context = {
             "client_public": client_public,
             "private_key": private_key,
             "public_key": public_key,
             "shared_key": shared_key,
-            "pre_session_key": pre_session_key
+            "keys": keys
         }
 
     def _upgrade_reader_to_encrypted(self):
@@ -271,6 +332,15 @@ class HAPServerHandler(BaseHTTPRequestHandler):
                      self.command, self.client_address, self.path)
         path = urlparse(self.path).path
         assert path in self.HANDLERS[self.command]
+        start = time.monotonic()
+        with tracing.span('hap.request', method=self.command, path=path) as span:
+            self._dispatch(path)
+            span.set_attribute('status', self.status_code)
+        self.accessory_handler.request_duration.labels(self.command, path).observe(
+            time.monotonic() - start)
+
+    def _dispatch(self, path):
+        """Call the handler method of the path and answer any error with a status."""
         try:
             getattr(self, self.HANDLERS[self.command][path])()
         except NotAllowedInStateException:
@@ -364,10 +434,9 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         encrypted_data = tlv_objects[HAP_TLV_TAGS.ENCRYPTED_DATA]
 
         session_key = self.accessory_handler.srp_verifier.get_session_key()
-        hkdf_enc_key = hap_hkdf(long_to_bytes(session_key),
-                                self.PAIRING_3_SALT, self.PAIRING_3_INFO)
+        keys = HandshakeKeys(long_to_bytes(session_key))
 
-        cipher = ChaCha20Poly1305(hkdf_enc_key)
+        cipher = keys.cipher(self.PAIRING_3_SALT, self.PAIRING_3_INFO)
         decrypted_data = cipher.decrypt(self.PAIRING_3_NONCE, bytes(encrypted_data), b"")
         assert decrypted_data is not None
 
@@ -376,9 +445,9 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         client_ltpk = dec_tlv_objects[HAP_TLV_TAGS.PUBLIC_KEY]
         client_proof = dec_tlv_objects[HAP_TLV_TAGS.PROOF]
 
-        self._pairing_four(client_username, client_ltpk, client_proof, hkdf_enc_key)
+        self._pairing_four(client_username, client_ltpk, client_proof, keys)
 
-    def _pairing_four(self, client_username, client_ltpk, client_proof, encryption_key):
+    def _pairing_four(self, client_username, client_ltpk, client_proof, keys):
         """Expand the SRP session key to obtain a new key.
             Use it to verify that the client's proof of the private key. Continue to
             step five.
@@ -392,13 +461,11 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         @param client_proof: The client's proof of password.
         @type client_proof: bytes
 
-        @param encryption_key: The encryption key for this step.
-        @type encryption_key: bytes
+        @param keys: The keys derived from the SRP session key.
+        @type keys: HandshakeKeys
         """
         logger.debug("Pairing [4/5]")
-        session_key = self.accessory_handler.srp_verifier.get_session_key()
-        output_key = hap_hkdf(long_to_bytes(session_key),
-                              self.PAIRING_4_SALT, self.PAIRING_4_INFO)
+        output_key = keys.key(self.PAIRING_4_SALT, self.PAIRING_4_INFO)
 
         data = output_key + client_username + client_ltpk
         verifying_key = ed25519.VerifyingKey(client_ltpk)
@@ -409,18 +476,16 @@ class HAPServerHandler(BaseHTTPRequestHandler):
             logger.error("Bad signature, abort.")
             raise
 
-        self._pairing_five(client_username, client_ltpk, encryption_key)
+        self._pairing_five(client_username, client_ltpk, keys)
 
-    def _pairing_five(self, client_username, client_ltpk, encryption_key):
+    def _pairing_five(self, client_username, client_ltpk, keys):
         """At that point we know the client has the accessory password and has a valid key
         pair. Add it as a pair and send a sever proof.
 
         Parameters are as for _pairing_four.
         """
         logger.debug("Pairing [5/5]")
-        session_key = self.accessory_handler.srp_verifier.get_session_key()
-        output_key = hap_hkdf(long_to_bytes(session_key),
-                              self.PAIRING_5_SALT, self.PAIRING_5_INFO)
+        output_key = keys.key(self.PAIRING_5_SALT, self.PAIRING_5_INFO)
 
         server_public = self.state.public_key.to_bytes()
         mac = self.state.mac.encode()
@@ -433,7 +498,8 @@ class HAPServerHandler(BaseHTTPRequestHandler):
                              HAP_TLV_TAGS.PUBLIC_KEY, server_public,
                              HAP_TLV_TAGS.PROOF, server_proof)
 
-        cipher = ChaCha20Poly1305(encryption_key)
+        # The messages in both directions use the same key, see _pairing_three
+        cipher = keys.cipher(self.PAIRING_3_SALT, self.PAIRING_3_INFO)
         aead_message = bytes(
             cipher.encrypt(self.PAIRING_5_NONCE, bytes(message), b""))
 
@@ -453,7 +519,8 @@ class HAPServerHandler(BaseHTTPRequestHandler):
     def handle_pair_verify(self):
         """Handles arbitrary step of the pair verify process.
 
-        Pair verify is session negotiation.
+        Pair verify is session negotiation. A controller that had a session before can
+        instead resume it in the first step, see ``_pair_resume``.
         """
         if not self.state.paired:
             raise NotAllowedInStateException
@@ -462,6 +529,9 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         tlv_objects = tlv.decode(self.rfile.read(length))
         sequence = tlv_objects[HAP_TLV_TAGS.SEQUENCE_NUM]
         if sequence == b'\x01':
+            if tlv_objects.get(HAP_TLV_TAGS.REQUEST_TYPE) == self.PRESUME_METHOD \
+                    and self._pair_resume(tlv_objects):
+                return
             self._pair_verify_one(tlv_objects)
         elif sequence == b'\x03':
             self._pair_verify_two(tlv_objects)
@@ -475,6 +545,7 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         @type tlv_object: dict
         """
         logger.debug("Pair verify [1/2].")
+        start = time.monotonic()
         client_public = tlv_objects[HAP_TLV_TAGS.PUBLIC_KEY]
 
         private_key = curve25519.Private()
@@ -488,15 +559,15 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         material = public_key.serialize() + mac + client_public
         server_proof = self.state.private_key.sign(material)
 
-        output_key = hap_hkdf(shared_key, self.PVERIFY_1_SALT, self.PVERIFY_1_INFO)
-
+        keys = HandshakeKeys(shared_key)
         self._set_encryption_ctx(client_public, private_key, public_key,
-                                 shared_key, output_key)
+                                 shared_key, keys)
+        self.enc_context["start"] = start
 
         message = tlv.encode(HAP_TLV_TAGS.USERNAME, mac,
                              HAP_TLV_TAGS.PROOF, server_proof)
 
-        cipher = ChaCha20Poly1305(output_key)
+        cipher = keys.cipher(self.PVERIFY_1_SALT, self.PVERIFY_1_INFO)
         aead_message = bytes(
             cipher.encrypt(self.PVERIFY_1_NONCE, bytes(message), b""))
         data = tlv.encode(HAP_TLV_TAGS.SEQUENCE_NUM, b'\x02',
@@ -514,7 +585,8 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         """
         logger.debug("Pair verify [2/2]")
         encrypted_data = tlv_objects[HAP_TLV_TAGS.ENCRYPTED_DATA]
-        cipher = ChaCha20Poly1305(self.enc_context["pre_session_key"])
+        cipher = self.enc_context["keys"].cipher(self.PVERIFY_1_SALT,
+                                                 self.PVERIFY_1_INFO)
         decrypted_data = cipher.decrypt(self.PVERIFY_2_NONCE, bytes(encrypted_data), b"")
         assert decrypted_data is not None  # TODO:
 
@@ -549,6 +621,14 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         logger.debug("Pair verify with client '%s' completed. Switching to "
                      "encrypted transport.", self.client_address)
 
+        session_id = self.enc_context["keys"].key(
+            self.PVERIFY_SESSION_ID_SALT,
+            self.PVERIFY_SESSION_ID_INFO)[:self.SESSION_ID_LENGTH]
+        self.accessory_handler.session_cache.add(
+            session_id, self.enc_context["shared_key"], client_uuid)
+        self.accessory_handler.pair_verify_duration.observe(
+            time.monotonic() - self.enc_context["start"])
+
         data = tlv.encode(HAP_TLV_TAGS.SEQUENCE_NUM, b'\x04')
         self.send_response(200)
         self.send_header("Content-Type", self.PAIRING_RESPONSE_TYPE)
@@ -557,13 +637,81 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         self._upgrade_writer_to_encrypted()
         del self.enc_context
 
+    def _pair_resume(self, tlv_objects):
+        """Resume a previous session and upgrade to encrypted transport.
+
+        The shared secret of the new session is derived from the one of the previous
+        session, so no key exchange or signatures are needed.
+
+        @param tlv_objects: The TLV data received from the client.
+        @type tlv_object: dict
+
+        @return: False if the session cannot be resumed, in which case the client
+            expects a regular pair verify response.
+        @rtype: bool
+        """
+        logger.debug("Pair resume [1/1]")
+        session_id = tlv_objects.get(HAP_TLV_TAGS.SESSION_ID)
+        client_public = tlv_objects.get(HAP_TLV_TAGS.PUBLIC_KEY)
+        if session_id is None or client_public is None:
+            logger.debug("Malformed pair resume request from %s.", self.client_address)
+            return False
+        # The session ID is sent in plaintext, so the session is only removed once the
+        # request is authenticated. Otherwise anyone could discard it.
+        session_cache = self.accessory_handler.session_cache
+        session = session_cache.get(session_id)
+        if session is None:
+            logger.debug("No session to resume for %s.", self.client_address)
+            return False
+        shared_key, client_uuid = session
+        if client_uuid not in self.state.paired_clients:
+            logger.debug("Client %s attempted pair resume without being paired.",
+                         client_uuid)
+            return False
+
+        request_key = hap_hkdf(shared_key, client_public + session_id,
+                               self.PRESUME_REQUEST_INFO)
+        try:
+            ChaCha20Poly1305(request_key).decrypt(
+                self.PRESUME_REQUEST_NONCE,
+                bytes(tlv_objects.get(HAP_TLV_TAGS.ENCRYPTED_DATA, b"")), b"")
+        except InvalidTag:
+            logger.debug("Pair resume request of %s failed authentication.",
+                         self.client_address)
+            return False
+        if session_cache.pop(session_id) is None:
+            logger.debug("Session of %s was already resumed.", self.client_address)
+            return False
+
+        new_session_id = os.urandom(self.SESSION_ID_LENGTH)
+        salt = client_public + new_session_id
+        response_key = hap_hkdf(shared_key, salt, self.PRESUME_RESPONSE_INFO)
+        auth_tag = ChaCha20Poly1305(response_key).encrypt(
+            self.PRESUME_RESPONSE_NONCE, b"", b"")
+        new_shared_key = hap_hkdf(shared_key, salt, self.PRESUME_SHARED_SECRET_INFO)
+        session_cache.add(new_session_id, new_shared_key, client_uuid)
+
+        logger.debug("Pair resume with client '%s' completed. Switching to "
+                     "encrypted transport.", self.client_address)
+        self.enc_context = {"shared_key": new_shared_key}
+        data = tlv.encode(HAP_TLV_TAGS.SEQUENCE_NUM, b'\x02',
+                          HAP_TLV_TAGS.REQUEST_TYPE, self.PRESUME_METHOD,
+                          HAP_TLV_TAGS.SESSION_ID, new_session_id,
+                          HAP_TLV_TAGS.ENCRYPTED_DATA, auth_tag)
+        self.send_response(200)
+        self.send_header("Content-Type", self.PAIRING_RESPONSE_TYPE)
+        self._upgrade_reader_to_encrypted()
+        self.end_response(data)
+        self._upgrade_writer_to_encrypted()
+        del self.enc_context
+        return True
+
     def handle_accessories(self):
         """Handles a client request to get the accessories."""
         if not self.is_encrypted:
             raise UnprivilegedRequestException
 
-        hap_rep = self.accessory_handler.get_accessories()
-        data = json.dumps(hap_rep).encode("utf-8")
+        data = self.accessory_handler.get_accessories_json()
         self.send_response(200)
         self.send_header("Content-Type", self.JSON_RESPONSE_TYPE)
         self.end_response(data)
@@ -595,17 +743,26 @@ class HAPServerHandler(BaseHTTPRequestHandler):
             self.rfile.read(data_len).decode('utf-8'))
         logger.debug('Set characteristics content: %s', requested_chars)
 
-        # TODO: Outline how chars return errors on set_chars.
         try:
-            self.accessory_handler.set_characteristics(requested_chars,
-                                                       self.client_address)
+            response = self.accessory_handler.set_characteristics(
+                requested_chars, self.client_address)
         except Exception as e:  # pylint: disable=broad-except
             logger.exception('Exception in set_characteristics: %s', e)
             self.send_response(HTTPStatus.BAD_REQUEST)
             self.end_response(b'')
-        else:
+            return
+
+        # Only report the characteristics if there is more to say than success
+        if response is None or all(
+                rep[HAP_REPR_STATUS] == HAP_SERVER_STATUS.SUCCESS
+                and HAP_REPR_VALUE not in rep
+                for rep in response[HAP_REPR_CHARS]):
             self.send_response(HTTPStatus.NO_CONTENT)
             self.end_response(b'')
+            return
+        self.send_response(HTTPStatus.MULTI_STATUS)
+        self.send_header("Content-Type", self.JSON_RESPONSE_TYPE)
+        self.end_response(json.dumps(response).encode("utf-8"))
 
     def handle_pairings(self):
         """Handles a client request to update or remove a pairing."""
@@ -676,6 +833,203 @@ class HAPServerHandler(BaseHTTPRequestHandler):
         self.end_response(image)
 
 
+class ClientEventQueue:
+    """A bounded queue of the EVENT messages pending for a single client.
+
+    Every client has its own queue, so a client that stops reading only delays its
+    own events. When the queue is full, ``put`` applies the overflow policy.
+    """
+
+    def __init__(self, maxsize, overflow_policy=EVENT_OVERFLOW_POLICY.DROP_OLDEST):
+        """
+        @param maxsize: The maximum number of queued events.
+        @type maxsize: int
+
+        @param overflow_policy: One of the EVENT_OVERFLOW_POLICY values.
+        @type overflow_policy: str
+        """
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.max_depth = 0
+        self.dropped = 0
+        self.closed = False
+        self._events = deque()  # (data, topics)
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _coalesce(self, topics):
+        """Discard the queued events whose topics are all contained in ``topics``."""
+        if not topics:
+            return
+        kept = deque(event for event in self._events
+                     if not event[1] or not event[1] <= topics)
+        self.dropped += len(self._events) - len(kept)
+        self._events = kept
+
+    def put(self, data, topics=()):
+        """Queue an event for the client.
+
+        @param data: The EVENT message.
+        @type data: bytes
+
+        @param topics: The topics with a value in the event.
+        @type topics: iterable
+
+        @return: False if the queue is closed or the client must be disconnected
+            because of an overflow, True otherwise.
+        @rtype: bool
+        """
+        topics = frozenset(topics)
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._events) >= self.maxsize:
+                if self.overflow_policy == EVENT_OVERFLOW_POLICY.DISCONNECT:
+                    self.dropped += 1
+                    return False
+                if self.overflow_policy == EVENT_OVERFLOW_POLICY.COALESCE:
+                    self._coalesce(topics)
+                if len(self._events) >= self.maxsize:
+                    self._events.popleft()
+                    self.dropped += 1
+            self._events.append((data, topics))
+            self.max_depth = max(self.max_depth, len(self._events))
+            self._cond.notify()
+        return True
+
+    def get(self):
+        """Return the next event, blocking until one is queued.
+
+        @return: The next EVENT message or None if the queue was closed.
+        @rtype: bytes
+        """
+        with self._cond:
+            while not self._events and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return None
+            return self._events.popleft()[0]
+
+    def get_nowait(self):
+        """Return the next event or None if there is none."""
+        with self._cond:
+            if not self._events or self.closed:
+                return None
+            return self._events.popleft()[0]
+
+    def close(self):
+        """Discard the queued events and wake up any waiting reader."""
+        with self._cond:
+            self.closed = True
+            self._events.clear()
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """Return the current depth, the highest depth and the number of dropped
+        events."""
+        return {'depth': len(self._events), 'max_depth': self.max_depth,
+                'dropped': self.dropped}
+
+
+class HAPCrypto:
+    """The HAP "TLS" framing of an encrypted session, without any I/O.
+
+    Incoming ciphertext is fed with ``receive_data`` and ``decrypt`` returns the
+    plaintext of all complete blocks received so far. ``encrypt`` splits outgoing data
+    into blocks and encrypts them.
+    """
+
+    MAX_BLOCK_LENGTH = 0x400
+    MAX_BLOCK_LENGTH_BYTES = struct.pack("H", MAX_BLOCK_LENGTH)
+    LENGTH_LENGTH = 2
+    # The nonce is the block counter, padded with zeroes at the front
+    NONCE_COUNTER_OFFSET = HAP_CRYPTO.TLS_NONCE_LEN - 8
+
+    CIPHER_SALT = b"Control-Salt"
+    OUT_CIPHER_INFO = b"Control-Read-Encryption-Key"
+    IN_CIPHER_INFO = b"Control-Write-Encryption-Key"
+
+    def __init__(self, shared_key):
+        """Derive the out/inbound keys from the session key of pair verify."""
+        self._crypt_in_buffer = bytearray()  # Encrypted buffer
+        self._out_count = 0
+        self._out_nonce = bytearray(HAP_CRYPTO.TLS_NONCE_LEN)
+        self._in_nonce = bytearray(HAP_CRYPTO.TLS_NONCE_LEN)
+        self._in_count = 0
+
+        outgoing_key = hap_hkdf(shared_key, self.CIPHER_SALT, self.OUT_CIPHER_INFO)
+        self._out_cipher = ChaCha20Poly1305(outgoing_key)
+
+        incoming_key = hap_hkdf(shared_key, self.CIPHER_SALT, self.IN_CIPHER_INFO)
+        self._in_cipher = ChaCha20Poly1305(incoming_key)
+
+    def receive_data(self, buffer):
+        """Receive data into the encrypted buffer."""
+        self._crypt_in_buffer += buffer
+
+    def decrypt(self):
+        """Decrypt and return all complete blocks in the encrypted buffer.
+
+        Partial blocks are kept until the rest of the block is received. The blocks are
+        decrypted from memoryview slices and the consumed data is removed from the
+        buffer once.
+
+        :raise cryptography.exceptions.InvalidTag: if a block fails authentication.
+        """
+        result = []
+        nonce = self._in_nonce
+        buffer_length = len(self._crypt_in_buffer)
+        pos = 0
+        with memoryview(self._crypt_in_buffer) as view:
+            while buffer_length - pos > self.LENGTH_LENGTH:
+                block_length = struct.unpack_from("H", view, pos)[0]
+                block_start = pos + self.LENGTH_LENGTH
+                block_end = block_start + block_length + HAP_CRYPTO.TAG_LENGTH
+                if buffer_length < block_end:
+                    break
+
+                struct.pack_into("Q", nonce, self.NONCE_COUNTER_OFFSET, self._in_count)
+                result.append(self._in_cipher.decrypt(
+                    nonce, view[block_start:block_end], view[pos:block_start]))
+                self._in_count += 1
+                pos = block_end
+
+        del self._crypt_in_buffer[:pos]
+        return b"".join(result)
+
+    def encrypt(self, data):
+        """Encrypt and frame the given data.
+
+        The frames are written into a single preallocated buffer and the blocks are
+        memoryview slices of ``data``, so the cost is linear in the size of the data.
+
+        :rtype: bytearray
+        """
+        data = memoryview(data)
+        total = len(data)
+        num_blocks = -(-total // self.MAX_BLOCK_LENGTH)
+        result = bytearray(
+            total + num_blocks * (self.LENGTH_LENGTH + HAP_CRYPTO.TAG_LENGTH))
+        nonce = self._out_nonce
+        pos = 0
+        for offset in range(0, total, self.MAX_BLOCK_LENGTH):
+            block = data[offset:offset + self.MAX_BLOCK_LENGTH]
+            if len(block) == self.MAX_BLOCK_LENGTH:
+                length_bytes = self.MAX_BLOCK_LENGTH_BYTES
+            else:
+                length_bytes = struct.pack("H", len(block))
+            struct.pack_into("Q", nonce, self.NONCE_COUNTER_OFFSET, self._out_count)
+            ciphertext = self._out_cipher.encrypt(nonce, block, length_bytes)
+            result[pos:pos + self.LENGTH_LENGTH] = length_bytes
+            pos += self.LENGTH_LENGTH
+            result[pos:pos + len(ciphertext)] = ciphertext
+            pos += len(ciphertext)
+            self._out_count += 1
+        return result
+
+
 class HAPSocket:
     """A socket implementing the HAP crypto. Just feed it as if it is a normal socket.
 
@@ -688,22 +1042,14 @@ class HAPSocket:
     with this situation.
     """
 
-    MAX_BLOCK_LENGTH = 0x400
-    LENGTH_LENGTH = 2
-
-    CIPHER_SALT = b"Control-Salt"
-    OUT_CIPHER_INFO = b"Control-Read-Encryption-Key"
-    IN_CIPHER_INFO = b"Control-Write-Encryption-Key"
+    RECV_CHUNK_SIZE = 0x10000  # Read as many frames as are available, up to this
 
     def __init__(self, sock, shared_key):
         """Initialise from the given socket."""
         self.socket = sock
 
         self.shared_key = shared_key
-        self.out_count = 0
-        self.in_count = 0
-        self.out_cipher = None
-        self.in_cipher = None
+        self.hap_crypto = None
         self.out_lock = threading.RLock()  # for locking send operations
         # NOTE: Some future python implementation of HTTP Server or Server Handler can use
         # methods different than the ones we lock now (send, sendall).
@@ -711,10 +1057,8 @@ class HAPSocket:
         # but don't forget locking these other methods after fixing the crypto.
 
         self._set_ciphers()
-        self.curr_in_total = None  # Length of the current incoming block
-        self.num_in_recv = None  # Number of bytes received from the incoming block
-        self.curr_in_block = None  # Bytes of the current incoming block
-        self.curr_decrypted = b""  # Decrypted buffer
+        self._recv_buffer = bytearray(self.RECV_CHUNK_SIZE)  # Encrypted chunk
+        self._decrypted = bytearray()  # Decrypted, not yet returned data
 
     def __getattr__(self, attribute_name):
         """Defer unknown behaviour to the socket"""
@@ -747,11 +1091,7 @@ class HAPSocket:
 
     def _set_ciphers(self):
         """Generate out/inbound encryption keys and initialise respective ciphers."""
-        outgoing_key = hap_hkdf(self.shared_key, self.CIPHER_SALT, self.OUT_CIPHER_INFO)
-        self.out_cipher = ChaCha20Poly1305(outgoing_key)
-
-        incoming_key = hap_hkdf(self.shared_key, self.CIPHER_SALT, self.IN_CIPHER_INFO)
-        self.in_cipher = ChaCha20Poly1305(incoming_key)
+        self.hap_crypto = HAPCrypto(self.shared_key)
 
     # socket.socket interface
 
@@ -762,11 +1102,38 @@ class HAPSocket:
                 return func(self, *args, **kwargs)  # pylint: disable=not-callable
         return _wrapper
 
+    def _fill_decrypted(self):
+        """Read from the socket until at least one block is decrypted.
+
+        Every read takes as much as is available, so several blocks are usually
+        received and decrypted at once. Partial blocks are buffered by the HAPCrypto.
+
+        :return: False if the connection was closed, True otherwise.
+        :rtype: bool
+        """
+        while not self._decrypted:
+            nbytes = self.socket.recv_into(self._recv_buffer)
+            if not nbytes:
+                # Connection likely dropped
+                return False
+            with tracing.span('hap.socket.decrypt', bytes=nbytes), \
+                    memoryview(self._recv_buffer) as view:
+                self.hap_crypto.receive_data(view[:nbytes])
+                self._decrypted += self.hap_crypto.decrypt()
+        return True
+
     def recv_into(self, buffer, nbytes=None, flags=0):
         """Receive and decrypt up to nbytes in the given buffer."""
-        data = self.recv(nbytes or len(buffer), flags)
-        buffer[:len(data)] = data
-        return len(data)
+        assert not flags
+        nbytes = min(nbytes or len(buffer), len(buffer))
+        if nbytes == 0 or not self._fill_decrypted():
+            return 0
+        nbytes = min(nbytes, len(self._decrypted))
+        with memoryview(buffer) as buffer_view, \
+                memoryview(self._decrypted) as decrypted_view:
+            buffer_view[:nbytes] = decrypted_view[:nbytes]
+        del self._decrypted[:nbytes]
+        return nbytes
 
     def recv(self, buflen=1042, flags=0):
         """Receive up to buflen bytes.
@@ -782,59 +1149,10 @@ class HAPSocket:
             # we return an empty bytes string.
             return b""
 
-        result = self.curr_decrypted
-
-        # If we do not have a partial decrypted block
-        # read the next one
-        while len(result) == 0:
-            # If we are not processing a block already, we need to first get the
-            # length of the next block, which is the first two bytes before it.
-            if self.curr_in_block is None:
-                # Always wait for a full block to arrive
-                block_length_bytes = self.socket.recv(
-                    self.LENGTH_LENGTH, socket.MSG_WAITALL
-                )
-                if not block_length_bytes:
-                    # Connection likely dropped
-                    return b""
-                # Init. info about the block we just started.
-                # Note we are setting the total length to block_length + mac length
-                self.curr_in_total = (
-                    struct.unpack("H", block_length_bytes)[0] + HAP_CRYPTO.TAG_LENGTH
-                )
-                self.num_in_recv = 0
-                self.curr_in_block = b""
-            else:
-                # Read as much from the current block as possible.
-                part = self.socket.recv(self.curr_in_total - self.num_in_recv)
-                # Check what is actually received
-                actual_len = len(part)
-                self.curr_in_block += part
-                self.num_in_recv += actual_len
-                if self.num_in_recv == self.curr_in_total:
-                    # We read a whole block. Decrypt it and append it to the result.
-                    nonce = _pad_tls_nonce(struct.pack("Q", self.in_count))
-                    # Note we are removing the mac length from the total length
-                    block_length = self.curr_in_total - HAP_CRYPTO.TAG_LENGTH
-                    result = self.in_cipher.decrypt(
-                        nonce, bytes(self.curr_in_block), struct.pack("H", block_length)
-                    )
-                    self.in_count += 1
-                    self.curr_in_block = None
-                    break
-                if not actual_len:
-                    # Connection likely dropped
-                    return b""
-
-        # The buffer can hold only
-        # part of the decrypted result
-        if buflen < len(result):
-            self.curr_decrypted = result[buflen:]
-            return result[:buflen]
-
-        # The buffer can hold the whole
-        # result
-        self.curr_decrypted = b""
+        if not self._fill_decrypted():
+            return b""
+        result = bytes(self._decrypted[:buflen])
+        del self._decrypted[:buflen]
         return result
 
     @_with_out_lock
@@ -845,25 +1163,13 @@ class HAPSocket:
         # sendall.
         return self.sendall(data, flags)
 
+    @tracing.traced('hap.socket.sendall')
     @_with_out_lock
     def sendall(self, data, flags=0):
         """Encrypt and send the given data."""
         assert not flags
-        result = b""
-        offset = 0
-        total = len(data)
-        while offset < total:
-            length = min(total - offset, self.MAX_BLOCK_LENGTH)
-            length_bytes = struct.pack("H", length)
-            block = bytes(data[offset: offset + length])
-            nonce = _pad_tls_nonce(struct.pack("Q", self.out_count))
-            ciphertext = length_bytes \
-                + self.out_cipher.encrypt(nonce, block, length_bytes)
-            offset += length
-            self.out_count += 1
-            result += ciphertext
-        self.socket.sendall(result)
-        return total
+        self.socket.sendall(self.hap_crypto.encrypt(data))
+        return len(data)
 
 
 class HAPServer(socketserver.ThreadingMixIn,
@@ -879,6 +1185,11 @@ class HAPServer(socketserver.ThreadingMixIn,
     decides to push a change in current temperature, while in the same time the HAP client
     decides to query the state of the Accessory. To overcome this the HAPSocket class
     implements exclusive access to the send methods.
+
+    @note: Every connection is served by a dedicated thread. This server is only used
+    when the AccessoryDriver is created with ``threaded_server=True``. Events are
+    written by a dedicated thread per client from its ClientEventQueue, so a client
+    that stops reading does not block the events of the others.
     """
 
     EVENT_MSG_STUB = b"EVENT/1.0 200 OK\r\n" \
@@ -895,18 +1206,22 @@ class HAPServer(socketserver.ThreadingMixIn,
         @param data: Payload of the request.
         @type data: bytes
         """
-        return cls.EVENT_MSG_STUB \
-            + str(len(bytesdata)).encode("utf-8") \
-            + b"\r\n" * 2 \
-            + bytesdata
+        return b"".join((cls.EVENT_MSG_STUB, str(len(bytesdata)).encode("utf-8"),
+                         b"\r\n\r\n", bytesdata))
 
     def __init__(self,
                  addr_port,
                  accessory_handler,
-                 handler_type=HAPServerHandler):
+                 handler_type=HAPServerHandler,
+                 event_queue_size=100,
+                 event_overflow_policy=EVENT_OVERFLOW_POLICY.DROP_OLDEST):
         super(HAPServer, self).__init__(addr_port, handler_type)
         self.connections = {}  # (address, port): socket
         self.accessory_handler = accessory_handler
+        self.event_queue_size = event_queue_size
+        self.event_overflow_policy = event_overflow_policy
+        self.event_queues = {}  # (address, port): ClientEventQueue
+        self._event_queues_lock = threading.Lock()
 
     def _close_socket(self, sock):  # pylint: disable=no-self-use
         """Shutdown and close the given socket."""
@@ -928,6 +1243,7 @@ class HAPServer(socketserver.ThreadingMixIn,
         # ETIMEDOUT.
         logger.debug("Connection timeout for %s with exception %s", client_addr, exception)
         logger.debug("Current connections %s", self.connections)
+        self._close_event_queue(client_addr)
         sock = self.connections.pop(client_addr, None)
         if sock is not None:
             self._close_socket(sock)
@@ -952,7 +1268,7 @@ class HAPServer(socketserver.ThreadingMixIn,
         The client can gracefully close the connection, but in other cases it can just
         leave, which will result in a timeout. In either case, we need to remove the
         connection from ``self.connections``, because it could also be used for
-        pushing events to the server.
+        pushing events to the server, and its subscriptions.
         """
         try:
             self.RequestHandlerClass(request, client_address,
@@ -965,6 +1281,8 @@ class HAPServer(socketserver.ThreadingMixIn,
             raise
         finally:
             logger.debug('Cleaning connection to %s', client_address)
+            self.accessory_handler.unsubscribe_client(client_address)
+            self._close_event_queue(client_address)
             conn_sock = self.connections.pop(client_address, None)
             if conn_sock is not None:
                 self._close_socket(conn_sock)
@@ -978,13 +1296,73 @@ class HAPServer(socketserver.ThreadingMixIn,
         # can see the Accessory disappearing and could close the connection. This can
         # happen while we deal with all connections here so we will get a "changed while
         # iterating" exception. To avoid that, make a copy and iterate over it instead.
+        for client_addr in list(self.event_queues):
+            self._close_event_queue(client_addr)
         for sock in list(self.connections.values()):
             self._close_socket(sock)
         self.connections.clear()
         super().server_close()
 
-    def push_event(self, bytesdata, client_addr):
-        """Send an event to the current connection with the provided data.
+    def _close_event_queue(self, client_addr):
+        """Close the event queue of the client, which stops its writer thread."""
+        with self._event_queues_lock:
+            event_queue = self.event_queues.pop(client_addr, None)
+        if event_queue is not None:
+            event_queue.close()
+
+    def _get_event_queue(self, client_addr, client_socket):
+        """Return the event queue of the client, starting its writer if needed."""
+        with self._event_queues_lock:
+            event_queue = self.event_queues.get(client_addr)
+            if event_queue is None:
+                event_queue = ClientEventQueue(self.event_queue_size,
+                                               self.event_overflow_policy)
+                self.event_queues[client_addr] = event_queue
+                threading.Thread(target=self._send_queued_events,
+                                 args=(client_addr, client_socket, event_queue),
+                                 daemon=True).start()
+        return event_queue
+
+    def _send_queued_events(self, client_addr, client_socket, event_queue):
+        """Write the queued events of a client until its queue is closed."""
+        while True:
+            data = event_queue.get()
+            if data is None:
+                return
+            try:
+                client_socket.sendall(data)
+            except (OSError, socket.timeout) as e:
+                logger.debug('exception %s for %s when sending an event',
+                             e, client_addr)
+                try:
+                    self._handle_sock_timeout(client_addr, e)
+                except (OSError, socket.timeout):
+                    pass
+                return
+
+    def get_event_queue_stats(self):
+        """Return the statistics of the event queue of every client.
+
+        :return: A dict of client (address, port) tuple to the ClientEventQueue stats.
+        :rtype: dict
+        """
+        return {client_addr: event_queue.get_stats()
+                for client_addr, event_queue in list(self.event_queues.items())}
+
+    def get_connection_stats(self):
+        """Return the number of connections and of those with an encrypted session.
+
+        :rtype: dict
+        """
+        sockets = list(self.connections.values())
+        return {'connections': len(sockets),
+                'encrypted': sum(1 for sock in sockets if isinstance(sock, HAPSocket))}
+
+    def push_event(self, bytesdata, client_addr, topics=()):
+        """Queue an event for the current connection with the provided data.
+
+        The event is written by the writer thread of the client, so this does not
+        block on a slow client.
 
         :param bytesdata: The data to send.
         :type bytesdata: bytes
@@ -992,21 +1370,26 @@ class HAPServer(socketserver.ThreadingMixIn,
         :param client_addr: A client (address, port) tuple to which to send the data.
         :type client_addr: tuple <str, int>
 
-        :return: True if sending was successful, False otherwise.
+        :param topics: The topics with a value in the data, used to coalesce events.
+        :type topics: iterable
+
+        :return: True if the event was queued, False otherwise.
         :rtype: bool
         """
         client_socket = self.connections.get(client_addr)
         if client_socket is None:
             logger.debug('No socket for %s', client_addr)
             return False
-        data = self.create_hap_event(bytesdata)
-        try:
-            client_socket.sendall(data)
-            return True
-        except (OSError, socket.timeout) as e:
-            logger.debug('exception %s for %s in push_event()', e, client_addr)
-            self._handle_sock_timeout(client_addr, e)
+        event_queue = self._get_event_queue(client_addr, client_socket)
+        if not event_queue.put(self.create_hap_event(bytesdata), topics):
+            logger.debug('Event queue of %s overflowed, closing connection.',
+                         client_addr)
+            self._close_event_queue(client_addr)
+            sock = self.connections.pop(client_addr, None)
+            if sock is not None:
+                self._close_socket(sock)
             return False
+        return True
 
     def upgrade_to_encrypted(self, client_address, shared_key):
         """Replace the socket for the given client with HAPSocket.
@@ -13,6 +13,9 @@ from .util import long_to_bytes
 # S - int
 # u - bytes
 # p - bytes
+#
+# The ctx comes from pyhap.params.get_srp_context, which also holds k and
+# hGroup = H(N) xor H(g).
 
 
 def padN(bytestr, ctx):
@@ -51,6 +54,16 @@ def get_k(ctx):
     return int(hf.hexdigest(), 16)
 
 
+def get_group_hash(ctx):
+    hf = ctx['hashfunc']()
+    hf.update(long_to_bytes(ctx['N']))
+    hN = hf.digest()
+    hf = ctx['hashfunc']()
+    hf.update(long_to_bytes(ctx['g']))
+    hG = hf.digest()
+    return bytes(hN[i] ^ hG[i] for i in range(0, len(hN)))
+
+
 def get_session_key(S, ctx):
     hf = ctx['hashfunc']()
     hf.update(long_to_bytes(S))
@@ -65,7 +78,7 @@ class Server():
         self.p = p
         self.s = s or os.urandom(self.ctx["salt_len"])
         self.v = v or get_verifier(u, p, self.s, self.ctx)
-        self.k = get_k(ctx)
+        self.k = ctx['k']
         self.b = bytes_to_long(os.urandom(256))  # TODO: specify length
         self.B = self.derive_B()
         self.A = None
@@ -96,18 +109,11 @@ class Server():
         return pow(Avu, self.b, self.ctx["N"])
 
     def get_M(self):
-        hf = self.ctx['hashfunc']()
-        hf.update(long_to_bytes(self.ctx['N']))
-        hN = hf.digest()
-        hf = self.ctx['hashfunc']()
-        hf.update(long_to_bytes(self.ctx['g']))
-        hG = hf.digest()
-        hGroup = bytes(hN[i] ^ hG[i] for i in range(0, len(hN)))
         hf = self.ctx['hashfunc']()
         hf.update(self.u)
         hU = hf.digest()
         hf = self.ctx['hashfunc']()
-        hf.update(hGroup + hU + self.s + long_to_bytes(self.A) +
+        hf.update(self.ctx['hGroup'] + hU + self.s + long_to_bytes(self.A) +
                   long_to_bytes(self.B) + long_to_bytes(self.K))
         return hf.digest()
 
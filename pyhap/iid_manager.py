@@ -9,7 +9,8 @@ class IIDManager:
 
     def __init__(self):
         """Initialize an empty instance."""
-        self.iids = {}
+        self.iids = {}  # obj: iid
+        self.objs = {}  # iid: obj
         self.counter = 0
 
     def assign(self, obj):
@@ -27,13 +28,11 @@ class IIDManager:
 
         self.counter += 1
         self.iids[obj] = self.counter
+        self.objs[self.counter] = obj
 
     def get_obj(self, iid):
         """Get the object that is assigned the given IID."""
-        for obj, iid_to_obj in self.iids.items():
-            if iid_to_obj == iid:
-                return obj
-        return None
+        return self.objs.get(iid)
 
     def get_iid(self, obj):
         """Get the IID assigned to the given object."""
@@ -44,13 +43,15 @@ class IIDManager:
         iid = self.iids.pop(obj, None)
         if iid is None:
             logger.error('Object %s not found.', obj)
+            return None
+        del self.objs[iid]
         return iid
 
     def remove_iid(self, iid):
         """Remove an object with an IID from the IID list."""
-        for obj, iid_to_obj in self.iids.items():
-            if iid_to_obj == iid:
-                del self.iids[obj]
-                return obj
-        logger.error('IID %s not found.', iid)
-        return None
+        obj = self.objs.pop(iid, None)
+        if obj is None:
+            logger.error('IID %s not found.', iid)
+            return None
+        del self.iids[obj]
+        return obj
@@ -7,8 +7,11 @@ The idea is, give a name of a service and you get an
 instance of it (as long as it is described in some
 json file).
 """
+import functools
 import json
 import logging
+from types import MappingProxyType
+from uuid import UUID
 
 from pyhap import CHARACTERISTICS_FILE, SERVICES_FILE
 from pyhap.characteristic import Characteristic
@@ -21,38 +24,77 @@ logger = logging.getLogger(__name__)
 class Loader:
     """Looks up type descriptions based on a name.
 
+    A type is compiled the first time it is used: its UUID is parsed once and its
+    properties are kept in a read-only mapping that all characteristics of the type
+    share. A characteristic replaces the shared mapping with its own dict before
+    changing it, see `Characteristic.override_properties`.
+
     .. seealso:: pyhap/resources/services.json
     .. seealso:: pyhap/resources/characteristics.json
     """
 
     def __init__(self, path_char=CHARACTERISTICS_FILE,
                  path_service=SERVICES_FILE):
-        """Initialize a new Loader instance."""
-        self.char_types = self._read_file(path_char)
-        self.serv_types = self._read_file(path_service)
+        """Initialize a new Loader instance.
+
+        Each file is only read once per process, but every Loader parses its own
+        copy of the types.
+        """
+        self.char_types = json.loads(self._read_file(path_char))
+        self.serv_types = json.loads(self._read_file(path_service))
+        self._compiled_chars = {}  # name: (type_id, properties)
+        self._compiled_services = {}  # name: (type_id, characteristic names)
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def _read_file(path):
-        """Read file and return a dict."""
+        """Read file and return its contents."""
         with open(path, 'r') as file:
-            return json.load(file)
+            return file.read()
+
+    def _compile_char(self, name):
+        """Return the type ID and the shared properties of a characteristic type."""
+        compiled = self._compiled_chars.get(name)
+        if compiled is None:
+            char_dict = self.char_types[name]
+            if 'Format' not in char_dict or \
+                'Permissions' not in char_dict or \
+                    'UUID' not in char_dict:
+                raise KeyError('Could not load char {}!'.format(name))
+            properties = {key: value for key, value in char_dict.items()
+                          if key != 'UUID'}
+            if 'ValidValues' in properties:
+                properties['ValidValues'] = \
+                    MappingProxyType(dict(properties['ValidValues']))
+            compiled = self._compiled_chars[name] = \
+                (UUID(char_dict['UUID']), MappingProxyType(properties))
+        return compiled
+
+    def _compile_service(self, name):
+        """Return the type ID and the characteristic names of a service type."""
+        compiled = self._compiled_services.get(name)
+        if compiled is None:
+            service_dict = self.serv_types[name]
+            if 'RequiredCharacteristics' not in service_dict or \
+                    'UUID' not in service_dict:
+                raise KeyError('Could not load service {}!'.format(name))
+            compiled = self._compiled_services[name] = \
+                (UUID(service_dict['UUID']),
+                 tuple(service_dict['RequiredCharacteristics']))
+        return compiled
 
     def get_char(self, name):
         """Return new Characteristic object."""
-        char_dict = self.char_types[name].copy()
-        if 'Format' not in char_dict or \
-            'Permissions' not in char_dict or \
-                'UUID' not in char_dict:
-            raise KeyError('Could not load char {}!'.format(name))
-        return Characteristic.from_dict(name, char_dict)
+        type_id, properties = self._compile_char(name)
+        return Characteristic(name, type_id, properties)
 
     def get_service(self, name):
         """Return new service object."""
-        service_dict = self.serv_types[name].copy()
-        if 'RequiredCharacteristics' not in service_dict or \
-                'UUID' not in service_dict:
-            raise KeyError('Could not load service {}!'.format(name))
-        return Service.from_dict(name, service_dict, self)
+        type_id, char_names = self._compile_service(name)
+        service = Service(type_id, name)
+        service.add_characteristic(*(self.get_char(char_name)
+                                     for char_name in char_names))
+        return service
 
     @classmethod
     def from_dict(cls, char_dict=None, serv_dict=None):
@@ -60,6 +102,8 @@ class Loader:
         loader = cls.__new__(Loader)
         loader.char_types = char_dict or {}
         loader.serv_types = serv_dict or {}
+        loader._compiled_chars = {}  # pylint: disable=protected-access
+        loader._compiled_services = {}  # pylint: disable=protected-access
         return loader
 
 
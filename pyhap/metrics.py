@@ -0,0 +1,363 @@
+"""Module for the metrics of the AccessoryDriver and the HAP servers.
+
+The AccessoryDriver records its metrics in a MetricsRegistry. Counters, gauges and
+histograms are created from the registry and values are recorded through the child of
+a set of label values, e.g. ``counter.labels('GET', '/accessories').inc()``. Values that
+are cheap to read at any time, like the number of connections, are instead taken from a
+``collect`` callback when the metrics are rendered.
+
+Any object with the ``counter``, ``gauge`` and ``histogram`` methods of the
+MetricsRegistry can be passed to the AccessoryDriver instead, e.g. to forward the
+metrics to another metrics library.
+
+The metrics can be rendered in the Prometheus text exposition format and served from a
+local HTTP endpoint with ``async_start_metrics_server``.
+"""
+import asyncio
+import bisect
+from collections import OrderedDict
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+"""The default upper bounds, in seconds, of the buckets of a histogram."""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+
+
+def _format_value(value):
+    """Format a sample value like the Prometheus text format expects."""
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '{:.1f}'.format(value)
+    return repr(value)
+
+
+def _escape(value):
+    """Escape a label value."""
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames, labelvalues):
+    if not labelnames:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in zip(labelnames, labelvalues)) + '}'
+
+
+class _CounterChild:
+    """The value of a counter for one set of label values."""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the counter by the given, non-negative amount."""
+        if amount < 0:
+            raise ValueError('Counters can only be increased.')
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    """The value of a gauge for one set of label values."""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """Set the gauge to the given value."""
+        self.value = value
+
+    def inc(self, amount=1):
+        """Increase the gauge by the given amount."""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge by the given amount."""
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    """The observations of a histogram for one set of label values."""
+
+    __slots__ = ('upper_bounds', 'bucket_counts', 'sum', 'count', '_lock')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.bucket_counts = [0] * len(upper_bounds)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record an observation."""
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """Base class of the metrics, holding a child for every set of label values."""
+
+    TYPE = None
+    CHILD_CLASS = None
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        """
+        :param name: The name of the metric, e.g. ``hap_events_published_total``.
+        :type name: str
+
+        :param documentation: A short description, rendered as the HELP of the metric.
+        :type documentation: str
+
+        :param labelnames: The names of the labels of the metric.
+        :type labelnames: tuple
+
+        :param collect: A function returning the current values when the metrics
+            are rendered, instead of recording them. It returns a dict of label values
+            tuple to value or, without labels, the value.
+        :type collect: callable
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._children = {}  # label values tuple: child
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return self.CHILD_CLASS()  # pylint: disable=not-callable
+
+    def labels(self, *labelvalues):
+        """Return the child for the given label values, creating it if needed."""
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('{} expects the labels {}, got {}'.format(
+                self.name, self.labelnames, labelvalues))
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def _get_values(self):
+        """Return a list of (label values, value) from the children or the callback."""
+        if self.collect is None:
+            return [(labelvalues, child.value)
+                    for labelvalues, child in list(self._children.items())]
+        values = self.collect()
+        if not self.labelnames:
+            return [((), values)]
+        return list(values.items())
+
+    def samples(self):
+        """Return the (name, labels, value) samples of the metric.
+
+        The labels are rendered already, e.g. ``{path="/accessories"}``.
+        """
+        return [(self.name, _format_labels(self.labelnames, labelvalues), value)
+                for labelvalues, value in self._get_values()]
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of events sent."""
+
+    TYPE = 'counter'
+    CHILD_CLASS = _CounterChild
+
+    def inc(self, amount=1):
+        """Increase the counter of a metric without labels."""
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the number of connections."""
+
+    TYPE = 'gauge'
+    CHILD_CLASS = _GaugeChild
+
+    def set(self, value):
+        """Set the gauge of a metric without labels."""
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    """Counts observations, e.g. request durations, in buckets of upper bounds."""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: The upper bounds of the buckets, in increasing order. A bucket
+            for everything above the last bound is added.
+        :type buckets: tuple
+        """
+        super().__init__(name, documentation, labelnames)
+        self.upper_bounds = tuple(float(bound) for bound in sorted(buckets)) + (math.inf,)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        """Record an observation of a metric without labels."""
+        self.labels().observe(value)
+
+    def samples(self):
+        """Return the cumulative bucket, the sum and the count samples."""
+        samples = []
+        bucket_labelnames = self.labelnames + ('le',)
+        for labelvalues, child in list(self._children.items()):
+            with child._lock:  # pylint: disable=protected-access
+                bucket_counts = list(child.bucket_counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.upper_bounds, bucket_counts):
+                cumulative += bucket_count
+                samples.append((
+                    self.name + '_bucket',
+                    _format_labels(bucket_labelnames,
+                                   labelvalues + (_format_value(upper_bound),)),
+                    cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds the metrics of a process and renders them. Thread-safe."""
+
+    def __init__(self):
+        self.metrics = OrderedDict()  # name: Metric
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        """Return the metric with the given name, creating it if needed."""
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:  # pylint: disable=unidiomatic-typecheck
+                raise ValueError('{} is already registered as a {}'.format(
+                    name, metric.TYPE))
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), collect=None):
+        """Return the Counter with the given name, see Metric."""
+        return self._register(Counter, name, documentation, labelnames, collect)
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        """Return the Gauge with the given name, see Metric."""
+        return self._register(Gauge, name, documentation, labelnames, collect)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Return the Histogram with the given name, see Histogram."""
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def get_sample_value(self, name, labels=None):
+        """Return the value of a sample, e.g. to check it in tests.
+
+        :param name: The name of the sample, e.g. ``hap_request_duration_seconds_count``.
+        :type name: str
+
+        :param labels: The labels of the sample, as a dict of name to value.
+        :type labels: dict
+
+        :return: The value or None if there is no such sample.
+        """
+        labels = labels or {}
+        for metric in list(self.metrics.values()):
+            if not name.startswith(metric.name):
+                continue
+            for sample_name, sample_labels, value in metric.samples():
+                if sample_name != name:
+                    continue
+                names = tuple(labels)
+                if sample_labels == _format_labels(
+                        names, tuple(labels[label] for label in names)):
+                    return value
+        return None
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format.
+
+        Metrics whose ``collect`` callback fails are left out.
+
+        :rtype: bytes
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to collect metric %s', metric.name)
+                continue
+            lines.append('# HELP {} {}'.format(
+                metric.name,
+                metric.documentation.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for sample_name, labels, value in samples:
+                lines.append('{}{} {}'.format(sample_name, labels, _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+class MetricsServerProtocol(asyncio.Protocol):
+    """Answers a single ``GET /metrics`` request with the rendered registry."""
+
+    MAX_REQUEST_SIZE = 8192
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.transport = None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buffer += data
+        if b'\r\n\r\n' not in self._buffer:
+            if len(self._buffer) > self.MAX_REQUEST_SIZE:
+                self.transport.close()
+            return
+        request_line = bytes(self._buffer).split(b'\r\n', 1)[0].split()
+        if len(request_line) == 3 and request_line[0] == b'GET' \
+                and request_line[1].split(b'?', 1)[0] == METRICS_PATH.encode():
+            self._respond(b'200 OK', self.registry.render())
+        else:
+            self._respond(b'404 Not Found', b'')
+
+    def _respond(self, status, body):
+        self.transport.write(b''.join((
+            b'HTTP/1.1 ', status, b'\r\n',
+            b'Content-Type: ', CONTENT_TYPE.encode(), b'\r\n',
+            b'Content-Length: ', str(len(body)).encode(), b'\r\n',
+            b'Connection: close\r\n\r\n', body)))
+        self.transport.close()
+
+
+async def async_start_metrics_server(registry, loop, address, port):
+    """Serve the registry on ``http://address:port/metrics`` from the event loop.
+
+    :return: The server; close it to stop serving.
+    :rtype: asyncio.AbstractServer
+    """
+    return await loop.create_server(lambda: MetricsServerProtocol(registry),
+                                    address, port)
@@ -1,4 +1,8 @@
 # hsrp parameters
+import functools
+
+from pyhap.hsrp import get_group_hash, get_k
+
 ng_order = (1024, 2048, 3072, 4096, 8192)
 
 _ng_const = (
@@ -96,8 +100,13 @@ FC026E479558E4475677E9AA9E3050E2765694DFC81F56E880B96E71\
 )
 
 
+@functools.lru_cache(maxsize=None)
 def get_srp_context(ng_group_len, hashfunc, salt_len=16):
+    """Return the SRP context for the given group, hash function and salt length.
 
+    The context is created once per set of parameters, together with the hashes of the
+    group that every SRP session uses. It must not be modified.
+    """
     group = _ng_const[ng_order.index(ng_group_len)]
 
     ctx = {
@@ -107,4 +116,6 @@ def get_srp_context(ng_group_len, hashfunc, salt_len=16):
         'N_len': ng_group_len,
         'salt_len': salt_len
     }
+    ctx['k'] = get_k(ctx)
+    ctx['hGroup'] = get_group_hash(ctx)
     return ctx
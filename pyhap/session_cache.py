@@ -0,0 +1,95 @@
+"""Module for the SessionCache class."""
+from collections import OrderedDict
+import threading
+import time
+
+
+class SessionCache:
+    """Keeps the shared secrets of past sessions, so controllers can pair resume.
+
+    Sessions are looked up by their session ID with ``get`` and removed with ``pop`` once
+    they are resumed, so each can be resumed once. The cache holds at most
+    ``max_sessions`` sessions, each for at most ``ttl`` seconds. Thread-safe.
+    """
+
+    def __init__(self, max_sessions=64, ttl=8 * 3600):
+        """Initialize an empty instance.
+
+        :param max_sessions: The number of sessions to keep. When full, the oldest
+            session is dropped.
+        :type max_sessions: int
+
+        :param ttl: The time, in seconds, for which a session can be resumed.
+        :type ttl: float
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        # session_id: (expiry, shared_key, client_uuid), oldest first
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _evict(self, now):
+        """Drop the expired sessions, with the lock held."""
+        while self.sessions:
+            session_id, (expiry, _, _) = next(iter(self.sessions.items()))
+            if expiry > now:
+                return
+            del self.sessions[session_id]
+
+    def add(self, session_id, shared_key, client_uuid):
+        """Remember the shared secret of a session.
+
+        :param session_id: The session ID the controller resumes the session with.
+        :type session_id: bytes
+
+        :param shared_key: The shared secret of the session.
+        :type shared_key: bytes
+
+        :param client_uuid: The paired client of the session.
+        :type client_uuid: uuid.UUID
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            self.sessions.pop(session_id, None)
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+            self.sessions[session_id] = (now + self.ttl, shared_key, client_uuid)
+
+    def get(self, session_id):
+        """Return the session with the given ID, without removing it.
+
+        :return: The shared secret and the client UUID of the session, or None if there
+            is no such session or it expired.
+        :rtype: tuple <bytes, uuid.UUID>
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return session[1:]
+
+    def pop(self, session_id):
+        """Remove and return the session with the given ID.
+
+        :return: The shared secret and the client UUID of the session, or None if there
+            is no such session or it expired.
+        :rtype: tuple <bytes, uuid.UUID>
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return None
+        return session[1:]
+
+    def remove_client(self, client_uuid):
+        """Remove all sessions of the given client, e.g. when it is unpaired."""
+        with self._lock:
+            for session_id, (_, _, session_client) in list(self.sessions.items()):
+                if session_client == client_uuid:
+                    del self.sessions[session_id]
@@ -1,7 +1,9 @@
 """Module for `State` class."""
+import os
+
 import ed25519
 
-from pyhap import util
+from pyhap import hsrp, util
 from pyhap.const import DEFAULT_CONFIG_VERSION, DEFAULT_PORT
 
 
@@ -30,7 +32,31 @@ class State:
         self.private_key = sk
         self.public_key = vk
 
+        # (username, pincode, N, g), salt, verifier; see get_srp_verifier
+        self._srp_verifier = None
+
     # ### Pairing ###
+    def get_srp_verifier(self, username, ctx):
+        """Return the SRP salt and verifier for the pincode.
+
+        They are derived once per pincode, rather than for every pair setup attempt.
+
+        :param username: The SRP username.
+        :type username: bytes
+
+        :param ctx: The SRP context, see pyhap.params.get_srp_context.
+        :type ctx: dict
+
+        :return: The salt and the verifier.
+        :rtype: tuple <bytes, int>
+        """
+        key = (username, self.pincode, ctx['N'], ctx['g'])
+        if self._srp_verifier is None or self._srp_verifier[0] != key:
+            salt = os.urandom(ctx['salt_len'])
+            verifier = hsrp.get_verifier(username, self.pincode, salt, ctx)
+            self._srp_verifier = (key, salt, verifier)
+        return self._srp_verifier[1:]
+
     @property
     def paired(self):
         """Return if main accessory is currently paired."""
@@ -1,8 +1,22 @@
-"""Encodes and decodes Tag-Length-Value (tlv8) data."""
-import struct
+"""Encodes and decodes Tag-Length-Value (tlv8) data.
 
+A value longer than 255 bytes is split into fragments: consecutive items with the same
+tag, all but the last of them 255 bytes long. Items of a list are separated by an
+item with the ``SEPARATOR`` tag and an empty value, e.g.
+``encode(tag, first, SEPARATOR, b'', tag, second)``.
+
+``decode`` returns a ``dict`` and merges the values of all items with the same tag.
+To read lists, or any data with repeated tags, use ``iter_items`` or ``iter_groups``,
+which also avoid copying the values.
+"""
 from pyhap import util
 
+SEPARATOR = b'\xFF'
+"""The tag of the item that separates the elements of a list."""
+
+_BYTES = [bytes((i,)) for i in range(256)]
+"""The single byte of every tag and length, to avoid creating them again."""
+
 
 def encode(*args, to_base64=False):
     """Encode the given byte args in TLV format.
@@ -25,17 +39,13 @@ def encode(*args, to_base64=False):
         tag = args[x]
         data = args[x + 1]
         total_length = len(data)
-        if len(data) <= 255:
-            encoded = tag + struct.pack("B", total_length) + data
+        if total_length <= 255:
+            pieces += (tag, _BYTES[total_length], data)
         else:
-            encoded = b""
-            for y in range(0, total_length // 255):
-                encoded = encoded + tag + b'\xFF' + data[y * 255: (y + 1) * 255]
-            remaining = total_length % 255
-            encoded = encoded + tag + struct.pack("B", remaining) \
-                + data[-remaining:]
-
-        pieces.append(encoded)
+            view = memoryview(data)
+            for start in range(0, total_length, 255):
+                fragment = view[start: start + 255]
+                pieces += (tag, _BYTES[len(fragment)], fragment)
 
     result = b"".join(pieces)
 
@@ -55,18 +65,89 @@ def decode(data, from_base64=False):
         data = util.base64_to_bytes(data)
 
     objects = {}
+    fragments = None  # tag: [value, ...] of the tags that occur more than once
     current = 0
-    while current < len(data):
-        # The following hack is because bytes[x] is an int
-        # and we want to keep the tag as a byte.
-        tag = data[current: current + 1]
-        length = data[current + 1]
-        value = data[current + 2: current + 2 + length]
-        if tag in objects:
-            objects[tag] = objects[tag] + value
+    end = len(data)
+    while current < end:
+        tag = _BYTES[data[current]]
+        start = current + 2
+        current = start + data[current + 1]
+        if tag not in objects:
+            objects[tag] = data[start: current]
+        elif fragments is None:
+            fragments = {tag: [objects[tag], data[start: current]]}
+        elif tag in fragments:
+            fragments[tag].append(data[start: current])
         else:
-            objects[tag] = value
+            fragments[tag] = [objects[tag], data[start: current]]
 
-        current = current + 2 + length
+    if fragments:
+        for tag, values in fragments.items():
+            objects[tag] = b"".join(values)
 
     return objects
+
+
+def iter_items(data, from_base64=False):
+    """Iterate over the items of the given TLV-encoded ``data``, in order.
+
+    The fragments of a value are merged, but repeated tags are not, so the items of a
+    list are all returned, together with their separators.
+
+    :param from_base64: Whether the given ``data`` should be base64 decoded first.
+    :type from_base64: ``bool``
+
+    :return: An iterator of ``(tag, value)`` tuples. The tag is ``bytes`` and the value a
+        ``memoryview``, of ``data`` itself unless the value was fragmented. Use
+        ``bytes(value)`` to keep a value after ``data`` is changed.
+    :rtype: ``iterator``
+
+    :raises ValueError: When the last item is truncated.
+    """
+    if from_base64:
+        data = util.base64_to_bytes(data)
+
+    view = memoryview(data)
+    end = len(view)
+    current = 0
+    while current < end:
+        tag = view[current]
+        start = current + 2
+        if start > end or start + view[current + 1] > end:
+            raise ValueError('Truncated TLV item at offset %d' % current)
+        current = start + view[current + 1]
+        value = view[start: current]
+        if current - start == 255 and current < end and view[current] == tag:
+            values = [value]
+            while current - start == 255 and current < end and view[current] == tag:
+                start = current + 2
+                if start > end or start + view[current + 1] > end:
+                    raise ValueError('Truncated TLV item at offset %d' % current)
+                current = start + view[current + 1]
+                values.append(view[start: current])
+            value = memoryview(b"".join(values))
+        yield _BYTES[tag], value
+
+
+def iter_groups(data, separator=SEPARATOR, from_base64=False):
+    """Iterate over the elements of a TLV-encoded list.
+
+    :param separator: The tag of the items between the elements.
+    :type separator: ``bytes``
+
+    :param from_base64: Whether the given ``data`` should be base64 decoded first.
+    :type from_base64: ``bool``
+
+    :return: An iterator of one ``dict`` of tag to value for every element, with values
+        as returned by ``iter_items``.
+    :rtype: ``iterator``
+    """
+    group = {}
+    for tag, value in iter_items(data, from_base64):
+        if tag == separator:
+            yield group
+            group = {}
+        else:
+            group[tag] = value
+    if group:
+        yield group
@@ -0,0 +1,234 @@
+"""Module for tracing where the time of requests and events goes.
+
+Tracing is off until a sink is set with ``set_sink``. The request handling, the
+reads and writes of characteristics, publishing and the encrypted transport are then
+recorded in timed spans, which are passed to the sink when they end. A span started
+while another one is running in the same thread is its child, so the spans of a
+request form a tree, e.g.::
+
+    hap.request (PUT /characteristics)
+      driver.set_characteristics
+        characteristic.setter
+
+While tracing is off, ``span`` returns a shared no-op context manager and ``traced``
+functions call through directly, so the instrumented code pays for little more than a
+function call.
+
+A sink is any object with an ``export(span)`` method, e.g. a RingBufferSink to keep
+the latest spans in memory or a JSONLinesSink to write them to a file. ``Span.to_dict``
+returns a span in the OTLP/JSON encoding, and ``otlp_request`` wraps spans in the body
+of an OTLP/HTTP export request, which an OpenTelemetry collector accepts at
+``/v1/traces``.
+"""
+from collections import deque
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_sink = None
+_local = threading.local()
+
+STATUS_CODE_ERROR = 2
+"""The OTLP status code of a span that ended with an exception."""
+
+
+def set_sink(sink):
+    """Start passing spans to the given sink, or stop tracing if it is None."""
+    global _sink  # pylint: disable=global-statement
+    _sink = sink
+
+
+def get_sink():
+    """Return the current sink, or None if tracing is off."""
+    return _sink
+
+
+class Span:
+    """A timed operation, ended and exported when its context is left."""
+
+    __slots__ = ('name', 'attributes', 'trace_id', 'span_id', 'parent_id',
+                 'start_time', 'duration', 'error', '_sink', '_start', '_parent')
+
+    def __init__(self, name, sink, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = None
+        self.span_id = random.getrandbits(64)
+        self.parent_id = None
+        self.start_time = None  # seconds since the epoch
+        self.duration = None  # seconds
+        self.error = None
+        self._sink = sink
+        self._start = None
+        self._parent = None
+
+    def __enter__(self):
+        parent = self._parent = getattr(_local, 'span', None)
+        if parent is None:
+            self.trace_id = random.getrandbits(128)
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        _local.span = self
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._start
+        _local.span = self._parent
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        try:
+            self._sink.export(self)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Failed to export span %s', self.name)
+        return False
+
+    def set_attribute(self, key, value):
+        """Add an attribute to the span, e.g. once the result is known."""
+        self.attributes[key] = value
+
+    def to_dict(self):
+        """Return the span as a JSON serializable dict in the OTLP/JSON encoding.
+
+        As in the JSON mapping of protobuf, the 64 bit integers, i.e. the times and
+        integer attributes, are strings.
+        """
+        start = int(self.start_time * 1e9)
+        attributes = dict(self.attributes)
+        if self.error is not None:
+            attributes['error.type'] = self.error
+        record = {
+            'traceId': '{:032x}'.format(self.trace_id),
+            'spanId': '{:016x}'.format(self.span_id),
+            'parentSpanId': ('{:016x}'.format(self.parent_id)
+                             if self.parent_id is not None else ''),
+            'name': self.name,
+            'startTimeUnixNano': str(start),
+            'endTimeUnixNano': str(start + int(self.duration * 1e9)),
+            'attributes': [{'key': key, 'value': _any_value(value)}
+                           for key, value in attributes.items()],
+        }
+        if self.error is not None:
+            record['status'] = {'code': STATUS_CODE_ERROR}
+        return record
+
+
+def _any_value(value):
+    """Return the OTLP/JSON AnyValue of an attribute value."""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_any_value(item) for item in value]}}
+    return {'stringValue': str(value)}
+
+
+def otlp_request(spans, service_name='HAP-python'):
+    """Return the body of an OTLP/HTTP export request with the given spans.
+
+    :param spans: The spans to export, e.g. those of a RingBufferSink.
+    :type spans: iterable
+
+    :param service_name: The ``service.name`` of the resource the spans belong to.
+    :type service_name: str
+
+    :return: A JSON serializable dict, to POST to ``/v1/traces`` as JSON.
+    :rtype: dict
+    """
+    return {'resourceSpans': [{
+        'resource': {'attributes': [
+            {'key': 'service.name', 'value': _any_value(service_name)}]},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [exported.to_dict() for exported in spans],
+        }],
+    }]}
+
+
+class _NoopSpan:
+    """Stands in for a Span while tracing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Return a context manager that records the code it wraps in a span.
+
+    :param name: The name of the span, e.g. ``hap.request``.
+    :type name: str
+
+    :param attributes: Attributes of the span, e.g. the path of a request.
+    """
+    sink = _sink
+    if sink is None:
+        return _NOOP_SPAN
+    return Span(name, sink, attributes)
+
+
+def traced(name):
+    """Decorator that records every call of the function in a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return func(*args, **kwargs)
+            with Span(name, sink, {}):
+                return func(*args, **kwargs)
+        return _wrapper
+    return decorator
+
+
+class RingBufferSink:
+    """Keeps the latest spans in memory, e.g. to inspect them from a debugger."""
+
+    def __init__(self, maxlen=1000):
+        """
+        :param maxlen: The number of spans to keep. The oldest span is dropped first.
+        :type maxlen: int
+        """
+        self.spans = deque(maxlen=maxlen)
+
+    def export(self, span):  # pylint: disable=redefined-outer-name
+        """Remember the span."""
+        self.spans.append(span)
+
+
+class JSONLinesSink:
+    """Writes every span as a line of JSON, see ``Span.to_dict``. Thread-safe."""
+
+    def __init__(self, file):
+        """
+        :param file: A text file, opened for writing.
+        """
+        self.file = file
+        self._lock = threading.Lock()
+
+    def export(self, span):  # pylint: disable=redefined-outer-name
+        """Write the span and flush it."""
+        line = json.dumps(span.to_dict()) + '\n'
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
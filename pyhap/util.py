@@ -3,8 +3,23 @@ import base64
 import socket
 import random
 import binascii
+import functools
+import json
+from json.encoder import encode_basestring_ascii
+import math
 import sys
 
+# Use a fast JSON library for events if one is installed.
+# Installation with `pip install HAP-python[FastJSON]`.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 
 ALPHANUM = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 HEX_DIGITS = '0123456789ABCDEF'
@@ -12,6 +27,15 @@ HEX_DIGITS = '0123456789ABCDEF'
 rand = random.SystemRandom()
 
 
+def iscoro(func):
+    """Check if the function is a coroutine or if the function is a ``functools.partial``,
+    check the wrapped function for the same.
+    """
+    if isinstance(func, functools.partial):
+        func = func.func
+    return asyncio.iscoroutinefunction(func)
+
+
 def get_local_address():
     """
     Grabs the local IP address using a socket.
@@ -39,16 +63,7 @@ def long_to_bytes(n):
     :return: ``long int`` in ``bytes`` format.
     :rtype: bytes
     """
-    byteList = list()
-    x = 0
-    off = 0
-    while x != n:
-        b = (n >> off) & 0xFF
-        byteList.append(b)
-        x = x | (b << off)
-        off += 8
-    byteList.reverse()
-    return bytes(byteList)
+    return n.to_bytes((n.bit_length() + 7) // 8, byteorder="big")
 
 
 def generate_mac():
@@ -147,3 +162,41 @@ async def event_wait(event, timeout, loop=None):
     except asyncio.TimeoutError:
         pass
     return event.is_set()
+
+
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def _stdlib_to_json_bytes(obj):
+    """Serialize ``obj`` to compact JSON bytes with the json module.
+
+    Characteristic values are mostly scalars, which are formatted directly since
+    the overhead of the encoder dominates for them.
+    """
+    obj_type = type(obj)
+    if obj_type is bool:
+        return b'true' if obj else b'false'
+    if obj_type is int:
+        return str(obj).encode()
+    if obj_type is float and math.isfinite(obj):
+        return repr(obj).encode()
+    if obj_type is str:
+        return encode_basestring_ascii(obj).encode()
+    return _JSON_ENCODER.encode(obj).encode()
+
+
+def _ujson_to_json_bytes(obj):
+    """Serialize ``obj`` to compact JSON bytes with ujson."""
+    return ujson.dumps(obj).encode()
+
+
+# to_json_bytes(obj) serializes obj to compact JSON bytes with the fastest
+# available library. The libraries differ for values that are not valid JSON: the
+# json module writes NaN and Infinity as such, while orjson writes them as null and
+# raises a TypeError for integers of more than 64 bits.
+if orjson is not None:
+    to_json_bytes = orjson.dumps  # pylint: disable=invalid-name,no-member
+elif ujson is not None:
+    to_json_bytes = _ujson_to_json_bytes  # pylint: disable=invalid-name
+else:
+    to_json_bytes = _stdlib_to_json_bytes  # pylint: disable=invalid-name
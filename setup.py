@@ -60,5 +60,6 @@ setup(
     ],
     extras_require={
         'QRCode': ['base36', 'pyqrcode'],
+        'FastJSON': ['orjson'],
     }
 )
@@ -14,9 +14,17 @@ def mock_driver():
     yield MockDriver()
 
 
+async def _mock_server_call(*_args):
+    """Stand-in for the AsyncHAPServer start and stop coroutines."""
+
+
 @pytest.fixture
 def driver():
     with patch("pyhap.accessory_driver.HAPServer"), patch(
+        "pyhap.accessory_driver.AsyncHAPServer.async_start", new=_mock_server_call
+    ), patch(
+        "pyhap.accessory_driver.AsyncHAPServer.async_stop", new=_mock_server_call
+    ), patch(
         "pyhap.accessory_driver.Zeroconf"
     ), patch("pyhap.accessory_driver.AccessoryDriver.persist"):
         yield AccessoryDriver()
@@ -26,9 +34,13 @@ class MockDriver():
 
     def __init__(self):
         self.loader = Loader()
+        self.suppress_unchanged_events = False
 
     def publish(self, data, client_addr=None):
         pass
 
+    def accessories_changed(self):
+        pass
+
     def add_job(self, target, *args):  # pylint: disable=no-self-use
         asyncio.get_event_loop().run_until_complete(target(*args))
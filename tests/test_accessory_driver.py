@@ -1,12 +1,19 @@
 """Tests for pyhap.accessory_driver."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
 import tempfile
+import threading
 from unittest.mock import MagicMock, patch
 from uuid import uuid1
 
 import pytest
 
+from pyhap import hsrp, util
 from pyhap.accessory import STANDALONE_AID, Accessory, Bridge
-from pyhap.accessory_driver import AccessoryDriver
+from pyhap.accessory_driver import AccessoryDriver, CountingThreadPoolExecutor
 from pyhap.characteristic import (HAP_FORMAT_INT, HAP_PERMISSION_READ,
                                   PROP_FORMAT, PROP_PERMISSIONS,
                                   Characteristic)
@@ -56,6 +63,63 @@ def test_persist_load():
     assert driver.state.public_key == pk
 
 
+def test_persist_is_atomic():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        persist_file = os.path.join(tmp_dir, "accessory.state")
+        with patch("pyhap.accessory_driver.HAPServer"), patch(
+            "pyhap.accessory_driver.Zeroconf"
+        ):
+            driver = AccessoryDriver(port=51234, persist_file=persist_file)
+        driver.persist()
+        with open(persist_file) as fp:
+            state = fp.read()
+
+        def fail(fp, _state):
+            fp.write("{")
+            raise OSError("disk full")
+
+        driver.encoder = MagicMock(persist=fail)
+        with pytest.raises(OSError):
+            driver.persist()
+        with open(persist_file) as fp:
+            assert fp.read() == state
+        assert os.listdir(tmp_dir) == ["accessory.state"]
+
+
+def test_schedule_persist(driver):
+    driver.PERSIST_DELAY = 0.01
+    driver.schedule_persist()
+    driver.schedule_persist()
+    assert driver.persist.call_count == 0
+
+    driver.loop.run_until_complete(asyncio.sleep(0.1))
+    assert driver.persist.call_count == 1
+
+    # Pending changes are written when the driver stops
+    driver.schedule_persist()
+    driver.persist_if_pending()
+    assert driver.persist.call_count == 2
+    driver.loop.run_until_complete(asyncio.sleep(0.1))
+    assert driver.persist.call_count == 2
+
+
+def test_pair_persists_immediately(driver):
+    """Test that pairing changes are written without waiting for the event loop."""
+    driver.PERSIST_DELAY = 0.01
+    client_uuid = uuid1()
+    driver.schedule_persist()
+    driver.pair(client_uuid, b"\x01" * 32)
+    assert driver.persist.call_count == 1
+    assert not driver.persist_pending
+
+    driver.unpair(client_uuid)
+    assert driver.persist.call_count == 2
+
+    # The scheduled write has nothing left to write
+    driver.loop.run_until_complete(asyncio.sleep(0.1))
+    assert driver.persist.call_count == 2
+
+
 def test_external_zeroconf():
     zeroconf = MagicMock()
     with patch("pyhap.accessory_driver.HAPServer"), patch(
@@ -166,6 +230,216 @@ def test_service_callbacks(driver):
     }
 
 
+def test_get_characteristics_concurrent_getters(driver):
+    """Test that slow getters run concurrently and time out on their own."""
+    driver.concurrent_getters = True
+    driver.getter_timeout = 0.2
+    acc = Accessory(driver, "TestAcc")
+    chars = [Characteristic("Char{}".format(i), uuid1(), CHAR_PROPS.copy())
+             for i in range(4)]
+    service = Service(uuid1(), "Test Service")
+    service.add_characteristic(*chars)
+    acc.add_service(service)
+    driver.add_accessory(acc)
+    release = threading.Event()
+
+    async def _async_getter():
+        await asyncio.sleep(0)
+        return 2
+
+    async def _slow_async_getter():
+        await asyncio.sleep(10)
+
+    def _slow_getter():
+        release.wait(10)
+        return 4
+
+    chars[0].getter_callback = lambda: 1
+    chars[1].getter_callback = _async_getter
+    chars[2].getter_callback = _slow_async_getter
+    chars[3].getter_callback = _slow_getter
+
+    with running_loop(driver, release=release):
+        get_chars = driver.get_characteristics(
+            ["1.{}".format(acc.iid_manager.get_iid(char)) for char in chars])
+
+    assert [(rep["status"], rep.get("value"))
+            for rep in get_chars[HAP_REPR_CHARS]] == [
+                (0, 1), (0, 2), (-70402, None), (-70402, None)]
+    assert chars[1].value == 2
+    # A coroutine getter is not called outside the event loop
+    assert chars[1].get_value() == 2
+
+
+def test_get_characteristics_concurrent_getters_in_executor(driver):
+    """Test that reads handled by every worker of the default executor do not wait
+    for a worker to run their getters."""
+    driver.concurrent_getters = True
+    driver.getter_timeout = 0.5
+    acc = Accessory(driver, "TestAcc")
+    chars = [Characteristic("Char{}".format(i), uuid1(), CHAR_PROPS.copy())
+             for i in range(2)]
+    service = Service(uuid1(), "Test Service")
+    service.add_characteristic(*chars)
+    acc.add_service(service)
+    driver.add_accessory(acc)
+    for char in chars:
+        char.getter_callback = lambda: 1
+    char_ids = ["1.{}".format(acc.iid_manager.get_iid(char)) for char in chars]
+
+    async def _read_twice():
+        return await asyncio.gather(*(
+            driver.loop.run_in_executor(None, driver.get_characteristics, char_ids)
+            for _ in range(2)))
+
+    with running_loop(driver, ThreadPoolExecutor(max_workers=2)):
+        responses = asyncio.run_coroutine_threadsafe(
+            _read_twice(), driver.loop).result(1)
+
+    assert [(rep["status"], rep.get("value")) for response in responses
+            for rep in response[HAP_REPR_CHARS]] == [(0, 1)] * 4
+
+
+@contextmanager
+def running_loop(driver, executor=None, release=None):
+    """Run the event loop of the driver in a thread until the block exits.
+
+    :param executor: The default executor of the loop while it runs, shut down after.
+
+    :param release: An event set on exit, so that blocked callbacks can finish.
+    """
+    if executor is not None:
+        driver.loop.set_default_executor(executor)
+    thread = threading.Thread(target=driver.loop.run_forever)
+    thread.start()
+    try:
+        yield
+    finally:
+        if release is not None:
+            release.set()
+        driver.loop.call_soon_threadsafe(driver.loop.stop)
+        thread.join()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def get_bridge_of_lightbulbs(driver, callbacks):
+    """Add a bridge with a lightbulb for each service callback and return the bulbs'
+    (aid, iid of On) pairs."""
+    bridge = Bridge(driver, "mybridge")
+    ids = []
+    for aid, setter_callback in enumerate(callbacks, 2):
+        acc = Accessory(driver, "TestAcc{}".format(aid), aid=aid)
+        service = Service(uuid1(), "Lightbulb")
+        service.add_characteristic(Characteristic("On", uuid1(), CHAR_PROPS))
+        service.setter_callback = setter_callback
+        acc.add_service(service)
+        bridge.add_accessory(acc)
+        ids.append((aid, acc.iid_manager.get_iid(service.characteristics[0])))
+    driver.add_accessory(bridge)
+    return ids
+
+
+def test_set_characteristics_write_response(driver):
+    """Test that write_response reports the status of every characteristic."""
+    driver.write_response = True
+
+    def _fail_callback(_values):
+        raise ValueError
+
+    (aid, iid), (aid2, iid2) = get_bridge_of_lightbulbs(
+        driver, [MagicMock(), _fail_callback])
+    response = driver.set_characteristics({HAP_REPR_CHARS: [
+        {HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_VALUE: 1, "r": True},
+        {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, HAP_REPR_VALUE: 1},
+        {HAP_REPR_AID: 9, HAP_REPR_IID: 9, HAP_REPR_VALUE: 1},
+    ]}, "mock_addr")
+
+    assert response == {HAP_REPR_CHARS: [
+        {HAP_REPR_AID: aid, HAP_REPR_IID: iid, "status": 0, HAP_REPR_VALUE: 1},
+        {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, "status": -70402},
+        {HAP_REPR_AID: 9, HAP_REPR_IID: 9, "status": -70409},
+    ]}
+
+
+def test_set_characteristics_concurrent_setters(driver):
+    """Test that the callbacks of different accessories run at the same time."""
+    driver.concurrent_setters = True
+    both_running = threading.Barrier(2, timeout=1)
+    called = []
+
+    def _sync_callback(values):
+        both_running.wait()
+        called.append(("sync", values))
+
+    async def _async_callback(values):
+        await driver.loop.run_in_executor(None, both_running.wait)
+        called.append(("async", values))
+
+    (aid, iid), (aid2, iid2) = get_bridge_of_lightbulbs(
+        driver, [_sync_callback, _async_callback])
+    with running_loop(driver):
+        driver.set_characteristics({HAP_REPR_CHARS: [
+            {HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_VALUE: 1},
+            {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, HAP_REPR_VALUE: 0},
+        ]}, "mock_addr")
+
+    assert sorted(called) == [("async", {"On": 0}), ("sync", {"On": 1})]
+
+
+def test_set_characteristics_concurrent_setters_in_executor(driver):
+    """Test that writes handled by every worker of the default executor do not wait
+    for a worker to run their callbacks."""
+    driver.concurrent_setters = True
+    driver.setter_timeout = 0.5
+    called = []
+    ids = get_bridge_of_lightbulbs(driver, [called.append, called.append])
+    query = {HAP_REPR_CHARS: [{HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_VALUE: 1}
+                              for aid, iid in ids]}
+
+    async def _write_twice():
+        await asyncio.gather(*(
+            driver.loop.run_in_executor(None, driver.set_characteristics, query,
+                                        "mock_addr")
+            for _ in range(2)))
+
+    with running_loop(driver, ThreadPoolExecutor(max_workers=2)):
+        asyncio.run_coroutine_threadsafe(_write_twice(), driver.loop).result(1)
+
+    assert called == [{"On": 1}] * 4
+
+
+def test_set_characteristics_concurrent_setters_timeout(driver):
+    """Test that a write stops waiting for its callbacks after setter_timeout."""
+    driver.concurrent_setters = True
+    driver.write_response = True
+    driver.setter_timeout = 0.1
+    release = threading.Event()
+
+    def _slow_callback(_values):
+        release.wait(1)
+
+    (aid, iid), (aid2, iid2) = get_bridge_of_lightbulbs(
+        driver, [MagicMock(), _slow_callback])
+    with running_loop(driver, release=release):
+        response = driver.set_characteristics({HAP_REPR_CHARS: [
+            {HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_VALUE: 1},
+            {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, HAP_REPR_VALUE: 1},
+        ]}, "mock_addr")
+
+        driver.write_response = False
+        with pytest.raises(asyncio.TimeoutError):
+            driver.set_characteristics({HAP_REPR_CHARS: [
+                {HAP_REPR_AID: aid, HAP_REPR_IID: iid, HAP_REPR_VALUE: 0},
+                {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, HAP_REPR_VALUE: 0},
+            ]}, "mock_addr")
+
+    assert response == {HAP_REPR_CHARS: [
+        {HAP_REPR_AID: aid, HAP_REPR_IID: iid, "status": 0},
+        {HAP_REPR_AID: aid2, HAP_REPR_IID: iid2, "status": -70402},
+    ]}
+
+
 def test_start_stop_sync_acc(driver):
     class Acc(Accessory):
         running = True
@@ -212,7 +486,7 @@ def test_send_events(driver):
     class HapServerMock:
         pushed_events = []
 
-        def push_event(self, bytedata, client_addr):
+        def push_event(self, bytedata, client_addr, topics=()):  # pylint: disable=unused-argument
             self.pushed_events.extend([[bytedata, client_addr]])
             return 1
 
@@ -222,11 +496,232 @@ def test_send_events(driver):
     driver.http_server = HapServerMock()
     driver.loop = LoopMock()
     driver.topics = {"mocktopic": ["client1", "client2", "client3"]}
-    driver.event_queue.put(("mocktopic", "bytedata", "client1"))
+    driver.event_queue.put(("mocktopic", {"aid": 1, "iid": 1}, "client1"))
     driver.send_events()
 
     # Only client2 and client3 get the event when client1 sent it
+    bytedata = b'{"characteristics":[{"aid":1,"iid":1}]}'
     assert driver.http_server.get_pushed_events() == [
-        ["bytedata", "client2"],
-        ["bytedata", "client3"],
+        [bytedata, "client2"],
+        [bytedata, "client3"],
     ]
+
+
+def test_send_events_coalesced(driver):
+    driver.loop = MagicMock()
+    driver.loop.is_closed.side_effect = [False, True]
+    driver.http_server = MagicMock()
+    driver.http_server.push_event.return_value = False
+    driver.subscribe_client_topic("client1", (1, 9))
+    driver.subscribe_client_topic("client2", (1, 9))
+    driver.subscribe_client_topic("client1", (1, 10))
+
+    driver.publish({"aid": 1, "iid": 9, "value": 1})
+    driver.publish({"aid": 1, "iid": 10, "value": 2})
+    driver.publish({"aid": 1, "iid": 9, "value": 3}, "client2")
+    driver.send_events()
+
+    # The superseded value is dropped and client1 gets both changes at once
+    assert driver.http_server.push_event.call_count == 1
+    bytedata, client_addr, topics = driver.http_server.push_event.call_args[0]
+    assert client_addr == "client1"
+    assert topics == [(1, 10), (1, 9)]
+    assert json.loads(bytedata) == {
+        "characteristics": [
+            {"aid": 1, "iid": 10, "value": 2},
+            {"aid": 1, "iid": 9, "value": 3},
+        ]
+    }
+    # The failed push unsubscribes client1 from the topics that were sent
+    assert driver.topics == {(1, 9): {"client2"}}
+    assert driver.client_topics == {"client2": {(1, 9)}}
+
+
+def test_send_events_unserializable(driver):
+    """Test that an event that cannot be encoded does not stop later events."""
+    def is_closed():
+        is_closed.calls += 1
+        if is_closed.calls == 2:
+            driver.publish({"aid": 1, "iid": 9, "value": 2})
+        return is_closed.calls > 2
+
+    is_closed.calls = 0
+    driver.loop = MagicMock()
+    driver.loop.is_closed.side_effect = is_closed
+    driver.http_server = MagicMock()
+    driver.subscribe_client_topic("client1", (1, 9))
+
+    driver.publish({"aid": 1, "iid": 9, "value": b"\x00"})
+    driver.send_events()
+
+    driver.http_server.push_event.assert_called_once_with(
+        b'{"characteristics":[{"aid":1,"iid":9,"value":2}]}', "client1", [(1, 9)])
+
+
+def test_executor_backlog():
+    """Test that the jobs waiting for a worker are counted."""
+    executor = CountingThreadPoolExecutor(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    try:
+        running = executor.submit(lambda: started.set() or release.wait())
+        assert started.wait(1)
+        waiting = executor.submit(lambda x: x, 1)
+        cancelled = executor.submit(lambda x: x, 2)
+        assert executor.backlog == 2
+        assert cancelled.cancel()
+        assert executor.backlog == 1
+        release.set()
+        assert running.result(1) is True
+        assert waiting.result(1) == 1
+        assert executor.backlog == 0
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_metrics(driver):
+    """Test that the events and queues of the driver are recorded in its metrics."""
+    driver.suppress_unchanged_events = True
+    [(aid, iid)] = get_bridge_of_lightbulbs(driver, [None])
+    char = driver.accessory.get_characteristic(aid, iid)
+    driver.subscribe_client_topic("client1", (aid, iid))
+    char.set_value(True)
+    char.set_value(True)
+
+    metrics = driver.metrics
+    labels = {"aid": aid, "iid": iid}
+    assert metrics.get_sample_value("hap_events_suppressed_total", labels) == 1
+    assert metrics.get_sample_value("hap_event_queue_size") == 1
+    assert metrics.get_sample_value("hap_connections") == 0
+    assert metrics.get_sample_value("hap_executor_backlog") == 0
+    assert b"hap_encrypted_sessions 0\n" in metrics.render()
+
+    driver.loop = MagicMock()
+    driver.loop.is_closed.side_effect = [False, True]
+    driver.http_server = MagicMock()
+    driver.http_server.push_event.return_value = False
+    driver.send_events()
+    assert metrics.get_sample_value("hap_events_published_total", labels) == 1
+    assert metrics.get_sample_value("hap_events_failed_total", labels) == 1
+
+
+def test_send_events_coalesce_window(driver):
+    driver.event_coalesce_window = 0.05
+    driver.subscribe_client_topic("client1", (1, 9))
+    driver.publish({"aid": 1, "iid": 9, "value": 1})
+    threading.Timer(
+        0.01, driver.publish, args=({"aid": 1, "iid": 9, "value": 2},)).start()
+
+    events = driver._get_event_batch()  # pylint: disable=protected-access
+    assert events == {(1, 9): ({"aid": 1, "iid": 9, "value": 2}, None)}
+
+
+def test_subscriptions(driver):
+    driver.subscribe_client_topic("client1", (1, 9))
+    driver.subscribe_client_topic("client1", (1, 10))
+    driver.subscribe_client_topic("client2", (1, 9))
+    subscribed_clients = driver.topics[(1, 9)]
+
+    driver.subscribe_client_topic("client1", (1, 9), False)
+    driver.subscribe_client_topic("client1", (2, 9), False)
+    assert driver.topics == {(1, 9): {"client2"}, (1, 10): {"client1"}}
+    # Sets are replaced, not modified, so readers need no copy
+    assert subscribed_clients == {"client1", "client2"}
+
+    driver.unsubscribe_client("client1")
+    driver.unsubscribe_client("client3")
+    assert driver.topics == {(1, 9): {"client2"}}
+    assert driver.client_topics == {"client2": {(1, 9)}}
+
+
+def test_get_accessories_json(driver):
+    bridge = Bridge(driver, "mybridge")
+    acc = Accessory(driver, "TestAcc", aid=2)
+    service = Service(uuid1(), "Lightbulb")
+    char_on = Characteristic("On", uuid1(), CHAR_PROPS)
+    service.add_characteristic(char_on)
+    acc.add_service(service)
+    bridge.add_accessory(acc)
+    driver.add_accessory(bridge)
+
+    assert json.loads(driver.get_accessories_json()) == driver.get_accessories()
+    cache = driver.accessories_json_cache
+    assert cache is not None
+
+    # Values are spliced into the cached structure
+    char_on.set_value(5, should_notify=False)
+    bridge.get_service("AccessoryInformation").get_characteristic(
+        "SerialNumber").set_value("x" * 70, should_notify=False)
+    assert json.loads(driver.get_accessories_json()) == driver.get_accessories()
+    assert driver.accessories_json_cache is cache
+
+    # Adding a service, overriding properties or changing the config version
+    # invalidates the cache
+    acc.add_service(Service(uuid1(), "Switch"))
+    assert json.loads(driver.get_accessories_json()) == driver.get_accessories()
+    assert driver.accessories_json_cache is not cache
+
+    cache = driver.accessories_json_cache
+    char_on.override_properties({"maxValue": 50}, valid_values={"Low": 1, "High": 2})
+    accessories = json.loads(driver.get_accessories_json())
+    assert accessories == driver.get_accessories()
+    assert driver.accessories_json_cache is not cache
+    iid = acc.iid_manager.get_iid(char_on)
+    char_json = next(char for acc_json in accessories["accessories"]
+                     if acc_json["aid"] == 2
+                     for service_json in acc_json["services"]
+                     for char in service_json["characteristics"] if char["iid"] == iid)
+    assert char_json["maxValue"] == 50
+    assert char_json["valid-values"] == [1, 2]
+
+    cache = driver.accessories_json_cache
+    with patch.object(driver, "update_advertisement"):
+        driver.config_changed()
+    assert json.loads(driver.get_accessories_json()) == driver.get_accessories()
+    assert driver.accessories_json_cache is not cache
+
+
+@pytest.mark.parametrize("value", [True, False, 0, -7, 21.5, "a\"bé", None, [1]])
+def test_encode_event_data(driver, value):
+    data = {"aid": 2, "iid": 9, "value": value}
+    encoded = driver._encode_event_data("2.9", data)
+    assert json.loads(encoded.decode()) == data
+    assert driver.event_prefixes == {"2.9": b'{"aid":2,"iid":9,"value":'}
+    assert json.loads(util._stdlib_to_json_bytes(data).decode()) == data
+
+    # Other data is serialized as a whole
+    data = {"aid": 2, "iid": 9, "status": -70402}
+    assert json.loads(driver._encode_event_data("2.9", data).decode()) == data
+
+
+def test_srp_verifier(driver):
+    """Test that a controller that knows the pincode passes the SRP proof."""
+    driver.state.pincode = b"123-45-678"
+    driver.setup_srp_verifier()
+    verifier = driver.srp_verifier
+    salt, B = verifier.get_challenge()
+    ctx = verifier.ctx
+    hashfunc, N, g = ctx["hashfunc"], ctx["N"], ctx["g"]
+
+    # The controller side of SRP
+    a = 12345
+    A = pow(g, a, N)
+    u = hsrp.bytes_to_long(hashfunc(
+        hsrp.padN(util.long_to_bytes(A), ctx)
+        + hsrp.padN(util.long_to_bytes(B), ctx)).digest())
+    x = hsrp.get_x(b"Pair-Setup", b"123-45-678", salt, ctx)
+    K = hsrp.get_session_key(pow(B - ctx["k"] * pow(g, x, N), a + u * x, N), ctx)
+    M = hashfunc(ctx["hGroup"] + hashfunc(b"Pair-Setup").digest() + salt
+                 + util.long_to_bytes(A) + util.long_to_bytes(B)
+                 + util.long_to_bytes(K)).digest()
+
+    verifier.set_A(util.long_to_bytes(A))
+    assert verifier.verify(M) is not None
+    assert verifier.verify(b"wrong proof") is None
+    assert verifier.get_session_key() == K
+
+    # The salt and verifier are reused, the ephemeral key is not
+    driver.setup_srp_verifier()
+    assert driver.srp_verifier.get_challenge()[0] == salt
+    assert driver.srp_verifier.get_challenge()[1] != B
@@ -5,7 +5,8 @@ from uuid import uuid1
 import pytest
 
 from pyhap.characteristic import (
-    Characteristic, HAP_FORMAT_INT, HAP_FORMAT_DEFAULTS, HAP_PERMISSION_READ)
+    GETTER_STALE_BACKGROUND, HAP_FORMAT_DEFAULTS, HAP_FORMAT_INT, HAP_PERMISSION_READ,
+    Characteristic)
 
 PROPERTIES = {
     'Format': HAP_FORMAT_INT,
@@ -54,11 +55,13 @@ def test_to_valid_value():
     """Test function to test if value is valid and saved correctly."""
     char = get_char(PROPERTIES.copy(), valid={'foo': 2, 'bar': 3},
                     min_value=2, max_value=7)
-    with pytest.raises(ValueError):
-        char.to_valid_value(1)
+    for value in (1, [2], {'foo': 2}):
+        with pytest.raises(ValueError):
+            char.to_valid_value(value)
     assert char.to_valid_value(2) == 2
 
-    del char.properties['ValidValues']
+    char.override_properties({'ValidValues': None})
+    assert 'ValidValues' not in char.properties
     for value in ('2', None):
         with pytest.raises(ValueError):
             char.to_valid_value(value)
@@ -66,17 +69,33 @@ def test_to_valid_value():
     assert char.to_valid_value(5) == 5
     assert char.to_valid_value(8) == 7
 
-    char.properties['Format'] = 'string'
+    char.override_properties({'Format': 'string'})
     assert char.to_valid_value(24) == '24'
 
-    char.properties['Format'] = 'bool'
+    char.override_properties({'Format': 'bool'})
     assert char.to_valid_value(1) is True
     assert char.to_valid_value(0) is False
 
-    char.properties['Format'] = 'dictionary'
+    char.override_properties({'Format': 'dictionary'})
     assert char.to_valid_value({'a': 1}) == {'a': 1}
 
 
+def test_validator_is_rebuilt_on_override():
+    """Test that the validator follows the properties set with override_properties."""
+    char = get_char(PROPERTIES.copy(), min_value=2, max_value=7)
+    assert char.to_valid_value(50) == 7
+
+    char.override_properties(properties={'maxValue': 20})
+    assert char.to_valid_value(50) == 20
+    assert char.value == 2
+
+    char.override_properties(valid_values={'foo': 4, 'bar': 5})
+    assert char.value == 4
+    assert char.to_valid_value(5) == 5
+    with pytest.raises(ValueError):
+        char.to_valid_value(6)
+
+
 def test_override_properties_properties():
     """Test if overriding the properties works."""
     new_properties = {'minValue': 10, 'maxValue': 20, 'step': 1}
@@ -238,3 +257,74 @@ def test_from_dict():
     assert char.display_name == 'Test Char'
     assert char.type_id == uuid
     assert char.properties == {'Format': 'int', 'Permissions': 'read'}
+
+
+def test_set_value_suppress_unchanged_events():
+    """Test that unchanged values are only notified if not suppressed."""
+    path = 'pyhap.characteristic.Characteristic.notify'
+    char = get_char({'Format': 'float', 'Permissions': [HAP_PERMISSION_READ]})
+    char.broker = Mock()
+    char.broker.driver.suppress_unchanged_events = False
+
+    with patch(path, autospec=True) as mock_notify:
+        mock_notify.side_effect = lambda self: setattr(self, '_notified_value',
+                                                       self.value)
+        char.set_value(20.0)
+        char.set_value(20.0)
+        assert mock_notify.call_count == 2
+
+        # Follows the driver option
+        char.broker.driver.suppress_unchanged_events = True
+        char.set_value(20.0)
+        assert mock_notify.call_count == 2
+        char.set_value(20.1)
+        assert mock_notify.call_count == 3
+
+        # Changes within the deadband are suppressed, from the last notified value
+        char.deadband = 0.5
+        char.set_value(20.4)
+        char.set_value(20.6)
+        assert mock_notify.call_count == 3
+        assert char.value == 20.6
+        char.set_value(20.7)
+        assert mock_notify.call_count == 4
+        assert char.suppressed_events == 3
+
+        # The characteristic overrides the driver
+        char.suppress_unchanged_events = False
+        char.set_value(20.7)
+        assert mock_notify.call_count == 5
+
+
+def test_get_value_getter_ttl():
+    """Test that a getter value is reused until its TTL expires."""
+    char = get_char(PROPERTIES.copy())
+    char.getter_callback = Mock(side_effect=[1, 2, 3])
+    char.getter_ttl = 10
+
+    with patch('pyhap.characteristic.time.monotonic', return_value=100):
+        assert char.get_value() == 1
+        assert char.get_value() == 1
+    with patch('pyhap.characteristic.time.monotonic', return_value=110):
+        assert char.get_value() == 2
+    assert char.getter_callback.call_count == 2
+
+
+def test_get_value_getter_stale_background():
+    """Test that an expired getter value is returned and refreshed in the background."""
+    char = get_char(PROPERTIES.copy())
+    char.getter_callback = Mock(side_effect=[1, 2])
+    char.getter_ttl = 10
+    char.getter_stale_policy = GETTER_STALE_BACKGROUND
+    char.broker = Mock()
+
+    with patch('pyhap.characteristic.time.monotonic', return_value=100):
+        assert char.get_value() == 1
+    with patch('pyhap.characteristic.time.monotonic', return_value=110):
+        assert char.get_value() == 1
+        assert char.get_value() == 1
+        char.broker.driver.add_job.assert_called_once_with(
+            char._refresh_value)  # pylint: disable=protected-access
+        char._refresh_value()  # pylint: disable=protected-access
+        assert char.get_value() == 2
+    assert char.getter_callback.call_count == 2
@@ -0,0 +1,379 @@
+"""Tests for the asyncio HAP transport."""
+import asyncio
+import json
+from unittest.mock import Mock, patch
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+import curve25519
+
+from pyhap import hap_protocol, tlv
+from pyhap.hap_server import (
+    EVENT_OVERFLOW_POLICY, HAP_TLV_TAGS, HAPCrypto, HAPServer, hap_hkdf)
+from pyhap.metrics import MetricsRegistry
+from pyhap.session_cache import SessionCache
+from pyhap.state import State
+
+CLIENT_ADDR = ("192.168.1.1", 55555)
+CLIENT_PUBLIC = curve25519.Private().get_public().serialize()
+SHARED_KEY = b"\x00" * 32
+
+
+class TransportMock:
+    """Records everything written to it."""
+
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def get_extra_info(self, name):  # pylint: disable=unused-argument,no-self-use
+        return CLIENT_ADDR
+
+    def write(self, data):
+        self.written.append(data)
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def get_client_crypto():
+    """Return a HAPCrypto with the controller's view of the session keys."""
+    client_crypto = HAPCrypto(SHARED_KEY)
+    # pylint: disable=protected-access
+    client_crypto._out_cipher, client_crypto._in_cipher = \
+        client_crypto._in_cipher, client_crypto._out_cipher
+    return client_crypto
+
+
+def get_protocol(loop, accessory_handler, **server_opts):
+    """Return a connected HAPServerProtocol and its transport."""
+    server = hap_protocol.AsyncHAPServer(("127.0.0.1", 0), accessory_handler,
+                                         **server_opts)
+    server.loop = loop
+    protocol = hap_protocol.HAPServerProtocol(loop, server)
+    transport = TransportMock()
+    protocol.connection_made(transport)
+    return server, protocol, transport
+
+
+def run_request(loop, protocol):
+    """Wait for the request in flight to be handled."""
+    # pylint: disable=protected-access
+    loop.run_until_complete(protocol._request_future)
+
+
+def test_crypto_roundtrip():
+    """Test that data encrypted by one side is decrypted by the other."""
+    server_crypto = HAPCrypto(SHARED_KEY)
+    client_crypto = get_client_crypto()
+    data = b"x" * 3000
+
+    encrypted = client_crypto.encrypt(data)
+    server_crypto.receive_data(encrypted[:100])
+    assert server_crypto.decrypt() == b""
+    server_crypto.receive_data(encrypted[100:])
+    assert server_crypto.decrypt() == data
+
+    client_crypto.receive_data(server_crypto.encrypt(b"reply"))
+    assert client_crypto.decrypt() == b"reply"
+
+
+def test_connection_management():
+    """Test that connections are registered and removed."""
+    loop = asyncio.new_event_loop()
+    accessory_handler = Mock()
+    server, protocol, transport = get_protocol(loop, accessory_handler)
+    assert server.connections == {CLIENT_ADDR: protocol}
+
+    protocol.connection_lost(None)
+    assert server.connections == {}
+    assert transport.closed
+    accessory_handler.unsubscribe_client.assert_called_once_with(CLIENT_ADDR)
+    loop.close()
+
+
+def test_unencrypted_request_is_unauthorized():
+    """Test that requests which require a session are refused before pair verify."""
+    loop = asyncio.new_event_loop()
+    _, protocol, transport = get_protocol(loop, Mock())
+
+    protocol.data_received(b"GET /accessories HTTP/1.1\r\nHost: x\r\n\r\n")
+    run_request(loop, protocol)
+
+    assert len(transport.written) == 1
+    assert transport.written[0].startswith(b"HTTP/1.1 401 Unauthorized\r\n")
+    assert transport.written[0].endswith(b'{"status": -70401}')
+    loop.close()
+
+
+def test_request_limits():
+    """Test that requests over the header or body limits close the connection."""
+    loop = asyncio.new_event_loop()
+    max_header_size = hap_protocol.HAPServerProtocol.MAX_HEADER_SIZE
+    for data in (
+            [b"GET /accessories HTTP/1.1\r\nX: " + b"x" * 1000] * 66,
+            [b"GET /accessories HTTP/1.1\r\n" + b"X: x\r\n" * 101 + b"\r\n"],
+            [b"PUT /characteristics HTTP/1.1\r\nContent-Length: 2000000\r\n\r\n"],
+            [b"PUT /characteristics HTTP/1.1\r\nContent-Length: -1\r\n\r\n"]):
+        _, protocol, transport = get_protocol(loop, Mock())
+        for chunk in data:
+            if not transport.closed:
+                protocol.data_received(chunk)
+        assert transport.closed
+        assert protocol._request_future is None  # pylint: disable=protected-access
+
+    _, protocol, transport = get_protocol(loop, Mock())
+    protocol.data_received(b"GET /accessories HTTP/1.1\r\n")
+    for _ in range(max_header_size // 1000 - 1):
+        protocol.data_received(b"X: " + b"x" * 995 + b"\r\n")
+    protocol.data_received(b"\r\n")
+    assert not transport.closed
+    run_request(loop, protocol)
+    assert transport.written[0].startswith(b"HTTP/1.1 401 Unauthorized\r\n")
+    loop.close()
+
+
+def test_encrypted_request():
+    """Test that a request split over several reads is decrypted and handled."""
+    loop = asyncio.new_event_loop()
+    accessory_handler = Mock()
+    accessory_handler.get_characteristics.return_value = {"characteristics": []}
+    _, protocol, transport = get_protocol(loop, accessory_handler)
+    protocol.hap_crypto = HAPCrypto(SHARED_KEY)
+    protocol.handler.is_encrypted = True
+    client_crypto = get_client_crypto()
+
+    request = client_crypto.encrypt(
+        b"GET /characteristics?id=1.9,2.3 HTTP/1.1\r\nHost: x\r\n\r\n")
+    protocol.data_received(request[:10])
+    assert protocol._request_future is None  # pylint: disable=protected-access
+    protocol.data_received(request[10:])
+    run_request(loop, protocol)
+
+    accessory_handler.get_characteristics.assert_called_with(["1.9", "2.3"])
+    client_crypto.receive_data(b"".join(transport.written))
+    response = client_crypto.decrypt()
+    assert response.startswith(b"HTTP/1.1 207 Multi-Status\r\n")
+    assert json.loads(response.split(b"\r\n\r\n")[1]) == {"characteristics": []}
+    loop.close()
+
+
+def test_set_characteristics_multi_status():
+    """Test that a write is answered with 207 only if a characteristic failed."""
+    accessory_handler = Mock()
+    handler = hap_protocol.HAPConnectionHandler(Mock(), CLIENT_ADDR, accessory_handler)
+    handler.is_encrypted = True
+    body = b'{"characteristics": [{"aid": 1, "iid": 9, "value": 1}]}'
+
+    def _put():
+        return handler.handle_request(
+            "PUT", "/characteristics", {"Content-Length": str(len(body))}, body)
+
+    accessory_handler.set_characteristics.return_value = None
+    assert _put().startswith(b"HTTP/1.1 204 No Content\r\n")
+
+    statuses = {"characteristics": [{"aid": 1, "iid": 9, "status": 0}]}
+    accessory_handler.set_characteristics.return_value = statuses
+    assert _put().startswith(b"HTTP/1.1 204 No Content\r\n")
+
+    statuses["characteristics"][0]["status"] = -70402
+    response = _put()
+    assert response.startswith(b"HTTP/1.1 207 Multi-Status\r\n")
+    assert json.loads(response.split(b"\r\n\r\n")[1]) == statuses
+
+
+def test_request_duration():
+    """Test that the duration of every request is recorded per path."""
+    accessory_handler = Mock()
+    accessory_handler.request_duration = MetricsRegistry().histogram(
+        "hap_request_duration_seconds", "Request duration.", ("method", "path"))
+    accessory_handler.get_accessories_json.return_value = b'{"accessories": []}'
+    handler = hap_protocol.HAPConnectionHandler(Mock(), CLIENT_ADDR, accessory_handler)
+    handler.is_encrypted = True
+    handler.handle_request("GET", "/accessories", {}, b"")
+    handler.handle_request("GET", "/characteristics?id=1.9", {}, b"")
+
+    samples = {labels: value for name, labels, value
+               in accessory_handler.request_duration.samples()
+               if name.endswith("_count")}
+    assert samples == {'{method="GET",path="/accessories"}': 1,
+                       '{method="GET",path="/characteristics"}': 1}
+
+
+def test_upgrade_to_encrypted():
+    """Test that the pair verify response is sent in plain text and what follows
+    is encrypted."""
+    loop = asyncio.new_event_loop()
+    accessory_handler = Mock()
+    accessory_handler.get_accessories_json.return_value = b'{"accessories": []}'
+    _, protocol, transport = get_protocol(loop, accessory_handler)
+    client_crypto = get_client_crypto()
+
+    def _pair_verify(handler):
+        handler.enc_context = {"shared_key": SHARED_KEY}
+        handler.send_response(200)
+        handler._upgrade_reader_to_encrypted()  # pylint: disable=protected-access
+        handler.end_response(b"verified")
+        handler._upgrade_writer_to_encrypted()  # pylint: disable=protected-access
+
+    with patch.object(hap_protocol.HAPConnectionHandler, "handle_pair_verify",
+                      _pair_verify):
+        # The next request arrives encrypted in the same read
+        protocol.data_received(
+            b"POST /pair-verify HTTP/1.1\r\nContent-Length: 0\r\n\r\n"
+            + client_crypto.encrypt(b"GET /accessories HTTP/1.1\r\n\r\n"))
+        run_request(loop, protocol)
+
+    assert transport.written[0].startswith(b"HTTP/1.1 200 OK\r\n")
+    assert transport.written[0].endswith(b"verified")
+
+    run_request(loop, protocol)
+    client_crypto.receive_data(transport.written[1])
+    assert client_crypto.decrypt().endswith(b'{"accessories": []}')
+    loop.close()
+
+
+def test_push_event():
+    """Test that events are only pushed to connected clients."""
+    loop = asyncio.new_event_loop()
+    server, _, transport = get_protocol(loop, Mock())
+
+    assert server.push_event(b"data", ("192.168.1.2", 1234)) is False
+    assert server.push_event(b"data", CLIENT_ADDR) is True
+    loop.run_until_complete(asyncio.sleep(0))
+    assert transport.written == [HAPServer.create_hap_event(b"data")]
+    loop.close()
+
+
+def test_push_event_backpressure():
+    """Test that events are held back while the transport is paused."""
+    loop = asyncio.new_event_loop()
+    server, protocol, transport = get_protocol(loop, Mock(), event_queue_size=2)
+
+    protocol.pause_writing()
+    for value in (b"1", b"2", b"3"):
+        server.push_event(value, CLIENT_ADDR)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert transport.written == []
+    assert server.get_event_queue_stats() == {
+        CLIENT_ADDR: {"depth": 2, "max_depth": 2, "dropped": 1}}
+
+    protocol.resume_writing()
+    assert transport.written == [HAPServer.create_hap_event(b"2"),
+                                 HAPServer.create_hap_event(b"3")]
+    loop.close()
+
+
+def test_push_event_overflow_disconnect():
+    """Test that a client is disconnected when its queue overflows."""
+    loop = asyncio.new_event_loop()
+    server, protocol, transport = get_protocol(
+        loop, Mock(), event_queue_size=1,
+        event_overflow_policy=EVENT_OVERFLOW_POLICY.DISCONNECT)
+
+    protocol.pause_writing()
+    server.push_event(b"1", CLIENT_ADDR)
+    server.push_event(b"2", CLIENT_ADDR)
+    loop.run_until_complete(asyncio.sleep(0))
+
+    assert transport.closed
+    assert server.push_event(b"3", CLIENT_ADDR) is False
+    loop.close()
+
+
+def get_pair_resume_handler():
+    """Return a connection handler for a paired accessory with a cached session."""
+    accessory_handler = Mock()
+    accessory_handler.state = State(address="127.0.0.1", mac="00:00:00:00:00:00")
+    client_uuid = uuid.uuid1()
+    accessory_handler.state.add_paired_client(client_uuid, b"\x01" * 32)
+    accessory_handler.session_cache = SessionCache()
+    accessory_handler.session_cache.add(b"session1", SHARED_KEY, client_uuid)
+    return hap_protocol.HAPConnectionHandler(Mock(), CLIENT_ADDR, accessory_handler)
+
+
+def pair_resume_request(handler, session_id, request_key):
+    """Send a pair resume request and return the decoded response."""
+    handler_type = hap_protocol.HAPConnectionHandler
+    body = tlv.encode(
+        HAP_TLV_TAGS.SEQUENCE_NUM, b"\x01",
+        HAP_TLV_TAGS.REQUEST_TYPE, handler_type.PRESUME_METHOD,
+        HAP_TLV_TAGS.PUBLIC_KEY, CLIENT_PUBLIC,
+        HAP_TLV_TAGS.SESSION_ID, session_id,
+        HAP_TLV_TAGS.ENCRYPTED_DATA, ChaCha20Poly1305(request_key).encrypt(
+            handler_type.PRESUME_REQUEST_NONCE, b"", b""))
+    response = handler.handle_request(
+        "POST", "/pair-verify", {"Content-Length": str(len(body))}, body)
+    return tlv.decode(response.split(b"\r\n\r\n", 1)[1])
+
+
+def test_pair_resume():
+    """Test that a cached session is resumed with a new session ID and key."""
+    handler_type = hap_protocol.HAPConnectionHandler
+    handler = get_pair_resume_handler()
+    request_key = hap_hkdf(SHARED_KEY, CLIENT_PUBLIC + b"session1",
+                           handler_type.PRESUME_REQUEST_INFO)
+
+    response = pair_resume_request(handler, b"session1", request_key)
+
+    new_session_id = response[HAP_TLV_TAGS.SESSION_ID]
+    salt = CLIENT_PUBLIC + new_session_id
+    response_key = hap_hkdf(SHARED_KEY, salt, handler_type.PRESUME_RESPONSE_INFO)
+    ChaCha20Poly1305(response_key).decrypt(
+        handler_type.PRESUME_RESPONSE_NONCE,
+        bytes(response[HAP_TLV_TAGS.ENCRYPTED_DATA]), b"")
+    new_shared_key = hap_hkdf(SHARED_KEY, salt,
+                              handler_type.PRESUME_SHARED_SECRET_INFO)
+    assert handler.shared_key == new_shared_key
+    assert handler.is_encrypted
+    # The old session is used up and the new one can be resumed
+    session_cache = handler.accessory_handler.session_cache
+    assert session_cache.pop(b"session1") is None
+    assert session_cache.pop(new_session_id)[0] == new_shared_key
+
+
+def test_pair_resume_falls_back_to_pair_verify():
+    """Test that a failed pair resume continues with a full pair verify."""
+    handler_type = hap_protocol.HAPConnectionHandler
+    handler = get_pair_resume_handler()
+    request_key = hap_hkdf(SHARED_KEY, CLIENT_PUBLIC + b"session2",
+                           handler_type.PRESUME_REQUEST_INFO)
+
+    # Unknown session
+    response = pair_resume_request(handler, b"session2", request_key)
+    assert response[HAP_TLV_TAGS.SEQUENCE_NUM] == b"\x02"
+    assert HAP_TLV_TAGS.PUBLIC_KEY in response
+    assert HAP_TLV_TAGS.SESSION_ID not in response
+
+    # Wrong key
+    response = pair_resume_request(handler, b"session1", request_key)
+    assert HAP_TLV_TAGS.PUBLIC_KEY in response
+    assert handler.shared_key is None
+    assert not handler.is_encrypted
+
+
+def test_pair_resume_failed_keeps_session():
+    """Test that a request that fails authentication does not discard the session."""
+    handler_type = hap_protocol.HAPConnectionHandler
+    request_key = hap_hkdf(SHARED_KEY, CLIENT_PUBLIC + b"session1",
+                           handler_type.PRESUME_REQUEST_INFO)
+    handler = get_pair_resume_handler()
+    accessory_handler = handler.accessory_handler
+
+    response = pair_resume_request(handler, b"session1", b"\x00" * 32)
+    assert HAP_TLV_TAGS.SESSION_ID not in response
+
+    # A request without a public key also falls back to pair verify
+    assert handler._pair_resume({  # pylint: disable=protected-access
+        HAP_TLV_TAGS.SEQUENCE_NUM: b"\x01",
+        HAP_TLV_TAGS.REQUEST_TYPE: handler_type.PRESUME_METHOD,
+        HAP_TLV_TAGS.SESSION_ID: b"session1"}) is False
+
+    # The controller can still resume its session
+    handler = hap_protocol.HAPConnectionHandler(Mock(), CLIENT_ADDR, accessory_handler)
+    response = pair_resume_request(handler, b"session1", request_key)
+    assert HAP_TLV_TAGS.SESSION_ID in response
+    assert handler.is_encrypted
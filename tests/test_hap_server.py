@@ -1,5 +1,7 @@
 """Tests for the HAPServer."""
+import queue
 from socket import timeout
+import threading
 from unittest.mock import Mock, MagicMock, patch
 
 import pytest
@@ -25,6 +27,7 @@ def test_finish_request_pops_socket():
     server.finish_request(amock, client_addr)
 
     assert len(server.connections) == 0
+    amock.unsubscribe_client.assert_called_with(client_addr)
 
     # Negative case: The request fails with a timeout
     def raises(*args):
@@ -124,3 +127,82 @@ def test_http_204_has_no_content_length():
         assert handler.connection.getsent() == [[b"HTTP/1.1 204 No Content\r\n\r\n"]]
         assert handler._headers_buffer == []  # pylint: disable=protected-access
         assert handler.wfile.called_once()
+
+
+def test_client_event_queue_drop_oldest():
+    """Test that the oldest event is dropped when the queue is full."""
+    event_queue = hap_server.ClientEventQueue(2)
+    for data in (b"1", b"2", b"3"):
+        assert event_queue.put(data, ["1.9"])
+
+    assert event_queue.get_stats() == {"depth": 2, "max_depth": 2, "dropped": 1}
+    assert event_queue.get() == b"2"
+    assert event_queue.get_nowait() == b"3"
+    assert event_queue.get_nowait() is None
+
+
+def test_client_event_queue_coalesce():
+    """Test that queued events superseded by the new event are dropped first."""
+    event_queue = hap_server.ClientEventQueue(
+        3, hap_server.EVENT_OVERFLOW_POLICY.COALESCE)
+    event_queue.put(b"1", ["1.9"])
+    event_queue.put(b"2", ["1.10"])
+    event_queue.put(b"3", ["1.9"])
+    event_queue.put(b"4", ["1.9", "1.11"])
+
+    assert event_queue.get_stats()["dropped"] == 2
+    assert event_queue.get() == b"2"
+    assert event_queue.get() == b"4"
+
+
+def test_client_event_queue_disconnect():
+    """Test that put fails when the queue is full or closed."""
+    event_queue = hap_server.ClientEventQueue(
+        1, hap_server.EVENT_OVERFLOW_POLICY.DISCONNECT)
+    assert event_queue.put(b"1")
+    assert not event_queue.put(b"2")
+
+    event_queue.close()
+    assert event_queue.get() is None
+    assert not event_queue.put(b"3")
+
+
+@patch("pyhap.hap_server.HAPServer.server_bind", new=MagicMock())
+@patch("pyhap.hap_server.HAPServer.server_activate", new=MagicMock())
+def test_push_event_is_written_by_client_writer():
+    """Test that a blocked client does not delay the events of another."""
+    client1 = ("192.168.1.1", 55555)
+    client2 = ("192.168.1.2", 55555)
+    blocked = threading.Event()
+    sent = queue.Queue()
+
+    sock1 = Mock()
+    sock1.sendall.side_effect = lambda data: blocked.wait()
+    sock2 = Mock()
+    sock2.sendall.side_effect = sent.put
+
+    server = hap_server.HAPServer(("", 51826), Mock())
+    server.connections = {client1: sock1, client2: sock2}
+
+    assert server.push_event(b"data", client1)
+    assert server.push_event(b"data", client2)
+    assert sent.get(timeout=1) == hap_server.HAPServer.create_hap_event(b"data")
+    assert server.push_event(b"data", ("192.168.1.3", 55555)) is False
+
+    server.server_close()
+    blocked.set()
+    assert server.event_queues == {}
+
+
+def test_handshake_keys_are_derived_once():
+    """Test that the keys and ciphers of a handshake are derived once and reused."""
+    keys = hap_server.HandshakeKeys(b"\x01" * 32)
+    with patch("pyhap.hap_server.hap_hkdf", wraps=hap_server.hap_hkdf) as mock_hkdf:
+        cipher = keys.cipher(b"salt", b"info")
+        assert keys.cipher(b"salt", b"info") is cipher
+        key = keys.key(b"salt", b"info")
+        assert keys.key(b"other", b"info") != key
+    assert mock_hkdf.call_count == 2
+    assert key == hap_server.hap_hkdf(b"\x01" * 32, b"salt", b"info")
+    nonce = b"\x00" * 12
+    assert cipher.decrypt(nonce, cipher.encrypt(nonce, b"data", b""), b"") == b"data"
@@ -11,3 +11,60 @@ def test_iorefs():
     assert sock._io_refs == 1  # pylint: disable=protected-access
     fileio.close()
     assert sock._io_refs == 0  # pylint: disable=protected-access
+
+
+SHARED_KEY = b'\x00' * 32
+
+
+def get_client_crypto():
+    """Return a HAPCrypto with the controller's view of the session keys."""
+    client_crypto = hap_server.HAPCrypto(SHARED_KEY)
+    # pylint: disable=protected-access
+    client_crypto._out_cipher, client_crypto._in_cipher = \
+        client_crypto._in_cipher, client_crypto._out_cipher
+    return client_crypto
+
+
+def test_sendall_frames():
+    """Test that sendall frames the data in blocks the controller can decrypt."""
+    client_crypto = get_client_crypto()
+    writer, reader = socket.socketpair()
+    sock = hap_server.HAPSocket(writer, SHARED_KEY)
+    data = bytes(range(256)) * 9
+
+    assert sock.sendall(memoryview(data)) == len(data)
+    assert sock.sendall(b'') == 0
+    received = reader.recv(4096)
+    # Three blocks of 1024, 1024 and 256 bytes
+    assert len(received) == len(data) + 3 * (2 + 16)
+    client_crypto.receive_data(received)
+    assert client_crypto.decrypt() == data
+    writer.close()
+    reader.close()
+
+
+def test_recv_buffers_frames():
+    """Test that frames split across reads or sharing a read are decrypted."""
+    client_crypto = get_client_crypto()
+    writer, reader = socket.socketpair()
+    sock = hap_server.HAPSocket(reader, SHARED_KEY)
+    data = bytes(range(256)) * 5
+
+    encrypted = client_crypto.encrypt(data) + client_crypto.encrypt(b'second')
+    writer.sendall(encrypted[:3])
+    writer.sendall(encrypted[3:])
+    assert sock.recv(1000) == data[:1000]
+    assert sock.recv(100) == data[1000:1100]
+
+    buffer = bytearray(1000)
+    assert sock.recv_into(buffer, 180) == 180
+    assert buffer[:180] == data[1100:]
+    assert sock.recv_into(buffer, 3) == 3
+    assert buffer[:3] == b'sec'
+    assert sock.recv(0) == b''
+    assert sock.recv(100) == b'ond'
+
+    writer.close()
+    assert sock.recv(100) == b''
+    assert sock.recv_into(buffer) == 0
+    reader.close()
@@ -28,6 +28,7 @@ def test_assign_order_with_remove():
     assert iid_manager.remove_obj(obj_a) == 1
     iid_manager.assign(obj_a)
     assert iid_manager.iids == {obj_a: 2}
+    assert iid_manager.objs == {2: obj_a}
 
 
 def test_get_obj():
@@ -49,6 +50,7 @@ def test_remove_obj():
     iid_manager, obj_a = get_iid_manager()
     assert iid_manager.remove_obj(Mock()) is None
     assert iid_manager.remove_obj(obj_a) == 1
+    assert iid_manager.get_obj(1) is None
 
 
 def test_remove_iid():
@@ -56,3 +58,5 @@ def test_remove_iid():
     iid_manager, obj_a = get_iid_manager()
     assert iid_manager.remove_iid(0) is None
     assert iid_manager.remove_iid(1) == obj_a
+    assert iid_manager.get_iid(obj_a) is None
+    assert iid_manager.remove_iid(1) is None
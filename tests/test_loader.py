@@ -77,3 +77,42 @@ def test_get_loader():
     assert loader.serv_types == loader2.serv_types
 
     assert get_loader() == loader
+
+
+def test_loader_shares_compiled_types():
+    """Test that characteristics of a type share its properties until overridden."""
+    loader = Loader()
+    char1 = loader.get_char('Brightness')
+    char2 = loader.get_char('Brightness')
+    assert char1.type_id is char2.type_id
+    assert char1.properties is char2.properties
+    assert 'UUID' not in char1.properties
+    # pylint: disable=protected-access
+    assert char1._uuid_str is char2._uuid_str
+    assert char1._validator is char2._validator
+
+    with pytest.raises(TypeError):
+        char1.properties['maxValue'] = 50
+    with pytest.raises(TypeError):
+        loader.get_char('TargetHeatingCoolingState').properties['ValidValues']['x'] = 5
+
+    char1.override_properties(properties={'maxValue': 50})
+    assert char1.properties['maxValue'] == 50
+    assert char2.properties['maxValue'] == 100
+    assert loader.get_char('Brightness').properties['maxValue'] == 100
+
+    service = loader.get_service('Lightbulb')
+    assert [char.display_name for char in service.characteristics] == ['On']
+
+
+def test_loaders_do_not_share_types():
+    """Test that changing the types of one loader does not change other loaders."""
+    loader = Loader()
+    loader.char_types['Brightness']['maxValue'] = 50
+    loader.serv_types['Lightbulb']['RequiredCharacteristics'].append('Brightness')
+    assert loader.get_char('Brightness').properties['maxValue'] == 50
+
+    loader2 = Loader()
+    assert loader2.char_types['Brightness']['maxValue'] == 100
+    assert loader2.serv_types['Lightbulb']['RequiredCharacteristics'] == ['On']
+    assert loader2.get_char('Brightness').properties['maxValue'] == 100
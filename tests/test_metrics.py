@@ -0,0 +1,100 @@
+"""Tests for pyhap.metrics."""
+import asyncio
+
+import pytest
+
+from pyhap.metrics import MetricsRegistry, async_start_metrics_server
+
+
+def test_render():
+    """Test that all metric types are rendered in the text exposition format."""
+    registry = MetricsRegistry()
+    counter = registry.counter('requests_total', 'Requests.', ('path',))
+    counter.labels('/accessories').inc()
+    counter.labels('/accessories').inc(2)
+    counter.labels('/say "hi"\n').inc()
+    registry.gauge('connections', 'Connections.', collect=lambda: 3)
+    histogram = registry.histogram('duration_seconds', 'Duration.', buckets=(.1, 1))
+    histogram.observe(.05)
+    histogram.observe(.5)
+    histogram.observe(5)
+
+    assert registry.render().decode() == '\n'.join((
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{path="/accessories"} 3',
+        'requests_total{path="/say \\"hi\\"\\n"} 1',
+        '# HELP connections Connections.',
+        '# TYPE connections gauge',
+        'connections 3',
+        '# HELP duration_seconds Duration.',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{le="0.1"} 1',
+        'duration_seconds_bucket{le="1.0"} 2',
+        'duration_seconds_bucket{le="+Inf"} 3',
+        'duration_seconds_sum 5.55',
+        'duration_seconds_count 3',
+        '',
+    ))
+    assert registry.get_sample_value(
+        'requests_total', {'path': '/accessories'}) == 3
+    assert registry.get_sample_value('duration_seconds_count') == 3
+    assert registry.get_sample_value('unknown') is None
+
+
+def test_register():
+    """Test that a metric is registered once per name."""
+    registry = MetricsRegistry()
+    counter = registry.counter('events_total', 'Events.', ('aid', 'iid'))
+    assert registry.counter('events_total', 'Events.', ('aid', 'iid')) is counter
+    with pytest.raises(ValueError):
+        registry.gauge('events_total', 'Events.')
+    with pytest.raises(ValueError):
+        counter.labels(1)
+    with pytest.raises(ValueError):
+        counter.labels(1, 2).inc(-1)
+
+
+def test_failing_collect():
+    """Test that a metric whose callback fails is left out."""
+    registry = MetricsRegistry()
+    registry.gauge('broken', 'Broken.', collect=lambda: 1 / 0)
+    registry.gauge('queue_size', 'Queue size.', ('client',),
+                   collect=lambda: {('1.2.3.4:5',): 2})
+
+    assert registry.render().decode() == '\n'.join((
+        '# HELP queue_size Queue size.',
+        '# TYPE queue_size gauge',
+        'queue_size{client="1.2.3.4:5"} 2',
+        '',
+    ))
+
+
+def test_metrics_server():
+    """Test that the metrics are served at /metrics only."""
+    loop = asyncio.new_event_loop()
+    registry = MetricsRegistry()
+    registry.counter('events_total', 'Events.').inc()
+
+    async def _get(port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    server = loop.run_until_complete(
+        async_start_metrics_server(registry, loop, '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    try:
+        response = loop.run_until_complete(_get(port, '/metrics'))
+        head, body = response.split(b'\r\n\r\n')
+        assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert body == registry.render()
+
+        response = loop.run_until_complete(_get(port, '/'))
+        assert response.startswith(b'HTTP/1.1 404 Not Found\r\n')
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
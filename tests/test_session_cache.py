@@ -0,0 +1,56 @@
+"""Tests for pyhap.session_cache."""
+from unittest.mock import patch
+from uuid import uuid1
+
+from pyhap.session_cache import SessionCache
+
+
+def test_pop_once():
+    """Test that a session can be resumed only once."""
+    cache = SessionCache()
+    client = uuid1()
+    cache.add(b"session1", b"key1", client)
+
+    assert cache.pop(b"unknown") is None
+    assert cache.get(b"session1") == (b"key1", client)
+    assert cache.pop(b"session1") == (b"key1", client)
+    assert cache.get(b"session1") is None
+    assert cache.pop(b"session1") is None
+
+
+def test_bounded():
+    """Test that the oldest session is dropped when the cache is full."""
+    cache = SessionCache(max_sessions=2)
+    client = uuid1()
+    for session_id in (b"session1", b"session2", b"session3"):
+        cache.add(session_id, b"key", client)
+
+    assert len(cache) == 2
+    assert cache.pop(b"session1") is None
+    assert cache.pop(b"session3") == (b"key", client)
+
+
+def test_ttl():
+    """Test that sessions expire."""
+    cache = SessionCache(ttl=10)
+    client = uuid1()
+    with patch("pyhap.session_cache.time.monotonic", return_value=100):
+        cache.add(b"session1", b"key1", client)
+    with patch("pyhap.session_cache.time.monotonic", return_value=105):
+        cache.add(b"session2", b"key2", client)
+    with patch("pyhap.session_cache.time.monotonic", return_value=111):
+        assert cache.pop(b"session1") is None
+        assert len(cache) == 1
+        assert cache.pop(b"session2") == (b"key2", client)
+
+
+def test_remove_client():
+    """Test that the sessions of an unpaired client are removed."""
+    cache = SessionCache()
+    client1, client2 = uuid1(), uuid1()
+    cache.add(b"session1", b"key1", client1)
+    cache.add(b"session2", b"key2", client2)
+
+    cache.remove_client(client1)
+    assert cache.pop(b"session1") is None
+    assert cache.pop(b"session2") == (b"key2", client2)
@@ -1,8 +1,11 @@
 """Test for pyhap.state."""
+import hashlib
 from unittest.mock import patch
 
 import pytest
 
+from pyhap import hsrp
+from pyhap.params import get_srp_context
 from pyhap.state import State
 
 
@@ -62,3 +65,20 @@ def test_pairing():
     state.remove_paired_client('uuid')
     assert not state.paired
     assert not state.paired_clients
+
+
+def test_srp_verifier_is_cached():
+    """Test that the SRP salt and verifier are derived once per pincode."""
+    ctx = get_srp_context(3072, hashlib.sha512, 16)
+    state = State(address='172.0.0.1', pincode=b'123-45-678')
+
+    salt, verifier = state.get_srp_verifier(b'Pair-Setup', ctx)
+    assert len(salt) == 16
+    assert verifier == hsrp.get_verifier(b'Pair-Setup', b'123-45-678', salt, ctx)
+    assert state.get_srp_verifier(b'Pair-Setup', ctx) == (salt, verifier)
+
+    state.pincode = b'876-54-321'
+    new_salt, new_verifier = state.get_srp_verifier(b'Pair-Setup', ctx)
+    assert new_verifier == hsrp.get_verifier(
+        b'Pair-Setup', b'876-54-321', new_salt, ctx)
+    assert new_verifier != verifier
@@ -0,0 +1,55 @@
+"""Tests for pyhap.tlv module."""
+import pytest
+
+from pyhap import tlv
+
+
+def test_encode_decode():
+    """Test that short values round trip."""
+    data = tlv.encode(b'\x06', b'\x01', b'\x03', b'key', b'\x07', b'')
+    assert data == b'\x06\x01\x01\x03\x03key\x07\x00'
+    assert tlv.decode(data) == {b'\x06': b'\x01', b'\x03': b'key', b'\x07': b''}
+    assert tlv.decode(tlv.encode(b'\x03', b'key', to_base64=True),
+                      from_base64=True) == {b'\x03': b'key'}
+
+
+@pytest.mark.parametrize('length', [255, 256, 510, 600])
+def test_fragments(length):
+    """Test that long values are split into fragments of 255 bytes and merged."""
+    value = bytes(range(256)) * 3
+    value = value[:length]
+    data = tlv.encode(b'\x03', value, b'\x06', b'\x02')
+    assert len(data) == length + 2 * -(-length // 255) + 3
+    assert data[:2] == b'\x03' + bytes((min(length, 255),))
+    assert tlv.decode(data) == {b'\x03': value, b'\x06': b'\x02'}
+    assert [(tag, bytes(value)) for tag, value in tlv.iter_items(data)] == \
+        [(b'\x03', value), (b'\x06', b'\x02')]
+
+
+def test_iter_items_list():
+    """Test that repeated items and separators are returned in order."""
+    data = tlv.encode(b'\x01', b'a', b'\x0b', b'\x01', tlv.SEPARATOR, b'',
+                      b'\x01', b'b', b'\x0b', b'\x00')
+    assert tlv.decode(data)[b'\x01'] == b'ab'
+    assert [(tag, bytes(value)) for tag, value in tlv.iter_items(data)] == [
+        (b'\x01', b'a'), (b'\x0b', b'\x01'), (tlv.SEPARATOR, b''),
+        (b'\x01', b'b'), (b'\x0b', b'\x00')]
+    assert [{tag: bytes(value) for tag, value in group.items()}
+            for group in tlv.iter_groups(data)] == [
+                {b'\x01': b'a', b'\x0b': b'\x01'}, {b'\x01': b'b', b'\x0b': b'\x00'}]
+
+
+def test_iter_items_no_copy():
+    """Test that unfragmented values are views of the data."""
+    data = bytearray(tlv.encode(b'\x01', b'a'))
+    (_, value), = tlv.iter_items(data)
+    data[2:3] = b'b'
+    assert value == b'b'
+
+
+@pytest.mark.parametrize('data', [
+    b'\x01', b'\x01\x02a', b'\x01\xff' + b'a' * 255 + b'\x01'])
+def test_iter_items_truncated(data):
+    """Test that a truncated item raises a ValueError."""
+    with pytest.raises(ValueError):
+        list(tlv.iter_items(data))
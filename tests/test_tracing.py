@@ -0,0 +1,126 @@
+"""Tests for pyhap.tracing."""
+import io
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from pyhap import hap_protocol, tracing
+
+
+@pytest.fixture
+def sink():
+    ring_buffer = tracing.RingBufferSink()
+    tracing.set_sink(ring_buffer)
+    try:
+        yield ring_buffer
+    finally:
+        tracing.set_sink(None)
+
+
+def test_disabled():
+    """Test that nothing is recorded without a sink."""
+    assert tracing.get_sink() is None
+    with tracing.span('noop', key='value') as span:
+        span.set_attribute('other', 1)
+    assert tracing.traced('noop')(lambda x: x + 1)(1) == 2
+
+
+def test_nested_spans(sink):
+    """Test that a span started within another one is its child."""
+    @tracing.traced('inner')
+    def inner():
+        return 1
+
+    with tracing.span('outer', path='/characteristics') as outer:
+        assert inner() == 1
+    with pytest.raises(ValueError):
+        with tracing.span('failed'):
+            raise ValueError
+
+    inner_span, outer_span, failed_span = sink.spans
+    assert outer_span is outer
+    assert inner_span.name == 'inner'
+    assert inner_span.trace_id == outer.trace_id
+    assert inner_span.parent_id == outer.span_id
+    assert outer.parent_id is None
+    assert outer.attributes == {'path': '/characteristics'}
+    assert outer.duration >= inner_span.duration
+    assert failed_span.trace_id != outer.trace_id
+    assert failed_span.error == 'ValueError'
+
+
+def test_json_lines_sink():
+    """Test that spans are written as OTLP/JSON lines."""
+    file = io.StringIO()
+    tracing.set_sink(tracing.JSONLinesSink(file))
+    try:
+        with tracing.span('outer'):
+            with tracing.span('inner', bytes=5):
+                pass
+    finally:
+        tracing.set_sink(None)
+
+    inner, outer = [json.loads(line) for line in file.getvalue().splitlines()]
+    assert inner['name'] == 'inner'
+    assert inner['attributes'] == [{'key': 'bytes', 'value': {'intValue': '5'}}]
+    assert inner['traceId'] == outer['traceId']
+    assert inner['parentSpanId'] == outer['spanId']
+    assert outer['parentSpanId'] == ''
+    assert 'status' not in outer
+    assert int(outer['startTimeUnixNano']) <= int(inner['startTimeUnixNano']) \
+        <= int(inner['endTimeUnixNano']) <= int(outer['endTimeUnixNano'])
+
+
+def test_otlp_encoding(sink):
+    """Test that attributes, errors and export requests use the OTLP/JSON encoding."""
+    with pytest.raises(ValueError):
+        with tracing.span('span', path='/accessories', status=207, ok=True,
+                          duration=0.5, ids=('1.9', 2)):
+            raise ValueError
+    span, = sink.spans
+
+    record = span.to_dict()
+    assert record['attributes'] == [
+        {'key': 'path', 'value': {'stringValue': '/accessories'}},
+        {'key': 'status', 'value': {'intValue': '207'}},
+        {'key': 'ok', 'value': {'boolValue': True}},
+        {'key': 'duration', 'value': {'doubleValue': 0.5}},
+        {'key': 'ids', 'value': {'arrayValue': {'values': [
+            {'stringValue': '1.9'}, {'intValue': '2'}]}}},
+        {'key': 'error.type', 'value': {'stringValue': 'ValueError'}},
+    ]
+    assert record['status'] == {'code': tracing.STATUS_CODE_ERROR}
+
+    request = json.loads(json.dumps(tracing.otlp_request(sink.spans)))
+    resource_spans, = request['resourceSpans']
+    assert resource_spans['resource']['attributes'] == [
+        {'key': 'service.name', 'value': {'stringValue': 'HAP-python'}}]
+    scope_spans, = resource_spans['scopeSpans']
+    assert scope_spans['scope'] == {'name': 'pyhap.tracing'}
+    assert scope_spans['spans'] == [record]
+
+
+def test_failing_sink():
+    """Test that a failing sink does not fail the traced code."""
+    tracing.set_sink(Mock(export=Mock(side_effect=OSError)))
+    try:
+        with tracing.span('span'):
+            pass
+    finally:
+        tracing.set_sink(None)
+
+
+def test_request_span(sink):
+    """Test that a request is recorded with its path and status."""
+    accessory_handler = Mock()
+    accessory_handler.get_accessories_json.return_value = b'{"accessories": []}'
+    handler = hap_protocol.HAPConnectionHandler(Mock(), ('127.0.0.1', 5555),
+                                                accessory_handler)
+    handler.is_encrypted = True
+    handler.handle_request('GET', '/accessories', {}, b'')
+
+    [span] = sink.spans
+    assert span.name == 'hap.request'
+    assert span.attributes == {'method': 'GET', 'path': '/accessories',
+                               'status': 200}